@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+
+"""
+A minimal container for named NumPy arrays: a magic string, a JSON header
+and one 64-byte aligned array after another. Files are read through a
+memory map, so opening one is cheap and only the pages that are used are
+ever loaded.
+"""
+
+import json
+import struct
+from typing import Dict
+
+import numpy as np
+
+
+ALIGNMENT = 64
+
+
+def _align(offset: int) -> int:
+    return -(-offset // ALIGNMENT) * ALIGNMENT
+
+
+def write_arrays(path: str, magic: bytes, arrays: Dict[str, np.ndarray]) -> None:
+    """
+    Writes `arrays` to `path`.
+
+    :param magic: Bytes identifying the kind of file, checked by `read_arrays`.
+    """
+    header: Dict = {"arrays": {}}
+    offset = 0
+    for name, array in arrays.items():
+        offset = _align(offset)
+        header["arrays"][name] = [array.dtype.str, list(array.shape), offset]
+        offset += array.nbytes
+    header_bytes = json.dumps(header).encode()
+    data_start = _align(len(magic) + 8 + len(header_bytes))
+
+    with open(path, "wb") as f:
+        f.write(magic)
+        f.write(struct.pack("<Q", len(header_bytes)))
+        f.write(header_bytes)
+        for name, array in arrays.items():
+            f.seek(data_start + header["arrays"][name][2])
+            f.write(np.ascontiguousarray(array).tobytes())
+
+
+def read_arrays(path: str, magic: bytes) -> Dict[str, np.ndarray]:
+    """
+    Returns the arrays written by `write_arrays` as read-only views into a
+    memory map of `path`.
+    """
+    buffer = np.memmap(path, dtype=np.uint8, mode="r")
+    assert bytes(buffer[: len(magic)]) == magic, "Unexpected file type: {}".format(
+        path
+    )
+    (header_size,) = struct.unpack("<Q", bytes(buffer[len(magic) : len(magic) + 8]))
+    header_end = len(magic) + 8 + header_size
+    header = json.loads(bytes(buffer[len(magic) + 8 : header_end]).decode())
+    data_start = _align(header_end)
+
+    arrays = {}
+    for name, (dtype, shape, offset) in header["arrays"].items():
+        dtype = np.dtype(dtype)
+        count = int(np.prod(shape))
+        start = data_start + offset
+        array = buffer[start : start + count * dtype.itemsize]
+        arrays[name] = array.view(dtype).reshape(shape)
+    return arrays
@@ -3,7 +3,7 @@
 from io import BytesIO
 import os
 import itertools
-from typing import Any, List, Dict, Optional
+from typing import Any, List, Dict, Optional, Tuple
 import traceback
 
 import numpy as np
@@ -84,6 +84,19 @@ class C2(metaclass=C2Meta):
         return C2._net.NextBlob(prefix)
 
 
+def _as_keys(keys) -> np.ndarray:
+    keys = np.asarray(keys)
+    if keys.dtype != np.int32 and keys.dtype != np.int64:
+        keys = keys.astype(np.int64)
+    return keys
+
+
+def _split_by_lengths(array: np.ndarray, lengths: np.ndarray) -> List[np.ndarray]:
+    if len(lengths) == 0:
+        return []
+    return np.split(array, np.cumsum(lengths)[:-1])
+
+
 class StackedArray(object):
     def __init__(self, lengths, values):
         self.lengths = lengths
@@ -91,17 +104,31 @@ class StackedArray(object):
 
     @classmethod
     def from_list_list(cls, d: List[List[float]], blob_prefix: str):
-        lengths_blob = blob_prefix + "_lengths"
-        values_blob = blob_prefix + "_values"
-
-        workspace.FeedBlob(lengths_blob, np.array([len(x) for x in d], dtype=np.int32))
-
-        workspace.FeedBlob(
-            values_blob, np.array(list(itertools.chain(*d)), dtype=np.float32)
+        lengths = np.array([len(x) for x in d], dtype=np.int32)
+        values = np.fromiter(
+            itertools.chain.from_iterable(d), dtype=np.float32, count=lengths.sum()
         )
+        return cls.from_numpy(lengths, values, blob_prefix)
 
+    @classmethod
+    def from_numpy(cls, lengths, values, blob_prefix: str):
+        """
+        Feeds already-stacked arrays: `values` holds every row back to back
+        and `lengths[i]` is the size of row i. No per-element work is done
+        for arrays that already have the right dtype.
+        """
+        lengths_blob = blob_prefix + "_lengths"
+        values_blob = blob_prefix + "_values"
+        workspace.FeedBlob(lengths_blob, np.asarray(lengths, dtype=np.int32))
+        workspace.FeedBlob(values_blob, np.asarray(values, dtype=np.float32))
         return cls(lengths_blob, values_blob)
 
+    def to_numpy(self) -> List[np.ndarray]:
+        """Returns one view into the values per row."""
+        lengths = workspace.FetchBlob(self.lengths)
+        values = workspace.FetchBlob(self.values)
+        return _split_by_lengths(values, lengths)
+
 
 class StackedAssociativeArray(object):
     def __init__(self, lengths, keys, values):
@@ -125,27 +152,57 @@ class StackedAssociativeArray(object):
             retval.append(d)
         return retval
 
+    def to_numpy(self) -> Tuple[List[np.ndarray], List[np.ndarray]]:
+        """
+        Vectorized counterpart of `to_python`: returns per-row views into the
+        keys and values instead of building a dict per row.
+        """
+        keys = workspace.FetchBlob(self.keys)
+        lengths = workspace.FetchBlob(self.lengths)
+        values = workspace.FetchBlob(self.values)
+        return _split_by_lengths(keys, lengths), _split_by_lengths(values, lengths)
+
     @classmethod
     def from_dict_list(cls, d: List[Dict[int, float]], blob_prefix: str):
+        lengths = np.array([len(x) for x in d], dtype=np.int32)
+        num_entries = lengths.sum()
+        keys = np.fromiter(
+            itertools.chain.from_iterable(x.keys() for x in d),
+            dtype=np.int32,
+            count=num_entries,
+        )
+        values = np.fromiter(
+            itertools.chain.from_iterable(x.values() for x in d),
+            dtype=np.float32,
+            count=num_entries,
+        )
+        return cls.from_csr(lengths, keys, values, blob_prefix)
+
+    @classmethod
+    def from_csr(cls, lengths, keys, values, blob_prefix: str):
+        """
+        Feeds CSR triplets: row i owns the next `lengths[i]` entries of `keys`
+        and `values`. Arrays that already have the right dtype are fed
+        without copies or per-element work.
+        """
         lengths_blob = blob_prefix + "_lengths"
         keys_blob = blob_prefix + "_keys"
         values_blob = blob_prefix + "_values"
+        workspace.FeedBlob(lengths_blob, np.asarray(lengths, dtype=np.int32))
+        workspace.FeedBlob(keys_blob, _as_keys(keys))
+        workspace.FeedBlob(values_blob, np.asarray(values, dtype=np.float32))
+        return cls(lengths_blob, keys_blob, values_blob)
 
-        workspace.FeedBlob(lengths_blob, np.array([len(x) for x in d], dtype=np.int32))
-
-        key_list_2d = [list(x.keys()) for x in d]
-        workspace.FeedBlob(
-            keys_blob, np.array(list(itertools.chain(*key_list_2d)), dtype=np.int32)
-        )
-
-        value_list_2d = [list(x.values()) for x in d]
-        workspace.FeedBlob(
-            values_blob,
-            np.array(list(itertools.chain(*value_list_2d)), dtype=np.float32),
+    @classmethod
+    def from_csr_matrix(cls, matrix, blob_prefix: str):
+        """
+        Feeds a `scipy.sparse.csr_matrix` whose column indices are the keys.
+        Explicitly stored zeros are kept.
+        """
+        return cls.from_csr(
+            np.diff(matrix.indptr), matrix.indices, matrix.data, blob_prefix
         )
 
-        return cls(lengths_blob, keys_blob, values_blob)
-
 
 class StackedTwoLevelAssociativeArray(object):
     def __init__(
@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+
+"""
+Columnar binary format for normalization parameters.
+
+The file is a small JSON header followed by one aligned array per
+NormalizationParameters field, so it can be memory-mapped and individual
+features materialized on demand instead of parsing one JSON string per
+feature as `normalization.deserialize` does.
+"""
+
+import logging
+from collections.abc import Mapping
+from typing import Dict
+
+import numpy as np
+from ml.rl.array_file import read_arrays, write_arrays
+from ml.rl.preprocessing import identify_types
+from ml.rl.preprocessing.identify_types import FEATURE_TYPES
+from ml.rl.preprocessing.normalization import (
+    NormalizationParameters,
+    deserialize,
+    serialize,
+)
+
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"RLNORM01"
+
+# Optional scalar fields; None is stored as NaN
+_SCALAR_FIELDS = [
+    "boxcox_lambda",
+    "boxcox_shift",
+    "mean",
+    "stddev",
+    "min_value",
+    "max_value",
+]
+# Optional list fields; stored as offsets + flattened values. None and an
+# empty list are told apart by the `<field>_present` flags.
+_RAGGED_FIELDS = [("possible_values", np.int64), ("quantiles", np.float64)]
+
+
+def _optional_float(value):
+    return np.nan if value is None else float(value)
+
+
+def _feature_names(features):
+    if all(isinstance(f, (int, np.integer)) for f in features):
+        return np.array(features, dtype=np.int64)
+    return np.array([str(f) for f in features])
+
+
+def save(parameters: Dict, path: str) -> None:
+    """
+    Writes a feature -> NormalizationParameters map to `path`.
+    """
+    features = list(parameters.keys())
+    arrays = {
+        "features": _feature_names(features),
+        "feature_type": np.array(
+            [FEATURE_TYPES.index(parameters[f].feature_type) for f in features],
+            dtype=np.uint8,
+        ),
+    }
+    for field in _SCALAR_FIELDS:
+        arrays[field] = np.array(
+            [_optional_float(getattr(parameters[f], field)) for f in features],
+            dtype=np.float64,
+        )
+    for field, dtype in _RAGGED_FIELDS:
+        lists = [getattr(parameters[f], field) for f in features]
+        arrays[field + "_present"] = np.array(
+            [x is not None for x in lists], dtype=np.bool_
+        )
+        lengths = [0 if x is None else len(x) for x in lists]
+        offsets = np.zeros(len(features) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum(lengths)
+        arrays[field + "_offsets"] = offsets
+        arrays[field + "_values"] = np.array(
+            [v for x in lists if x is not None for v in x], dtype=dtype
+        )
+
+    write_arrays(path, MAGIC, arrays)
+
+
+class BinaryNormalizationParameters(Mapping):
+    """
+    Read-only feature -> NormalizationParameters mapping over a file written
+    by `save`. The file is memory-mapped and each NormalizationParameters is
+    built only when it is looked up, so opening a map with many features is
+    cheap and only touches the pages that are used.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._arrays = read_arrays(path, MAGIC)
+        self._features = self._arrays["features"]
+        self._index = None
+        self._check_enum_values()
+
+    def _check_enum_values(self):
+        is_enum = self._arrays["feature_type"] == FEATURE_TYPES.index(
+            identify_types.ENUM
+        )
+        values = self._arrays["possible_values_values"]
+        if not np.any(values < 0):
+            return
+        offsets = self._arrays["possible_values_offsets"]
+        for i in np.flatnonzero(is_enum):
+            possible_values = values[offsets[i] : offsets[i + 1]]
+            if np.any(possible_values < 0):
+                logger.fatal(
+                    "Invalid enum ID in feature: "
+                    + str(self._features[i])
+                    + " with possible_values "
+                    + str(possible_values.tolist())
+                )
+                raise Exception("Invalid enum ID")
+
+    def _feature_index(self):
+        if self._index is None:
+            self._index = {f: i for i, f in enumerate(self._features.tolist())}
+        return self._index
+
+    def _ragged(self, field, i, convert):
+        if not self._arrays[field + "_present"][i]:
+            return None
+        offsets = self._arrays[field + "_offsets"]
+        return [
+            convert(x)
+            for x in self._arrays[field + "_values"][offsets[i] : offsets[i + 1]]
+        ]
+
+    def parameters_at(self, i: int) -> NormalizationParameters:
+        scalars = {}
+        for field in _SCALAR_FIELDS:
+            value = self._arrays[field][i]
+            scalars[field] = None if np.isnan(value) else float(value)
+        return NormalizationParameters(
+            feature_type=FEATURE_TYPES[self._arrays["feature_type"][i]],
+            possible_values=self._ragged("possible_values", i, int),
+            quantiles=self._ragged("quantiles", i, float),
+            **scalars
+        )
+
+    def __getitem__(self, feature) -> NormalizationParameters:
+        return self.parameters_at(self._feature_index()[feature])
+
+    def __iter__(self):
+        return iter(self._features.tolist())
+
+    def __len__(self) -> int:
+        return len(self._features)
+
+    def __contains__(self, feature) -> bool:
+        return feature in self._feature_index()
+
+    def to_dict(self) -> Dict:
+        """Materializes every feature, converting whole columns at once."""
+        columns = {
+            "feature_type": [
+                FEATURE_TYPES[t] for t in self._arrays["feature_type"].tolist()
+            ]
+        }
+        for field in _SCALAR_FIELDS:
+            # NaN is the only value not equal to itself
+            columns[field] = [
+                None if x != x else x for x in self._arrays[field].tolist()
+            ]
+        for field, _ in _RAGGED_FIELDS:
+            offsets = self._arrays[field + "_offsets"].tolist()
+            values = self._arrays[field + "_values"].tolist()
+            columns[field] = [
+                values[offsets[i] : offsets[i + 1]] if present else None
+                for i, present in enumerate(self._arrays[field + "_present"].tolist())
+            ]
+        return {
+            f: NormalizationParameters(*fields)
+            for f, fields in zip(
+                self._features.tolist(),
+                zip(*[columns[field] for field in NormalizationParameters._fields]),
+            )
+        }
+
+
+def load(path: str) -> BinaryNormalizationParameters:
+    return BinaryNormalizationParameters(path)
+
+
+def json_to_binary(parameters_json: Dict, path: str) -> None:
+    """Converts the output of `normalization.serialize` to the binary format."""
+    save(deserialize(parameters_json), path)
+
+
+def binary_to_json(path: str) -> Dict:
+    """Converts a binary file back to the `normalization.serialize` format."""
+    return serialize(load(path).to_dict())
@@ -0,0 +1,291 @@
+#!/usr/bin/env python3
+
+"""
+Monitors the distribution of live features against the normalization
+parameters they were identified with.
+
+Every feature is histogrammed in normalized space, with bins aligned to
+what the parameters promise: CONTINUOUS and BOXCOX features should come
+out standard normal and QUANTILE features uniform over their quantiles.
+PROBABILITY, BINARY and ENUM parameters do not describe a distribution, so
+their expected histogram is taken from the first `reference_rows` rows the
+monitor sees.
+"""
+
+import logging
+import time
+from typing import Dict, List, NamedTuple, Optional
+
+import numpy as np
+from ml.rl.preprocessing import identify_types
+from ml.rl.preprocessing.feature_index import FeatureIndex
+from ml.rl.preprocessing.normalization import NormalizationParameters
+from ml.rl.preprocessing.preprocessor import Preprocessor
+from scipy import stats
+
+
+logger = logging.getLogger(__name__)
+
+# Bin edges of normally distributed features, in standard deviations
+NORMAL_BIN_EDGES = (-2.0, -1.0, -0.5, 0.0, 0.5, 1.0, 2.0)
+NORMAL_BIN_FREQUENCIES = np.diff(
+    stats.norm.cdf(np.concatenate([[-np.inf], NORMAL_BIN_EDGES, [np.inf]]))
+)
+# PROBABILITY features are normalized with a logit, so their edges at
+# 0.1, 0.2, ..., 0.9 are logits too
+_PROBABILITIES = np.linspace(0.1, 0.9, 9)
+PROBABILITY_BIN_EDGES = tuple(np.log(_PROBABILITIES / (1 - _PROBABILITIES)).tolist())
+# Rows of a batch that are histogrammed; the rest are skipped
+DEFAULT_MAX_ROWS_PER_BATCH = 256
+DEFAULT_REFERENCE_ROWS = 10000
+# Floor for bin frequencies in the PSI, so empty bins stay finite
+PSI_EPSILON = 1e-4
+NUM_DRIFTING_FEATURES_TO_LOG = 10
+
+
+class DriftScore(NamedTuple):
+    # Population stability index of the live histogram against the expected
+    psi: float
+    # Largest difference between the live and expected cumulative histograms
+    ks: float
+    num_rows: int
+
+
+class _BinGroup(object):
+    """Normalized columns that share one set of bin edges."""
+
+    def __init__(self, features, columns, edges, expected=None) -> None:
+        self.features = features
+        self.columns = np.array(columns, dtype=np.int64)
+        self.edges = np.array(edges, dtype=np.float32)
+        num_bins = len(edges) + 1
+        self.expected = None if expected is None else np.asarray(expected)
+        self.counts = np.zeros((len(features), num_bins), dtype=np.int64)
+        self.reference = np.zeros((len(features), num_bins), dtype=np.int64)
+
+    def bin(self, matrix):
+        return np.searchsorted(self.edges, matrix[:, self.columns], side="right")
+
+    def add(self, matrix, counts):
+        bins = self.bin(matrix)
+        num_bins = counts.shape[1]
+        flat = bins + np.arange(bins.shape[1]) * num_bins
+        counts += np.bincount(flat.ravel(), minlength=counts.size).reshape(
+            counts.shape
+        )
+
+
+class _OneHotGroup(_BinGroup):
+    """An ENUM feature's one-hot block; the last bin counts all-zero rows."""
+
+    def __init__(self, feature, start, width) -> None:
+        super().__init__([feature], [start], np.arange(width) + 0.5)
+        self.width = width
+
+    def bin(self, matrix):
+        block = matrix[:, self.columns[0] : self.columns[0] + self.width]
+        return np.where(
+            block.max(axis=1) > 0.5, block.argmax(axis=1), self.width
+        ).reshape(-1, 1)
+
+
+class DriftMonitor(object):
+    def __init__(
+        self,
+        normalization_parameters: Dict[str, NormalizationParameters],
+        enum_as_index: bool = False,
+        max_rows_per_batch: int = DEFAULT_MAX_ROWS_PER_BATCH,
+        reference_rows: int = DEFAULT_REFERENCE_ROWS,
+        seed: int = 0,
+    ) -> None:
+        """
+        :param normalization_parameters: Parameters the monitored features
+            were normalized with.
+        :param enum_as_index: Whether normalized matrices passed to
+            `observe_normalized` hold ENUM indices instead of one-hot blocks.
+        :param max_rows_per_batch: Rows sampled from each batch, which bounds
+            the cost of an `observe_*` call independently of the batch size.
+        :param reference_rows: Sampled rows used to build the expected
+            histogram of PROBABILITY, BINARY and ENUM features.
+        """
+        self.normalization_parameters = normalization_parameters
+        self.enum_as_index = enum_as_index
+        self.max_rows_per_batch = max_rows_per_batch
+        self.reference_rows = reference_rows
+        self.feature_index = FeatureIndex.from_normalization(normalization_parameters)
+        self._preprocessor = Preprocessor(True, enum_as_index)
+        self._random = np.random.RandomState(seed)
+        self._groups = self._build_groups()
+
+        self.num_reference_rows = 0
+        # Rows and batches in the live histograms
+        self.num_rows = 0
+        self.num_batches = 0
+        self.seconds = 0.0
+        self._num_observed_batches = 0
+
+    def _build_groups(self) -> List[_BinGroup]:
+        grouped: Dict = {}
+        groups: List[_BinGroup] = []
+        column = 0
+        for feature in self.feature_index.features:
+            parameters = self.normalization_parameters[feature]
+            feature_type = parameters.feature_type
+            expected = None
+            if feature_type in (identify_types.CONTINUOUS, identify_types.BOXCOX):
+                edges = NORMAL_BIN_EDGES
+                expected = NORMAL_BIN_FREQUENCIES
+            elif feature_type == identify_types.QUANTILE:
+                # Normalized values between quantiles k and k + 1 fall in
+                # [k / n, (k + 1) / n)
+                n = len(parameters.quantiles)
+                edges = tuple(k / float(n) for k in range(1, n - 1))
+                expected = np.full(len(edges) + 1, 1.0 / (len(edges) + 1))
+            elif feature_type == identify_types.PROBABILITY:
+                edges = PROBABILITY_BIN_EDGES
+            elif feature_type == identify_types.BINARY:
+                edges = (0.5,)
+            elif feature_type == identify_types.ENUM:
+                num_values = len(parameters.possible_values)
+                if self.enum_as_index:
+                    edges = tuple(k + 0.5 for k in range(num_values))
+                else:
+                    groups.append(_OneHotGroup(feature, column, num_values))
+                    column += num_values
+                    continue
+            else:
+                raise NotImplementedError(
+                    "Invalid feature type: {}".format(feature_type)
+                )
+            key = (feature_type, edges)
+            if key not in grouped:
+                grouped[key] = ([], [], edges, expected)
+            grouped[key][0].append(feature)
+            grouped[key][1].append(column)
+            column += 1
+        for features, columns, edges, expected in grouped.values():
+            groups.append(_BinGroup(features, columns, edges, expected))
+        self.num_output_features = column
+        return groups
+
+    def _sample_rows(self, num_rows: int) -> Optional[np.ndarray]:
+        if num_rows <= self.max_rows_per_batch:
+            return None
+        # Sampling with replacement keeps this O(max_rows_per_batch)
+        return np.unique(self._random.randint(0, num_rows, self.max_rows_per_batch))
+
+    def observe_normalized(self, matrix) -> None:
+        """
+        Histograms a (rows, num_output_features) normalized matrix, e.g. the
+        states of a TrainingDataPage.
+        """
+        start_time = time.time()
+        matrix = np.asarray(matrix)
+        rows = self._sample_rows(matrix.shape[0])
+        if rows is not None:
+            matrix = matrix[rows]
+        self._add(matrix)
+        self.seconds += time.time() - start_time
+
+    def observe_sparse(self, lengths, keys, values) -> None:
+        """
+        Normalizes and histograms raw (lengths, keys, values) sparse rows, as
+        fed to `RLPredictor.predict`.
+        """
+        start_time = time.time()
+        lengths = np.asarray(lengths)
+        keys = np.asarray(keys)
+        values = np.asarray(values)
+        rows = self._sample_rows(len(lengths))
+        if rows is not None:
+            selected = np.zeros(len(lengths), dtype=np.bool_)
+            selected[rows] = True
+            entries = np.repeat(selected, lengths)
+            lengths, keys, values = lengths[rows], keys[entries], values[entries]
+        matrix = self._preprocessor.normalize_sparse_matrix(
+            lengths,
+            keys,
+            values,
+            self.normalization_parameters,
+            feature_index=self.feature_index,
+        )
+        self._add(matrix)
+        self.seconds += time.time() - start_time
+
+    def observe_page(self, tdp) -> None:
+        self.observe_normalized(tdp.states)
+
+    def _add(self, matrix) -> None:
+        assert (
+            matrix.shape[1] == self.num_output_features
+        ), "Expected {} normalized columns, got {}".format(
+            self.num_output_features, matrix.shape[1]
+        )
+        self._num_observed_batches += 1
+        if self.num_reference_rows < self.reference_rows:
+            num_reference = self.reference_rows - self.num_reference_rows
+            reference, matrix = matrix[:num_reference], matrix[num_reference:]
+            self.num_reference_rows += len(reference)
+            for group in self._groups:
+                if group.expected is None:
+                    group.add(reference, group.reference)
+            # The rest of the batch is histogrammed as live rows
+            if len(matrix) == 0:
+                return
+        self.num_rows += len(matrix)
+        self.num_batches += 1
+        for group in self._groups:
+            group.add(matrix, group.counts)
+
+    def drift_scores(self) -> Dict[str, DriftScore]:
+        """
+        Returns feature -> DriftScore for the rows observed after the
+        reference rows.
+        """
+        scores = {}
+        for group in self._groups:
+            for i, feature in enumerate(group.features):
+                if group.expected is not None:
+                    expected = group.expected
+                else:
+                    reference = group.reference[i]
+                    expected = reference / max(1, reference.sum())
+                counts = group.counts[i]
+                actual = counts / max(1, counts.sum())
+                floored_actual = np.maximum(actual, PSI_EPSILON)
+                floored_expected = np.maximum(expected, PSI_EPSILON)
+                psi = np.sum(
+                    (floored_actual - floored_expected)
+                    * np.log(floored_actual / floored_expected)
+                )
+                ks = np.max(np.abs(np.cumsum(actual) - np.cumsum(expected)))
+                scores[feature] = DriftScore(float(psi), float(ks), int(counts.sum()))
+        return scores
+
+    def seconds_per_batch(self) -> float:
+        """Average time spent in the `observe_*` calls."""
+        return self.seconds / max(1, self._num_observed_batches)
+
+    def reset(self) -> None:
+        """Clears the live histograms, keeping the reference ones."""
+        for group in self._groups:
+            group.counts[:] = 0
+        self.num_rows = 0
+        self.num_batches = 0
+
+    def log_report(self) -> Dict[str, DriftScore]:
+        scores = self.drift_scores()
+        logger.info(
+            "Drift over {} rows, {:.2f}ms per batch. Top features by PSI:".format(
+                self.num_rows, 1000 * self.seconds_per_batch()
+            )
+        )
+        for feature in sorted(scores, key=lambda f: -scores[f].psi)[
+            :NUM_DRIFTING_FEATURES_TO_LOG
+        ]:
+            logger.info(
+                "Feature {}: PSI {:.4f} KS {:.4f}".format(
+                    feature, scores[feature].psi, scores[feature].ks
+                )
+            )
+        return scores
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+
+import logging
+from typing import Dict, List
+
+import numpy as np
+from ml.rl.preprocessing.normalization import (
+    MISSING_VALUE,
+    NormalizationParameters,
+    sort_features_by_normalization,
+)
+
+
+logger = logging.getLogger(__name__)
+
+
+class FeatureIndex(object):
+    """
+    Maps sparse feature ids to the columns of the dense matrix
+    `normalize_sparse_matrix` produces (features grouped by type, see
+    `sort_features_by_normalization`).
+
+    The ids are kept in a sorted array, so a lookup is one vectorized
+    binary search for any number of keys, and the index can be built once
+    per normalization map and saved next to it.
+    """
+
+    def __init__(self, features: List[str], feature_ids: np.ndarray) -> None:
+        """
+        :param features: Feature names in column order.
+        :param feature_ids: int64 id of each feature, in column order.
+        """
+        self.features = features
+        self.feature_ids = np.asarray(feature_ids, dtype=np.int64)
+        self._columns_by_id = np.argsort(self.feature_ids, kind="stable")
+        self._sorted_ids = self.feature_ids[self._columns_by_id]
+
+    @classmethod
+    def from_normalization(
+        cls, normalization_parameters: Dict[str, NormalizationParameters]
+    ) -> "FeatureIndex":
+        sorted_features, _ = sort_features_by_normalization(normalization_parameters)
+        return cls(
+            sorted_features,
+            np.array([int(feature) for feature in sorted_features], dtype=np.int64),
+        )
+
+    def __len__(self) -> int:
+        return len(self.feature_ids)
+
+    def lookup(self, keys):
+        """
+        Returns (columns, known): the column of every key, and a mask of the
+        keys that are in the index. Columns of unknown keys are meaningless.
+        """
+        keys = np.asarray(keys, dtype=np.int64)
+        if len(self._sorted_ids) == 0:
+            return np.zeros(len(keys), dtype=np.int64), np.zeros(len(keys), np.bool_)
+        positions = np.minimum(
+            np.searchsorted(self._sorted_ids, keys), len(self._sorted_ids) - 1
+        )
+        known = self._sorted_ids[positions] == keys
+        return self._columns_by_id[positions], known
+
+    def densify(self, lengths, keys, values, missing_value=MISSING_VALUE):
+        """
+        Scatters (lengths, keys, values) sparse rows into a dense float32
+        matrix with one column per feature. Keys not in the index are
+        dropped; absent features are filled with `missing_value`.
+        """
+        lengths = np.asarray(lengths)
+        values = np.asarray(values, dtype=np.float32)
+        columns, known = self.lookup(keys)
+        rows = np.repeat(np.arange(len(lengths)), lengths)
+
+        dense = np.full((len(lengths), len(self)), missing_value, dtype=np.float32)
+        dense[rows[known], columns[known]] = values[known]
+        return dense
+
+    def save(self, path: str) -> None:
+        np.savez(
+            path, features=np.array(self.features), feature_ids=self.feature_ids
+        )
+
+    @classmethod
+    def load(cls, path: str) -> "FeatureIndex":
+        with np.load(path) as data:
+            return cls(data["features"].tolist(), data["feature_ids"])
@@ -0,0 +1,236 @@
+#!/usr/bin/env python3
+
+"""
+Pruning of redundant features after normalization parameters have been
+identified.
+
+Constant features carry no information, exact duplicates and (near)
+collinear CONTINUOUS features carry the information of a feature that is
+kept. Dropping them shrinks the normalization map, and with it the input
+layer of the models and the cost of preprocessing. Every dropped feature
+gets a `FeatureAlias` recording how to rebuild it from the kept ones.
+"""
+
+import logging
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+from ml.rl.preprocessing import identify_types
+from ml.rl.preprocessing.normalization import MISSING_VALUE
+
+
+logger = logging.getLogger(__name__)
+
+# Rows sampled to find duplicate and collinear candidates. Candidates are
+# always verified on every row before a feature is dropped.
+DEFAULT_SKETCH_ROWS = 4096
+# Minimum |correlation| for a CONTINUOUS feature to be dropped as collinear
+DEFAULT_COLLINEAR_THRESHOLD = 0.9999
+
+
+class FeatureAlias(NamedTuple):
+    """
+    A pruned feature equals `scale * values[source] + offset`. Constant
+    features have no source.
+    """
+
+    source: Optional[str]
+    scale: float
+    offset: float
+
+
+def _as_matrix(feature_values, features):
+    if isinstance(feature_values, dict):
+        if features is None:
+            features = list(feature_values.keys())
+        matrix = np.stack(
+            [np.asarray(feature_values[f]).ravel() for f in features], axis=1
+        )
+    else:
+        matrix = np.asarray(feature_values)
+        assert matrix.ndim == 2, "Expected a (rows, features) matrix"
+        if features is None:
+            features = list(range(matrix.shape[1]))
+    assert len(features) == matrix.shape[1], "One name per column is required"
+    return features, matrix
+
+
+def _is_missing(values):
+    return np.abs(values - MISSING_VALUE) < 1e-4
+
+
+def _find_duplicates(matrix, sketch, candidates, features, normalization_parameters):
+    """
+    Groups the candidate columns whose sampled rows are identical, then
+    keeps the first column of each group and aliases the exact copies.
+    """
+    aliases = {}
+    if len(candidates) < 2:
+        return aliases
+    _, first, inverse = np.unique(
+        sketch.T, axis=0, return_index=True, return_inverse=True
+    )
+    inverse = inverse.ravel()
+    for j in np.flatnonzero(first[inverse] != np.arange(len(candidates))):
+        kept = candidates[first[inverse[j]]]
+        dropped = candidates[j]
+        if normalization_parameters[features[kept]] == normalization_parameters[
+            features[dropped]
+        ] and np.array_equal(matrix[:, kept], matrix[:, dropped]):
+            aliases[features[dropped]] = FeatureAlias(features[kept], 1.0, 0.0)
+    return aliases
+
+
+def _find_collinear(matrix, sketch, candidates, features, threshold):
+    """
+    Greedily drops CONTINUOUS columns whose correlation with an earlier kept
+    column is at least `threshold`, using the correlation matrix of the
+    sampled rows to pick the pairs worth checking on every row. Columns with
+    missing values are never aliased, as their missing rows would differ.
+    """
+    aliases = {}
+    sample = sketch.astype(np.float64)
+    stddevs = sample.std(axis=0)
+    usable = (stddevs > 0) & ~np.any(_is_missing(sample), axis=0)
+    candidates = candidates[usable]
+    if len(candidates) < 2:
+        return aliases
+    sample = sample[:, usable]
+    standardized = (sample - sample.mean(axis=0)) / stddevs[usable]
+    correlation = standardized.T @ standardized / sample.shape[0]
+
+    dropped = np.zeros(len(candidates), dtype=np.bool_)
+    for a in range(len(candidates)):
+        if dropped[a]:
+            continue
+        x = None
+        for b in np.flatnonzero(np.abs(correlation[a, a + 1 :]) >= threshold):
+            b += a + 1
+            if dropped[b]:
+                continue
+            if x is None:
+                x = matrix[:, candidates[a]].astype(np.float64)
+                if np.any(_is_missing(x)):
+                    break
+            y = matrix[:, candidates[b]].astype(np.float64)
+            if np.any(_is_missing(y)) or np.std(y) == 0:
+                continue
+            if abs(np.corrcoef(x, y)[0, 1]) < threshold:
+                continue
+            scale, offset = np.polyfit(x, y, 1)
+            aliases[features[candidates[b]]] = FeatureAlias(
+                features[candidates[a]], float(scale), float(offset)
+            )
+            dropped[b] = True
+    return aliases
+
+
+def prune_features(
+    feature_values,
+    normalization_parameters: Dict,
+    features: Optional[List] = None,
+    collinear_threshold: float = DEFAULT_COLLINEAR_THRESHOLD,
+    sketch_rows: int = DEFAULT_SKETCH_ROWS,
+    seed: int = 0,
+) -> Tuple[Dict, Dict]:
+    """
+    Finds constant, duplicate and collinear features.
+
+    :param feature_values: Either a 2-D (rows, features) matrix or a dict
+        mapping feature -> 1-D array of values, with the same rows for
+        every feature.
+    :param normalization_parameters: Mapping feature ->
+        NormalizationParameters identified from `feature_values`.
+    :param features: Feature names. Defaults to the dict keys or to the
+        column indices of the matrix.
+    :param collinear_threshold: Minimum |correlation| for a CONTINUOUS
+        feature to be aliased to another one. Values above 1 disable the
+        collinearity check.
+    :param sketch_rows: Rows sampled to find candidates.
+    :returns: (pruned normalization parameters, alias table mapping each
+        dropped feature -> FeatureAlias).
+    """
+    features, matrix = _as_matrix(feature_values, features)
+    num_rows = matrix.shape[0]
+    if num_rows == 0:
+        return dict(normalization_parameters), {}
+
+    aliases: Dict = {}
+    mins = matrix.min(axis=0)
+    is_constant = mins == matrix.max(axis=0)
+    for i in np.flatnonzero(is_constant):
+        aliases[features[i]] = FeatureAlias(None, 0.0, float(mins[i]))
+
+    if num_rows > sketch_rows:
+        rows = np.sort(
+            np.random.RandomState(seed).choice(num_rows, sketch_rows, replace=False)
+        )
+        sketch = matrix[rows]
+    else:
+        sketch = matrix
+    candidates = np.flatnonzero(~is_constant)
+    aliases.update(
+        _find_duplicates(
+            matrix,
+            sketch[:, candidates],
+            candidates,
+            features,
+            normalization_parameters,
+        )
+    )
+
+    candidates = np.array(
+        [
+            i
+            for i in candidates
+            if features[i] not in aliases
+            and normalization_parameters[features[i]].feature_type
+            == identify_types.CONTINUOUS
+        ],
+        dtype=np.int64,
+    )
+    collinear = _find_collinear(
+        matrix, sketch[:, candidates], candidates, features, collinear_threshold
+    )
+    # Duplicates of a feature dropped as collinear follow it to its source
+    for feature, alias in aliases.items():
+        if alias.source in collinear:
+            source = collinear[alias.source]
+            aliases[feature] = FeatureAlias(
+                source.source,
+                alias.scale * source.scale,
+                alias.scale * source.offset + alias.offset,
+            )
+    aliases.update(collinear)
+
+    pruned = {
+        feature: parameters
+        for feature, parameters in normalization_parameters.items()
+        if feature not in aliases
+    }
+    logger.info(
+        "Pruned {} of {} features: {} constant, {} duplicate or collinear".format(
+            len(aliases),
+            len(features),
+            int(np.sum(is_constant)),
+            len(aliases) - int(np.sum(is_constant)),
+        )
+    )
+    return pruned, aliases
+
+
+def restore_pruned_features(feature_values: Dict, aliases: Dict) -> Dict:
+    """
+    Returns a copy of `feature_values` (feature -> 1-D array over the kept
+    features) with the features in `aliases` rebuilt from their sources.
+    """
+    num_rows = len(next(iter(feature_values.values()))) if feature_values else 0
+    restored = dict(feature_values)
+    for feature, alias in aliases.items():
+        if alias.source is None:
+            restored[feature] = np.full(num_rows, alias.offset)
+        else:
+            restored[feature] = (
+                alias.scale * np.asarray(feature_values[alias.source]) + alias.offset
+            )
+    return restored
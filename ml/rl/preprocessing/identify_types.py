@@ -52,3 +52,53 @@ def identify_type(values, enum_threshold=DEFAULT_MAX_UNIQUE_ENUM):
         return CONTINUOUS
     else:
         assert False
+
+
+def _count_distinct_sorted(sorted_columns):
+    if sorted_columns.shape[0] == 0:
+        return np.zeros(sorted_columns.shape[1], dtype=np.int64)
+    return 1 + np.count_nonzero(np.diff(sorted_columns, axis=0), axis=0)
+
+
+def identify_types_dense(matrix, enum_threshold=DEFAULT_MAX_UNIQUE_ENUM):
+    """
+    Columnar version of `identify_type` for a dense (rows, features) matrix.
+
+    Every column gets the same label `identify_type` would give it, but the
+    checks run as a few vectorized passes over the whole matrix.  Distinct
+    values are only counted for columns that could still be an ENUM, and
+    columns that exceed `enum_threshold` distinct values in the first rows
+    are dropped before the full count.
+    """
+    matrix = np.asarray(matrix)
+    assert matrix.ndim == 2, "Expected a (rows, features) matrix"
+    types = np.full(matrix.shape[1], CONTINUOUS, dtype=object)
+
+    mins = np.min(matrix, axis=0)
+    maxs = np.max(matrix, axis=0)
+    is_binary = np.all((matrix == 0) | (matrix == 1), axis=0) | (mins == maxs)
+    is_probability = ~is_binary & (mins >= 0) & (maxs <= 1)
+    types[is_binary] = BINARY
+    types[is_probability] = PROBABILITY
+
+    candidates = np.flatnonzero(~is_binary & ~is_probability & (mins >= 0))
+    if len(candidates) > 0:
+        are_all_ints = np.all(
+            np.isfinite(matrix[:, candidates])
+            & (np.floor(matrix[:, candidates]) == matrix[:, candidates]),
+            axis=0,
+        )
+        candidates = candidates[are_all_ints]
+
+    # Early exit: a column with too many distinct values in a prefix of the
+    # rows can't be an enum, so skip sorting the rest of it.
+    probe_rows = 4 * (enum_threshold + 1)
+    if len(candidates) > 0 and matrix.shape[0] > probe_rows:
+        probe = np.sort(matrix[:probe_rows, candidates], axis=0)
+        candidates = candidates[_count_distinct_sorted(probe) <= enum_threshold]
+
+    if len(candidates) > 0:
+        distinct = _count_distinct_sorted(np.sort(matrix[:, candidates], axis=0))
+        types[candidates[distinct <= enum_threshold]] = ENUM
+
+    return types.tolist()
@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+
+import numpy as np
+from scipy import stats
+
+
+class StreamingMoments(object):
+    """
+    Mergeable accumulator for the first four central moments of a stream.
+
+    Chunks are reduced with numpy and combined with the pairwise update
+    formulas from Pebay (2008), so accumulators built on separate shards can
+    be merged without revisiting the data.
+    """
+
+    __slots__ = ["count", "mean", "m2", "m3", "m4"]
+
+    def __init__(self) -> None:
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.m3 = 0.0
+        self.m4 = 0.0
+
+    def update(self, values) -> "StreamingMoments":
+        values = np.asarray(values, dtype=np.float64).ravel()
+        if len(values) == 0:
+            return self
+        chunk = StreamingMoments()
+        chunk.count = len(values)
+        chunk.mean = float(np.mean(values))
+        deltas = values - chunk.mean
+        squared_deltas = deltas * deltas
+        chunk.m2 = float(np.sum(squared_deltas))
+        chunk.m3 = float(np.dot(squared_deltas, deltas))
+        chunk.m4 = float(np.dot(squared_deltas, squared_deltas))
+        return self.merge(chunk)
+
+    def merge(self, other: "StreamingMoments") -> "StreamingMoments":
+        if other.count == 0:
+            return self
+        if self.count == 0:
+            self.count = other.count
+            self.mean = other.mean
+            self.m2 = other.m2
+            self.m3 = other.m3
+            self.m4 = other.m4
+            return self
+
+        na = float(self.count)
+        nb = float(other.count)
+        n = na + nb
+        delta = other.mean - self.mean
+        delta2 = delta * delta
+
+        m4 = (
+            self.m4
+            + other.m4
+            + delta2 * delta2 * na * nb * (na * na - na * nb + nb * nb) / (n ** 3)
+            + 6.0 * delta2 * (na * na * other.m2 + nb * nb * self.m2) / (n * n)
+            + 4.0 * delta * (na * other.m3 - nb * self.m3) / n
+        )
+        m3 = (
+            self.m3
+            + other.m3
+            + delta * delta2 * na * nb * (na - nb) / (n * n)
+            + 3.0 * delta * (na * other.m2 - nb * self.m2) / n
+        )
+        m2 = self.m2 + other.m2 + delta2 * na * nb / n
+
+        self.count += other.count
+        self.mean += delta * nb / n
+        self.m2 = m2
+        self.m3 = m3
+        self.m4 = m4
+        return self
+
+    def std(self, ddof=0) -> float:
+        if self.count - ddof <= 0:
+            return float("nan")
+        return float(np.sqrt(self.m2 / (self.count - ddof)))
+
+    def skew(self) -> float:
+        """Biased sample skewness, matching `scipy.stats.skew`."""
+        if self.m2 == 0:
+            return 0.0
+        return (self.m3 / self.count) / (self.m2 / self.count) ** 1.5
+
+    def kurtosis(self) -> float:
+        """Biased Pearson kurtosis, matching `scipy.stats.kurtosis(fisher=False)`."""
+        if self.m2 == 0:
+            return 0.0
+        return (self.m4 / self.count) / (self.m2 / self.count) ** 2
+
+
+def normaltest_from_moments(count, skew, kurtosis):
+    """
+    D'Agostino-Pearson K^2 test computed from summary statistics.
+
+    Reproduces `scipy.stats.normaltest` (skewtest + kurtosistest) from the
+    sample size, biased skewness and Pearson kurtosis so that it can run on
+    streaming moments.
+    """
+    n = float(count)
+
+    y = skew * np.sqrt(((n + 1) * (n + 3)) / (6.0 * (n - 2)))
+    beta2 = (
+        3.0
+        * (n * n + 27 * n - 70)
+        * (n + 1)
+        * (n + 3)
+        / ((n - 2.0) * (n + 5) * (n + 7) * (n + 9))
+    )
+    w2 = -1 + np.sqrt(2 * (beta2 - 1))
+    delta = 1 / np.sqrt(0.5 * np.log(w2))
+    alpha = np.sqrt(2.0 / (w2 - 1))
+    if y == 0:
+        y = 1
+    z_skew = delta * np.log(y / alpha + np.sqrt((y / alpha) ** 2 + 1))
+
+    expected = 3.0 * (n - 1) / (n + 1)
+    var_b2 = 24.0 * n * (n - 2) * (n - 3) / ((n + 1) * (n + 1.0) * (n + 3) * (n + 5))
+    x = (kurtosis - expected) / np.sqrt(var_b2)
+    sqrt_beta1 = (
+        6.0
+        * (n * n - 5 * n + 2)
+        / ((n + 7) * (n + 9))
+        * np.sqrt((6.0 * (n + 3) * (n + 5)) / (n * (n - 2) * (n - 3)))
+    )
+    a = 6.0 + 8.0 / sqrt_beta1 * (
+        2.0 / sqrt_beta1 + np.sqrt(1 + 4.0 / (sqrt_beta1 ** 2))
+    )
+    term1 = 1 - 2 / (9.0 * a)
+    denom = 1 + x * np.sqrt(2 / (a - 4.0))
+    if denom == 0.0:
+        term2 = np.nan
+    else:
+        term2 = np.sign(denom) * np.power((1 - 2.0 / a) / np.abs(denom), 1 / 3.0)
+    z_kurtosis = (term1 - term2) / np.sqrt(2 / (9.0 * a))
+
+    k2 = z_skew * z_skew + z_kurtosis * z_kurtosis
+    return k2, stats.chi2.sf(k2, 2)
@@ -1,13 +1,17 @@
 #!/usr/bin/env python3
 
+import hashlib
 import json
 import logging
+import os
+import tempfile
 from collections import namedtuple
 
 import numpy as np
 import six
 from ml.rl.preprocessing import identify_types
-from ml.rl.preprocessing.identify_types import DEFAULT_MAX_UNIQUE_ENUM
+from ml.rl.preprocessing.identify_types import DEFAULT_MAX_UNIQUE_ENUM, FEATURE_TYPES
+from ml.rl.preprocessing.moments import StreamingMoments, normaltest_from_moments
 from scipy import stats
 from scipy.stats.mstats import mquantiles
 
@@ -36,6 +40,14 @@ MISSING_VALUE = -1337.1337
 DEFAULT_QUANTILE_K2_THRESHOLD = 1000.0
 MINIMUM_SAMPLES_TO_IDENTIFY = 20
 DEFAULT_MAX_QUANTILE_SIZE = 20
+BOX_COX_TRANSFORM_CHUNK_SIZE = 1 << 20
+BOX_COX_LAMBDA_STEP = 1e-3
+
+# Storage types for normalized matrices. float16 halves their memory;
+# consumers upcast when they build float32 tensors.
+OUTPUT_DTYPES = (np.float32, np.float16)
+# Largest N such that every integer in [0, N] is exact in float16
+FLOAT16_MAX_EXACT_INT = 2048
 
 
 class NumpyEncoder(json.JSONEncoder):
@@ -58,7 +70,21 @@ def identify_parameter(
     skip_box_cox=False,
     skip_quantiles=False,
     feature_type=None,
+    boxcox_subsample_size=None,
+    fit_info=None,
 ):
+    """
+    Picks a feature type and its normalization parameters from `values`.
+
+    :param boxcox_subsample_size: If set and smaller than `len(values)`, fit
+        the Box-Cox lambda on a stratified subsample of this size instead of
+        the full column. The normality test and the mean/stddev of the
+        transformed values are still computed over the full column, in
+        chunks.
+    :param fit_info: If given, filled with "boxcox_lambda_error", the
+        estimated error of a subsampled lambda vs. the full-data fit (see
+        `fit_boxcox_lambda_subsampled`).
+    """
     if feature_type is None:
         feature_type = identify_types.identify_type(values, max_unique_enum_values)
 
@@ -86,10 +112,25 @@ def identify_parameter(
 
         # shift can be estimated but not in scipy
         boxcox_shift = float(min_value * -1)
-        candidate_values, lmbda = stats.boxcox(
-            np.maximum(values + boxcox_shift, BOX_COX_MARGIN)
-        )
-        k2_boxcox, p_boxcox = stats.normaltest(candidate_values)
+        candidate_moments = None
+        if boxcox_subsample_size is not None and len(values) > boxcox_subsample_size:
+            candidate_values = None
+            lmbda, lambda_error = fit_boxcox_lambda_subsampled(
+                values, boxcox_shift, boxcox_subsample_size
+            )
+            if fit_info is not None:
+                fit_info["boxcox_lambda_error"] = lambda_error
+            candidate_moments = _boxcox_moments(values, boxcox_shift, lmbda)
+            k2_boxcox, p_boxcox = normaltest_from_moments(
+                candidate_moments.count,
+                candidate_moments.skew(),
+                candidate_moments.kurtosis(),
+            )
+        else:
+            candidate_values, lmbda = stats.boxcox(
+                np.maximum(values + boxcox_shift, BOX_COX_MARGIN)
+            )
+            k2_boxcox, p_boxcox = stats.normaltest(candidate_values)
         logger.info(
             "Feature stats.  Original K2: {} P: {} Boxcox K2: {} P: {}".format(
                 k2_original, p_original, k2_boxcox, p_boxcox
@@ -102,14 +143,18 @@ def identify_parameter(
                 # than the original data and is normal enough to apply
                 # effectively.
 
-                stddev = np.std(candidate_values, ddof=1)
+                if candidate_moments is not None:
+                    stddev = candidate_moments.std(ddof=1)
+                else:
+                    stddev = np.std(candidate_values, ddof=1)
                 # Unclear whether this happens in practice or not
                 if (
                     np.isfinite(stddev)
                     and stddev < BOX_COX_MAX_STDDEV
                     and not np.isclose(stddev, 0)
                 ):
-                    values = candidate_values
+                    if candidate_values is not None:
+                        values = candidate_values
                     boxcox_lambda = float(lmbda)
         if boxcox_lambda is None or skip_box_cox:
             boxcox_shift = None
@@ -137,7 +182,13 @@ def identify_parameter(
             )
             logger.info("Feature is non-normal, using quantiles: {}".format(quantiles))
 
-    if (
+    if feature_type == identify_types.BOXCOX and candidate_moments is not None:
+        # The transformed column was never materialized
+        mean = float(candidate_moments.mean)
+        stddev = candidate_moments.std(ddof=1)
+        if np.isclose(stddev, 0) or not np.isfinite(stddev):
+            stddev = 1
+    elif (
         feature_type == identify_types.CONTINUOUS
         or feature_type == identify_types.BOXCOX
     ):
@@ -164,17 +215,197 @@ def identify_parameter(
     )
 
 
-def get_num_output_features(normalization_parmeters):
+def _stratified_subsample(values, sample_size, seed=0):
+    """
+    Draws one value uniformly from each of `sample_size` equal, contiguous
+    blocks of `values`, so ordered logs are covered end to end.
+    """
+    random_state = np.random.RandomState(seed)
+    block_starts = (np.arange(sample_size) * len(values)) // sample_size
+    block_ends = (np.arange(1, sample_size + 1) * len(values)) // sample_size
+    offsets = np.floor(
+        random_state.random_sample(sample_size) * (block_ends - block_starts)
+    ).astype(np.int64)
+    return values[block_starts + offsets]
+
+
+def fit_boxcox_lambda_subsampled(values, boxcox_shift, sample_size):
+    """
+    Fits the Box-Cox lambda on a stratified subsample and estimates how far it
+    is from the full-data maximum likelihood estimate.
+
+    The error is estimated with one Newton step of the full-data
+    log-likelihood around the subsample lambda. The likelihoods are
+    accumulated chunk by chunk, so only the subsample is ever shifted and
+    transformed in full.
+
+    :returns: (lambda, estimated absolute error of lambda). The error is inf
+        if the log-likelihood is not concave around lambda.
+    """
+    sample = _stratified_subsample(values, sample_size)
+    _, lmbda = stats.boxcox(np.maximum(sample + boxcox_shift, BOX_COX_MARGIN))
+
+    lambdas = (lmbda - BOX_COX_LAMBDA_STEP, lmbda, lmbda + BOX_COX_LAMBDA_STEP)
+    llf_low, llf_mid, llf_high = _boxcox_llfs(values, boxcox_shift, lambdas)
+    first_derivative = (llf_high - llf_low) / (2 * BOX_COX_LAMBDA_STEP)
+    second_derivative = (llf_high - 2 * llf_mid + llf_low) / (BOX_COX_LAMBDA_STEP ** 2)
+    if second_derivative < 0:
+        lambda_error = float(abs(first_derivative / second_derivative))
+    else:
+        lambda_error = float("inf")
+    logger.info(
+        "Box-Cox lambda {} fit on {} of {} values, estimated error vs. full "
+        "data fit: {}".format(lmbda, sample_size, len(values), lambda_error)
+    )
+    return lmbda, lambda_error
+
+
+def _boxcox_llfs(values, boxcox_shift, lambdas):
+    """
+    `stats.boxcox_llf` of the shifted column for each of `lambdas`, computed
+    chunk by chunk.
+    """
+    log_sum = 0.0
+    moments = [StreamingMoments() for _ in lambdas]
+    for start in range(0, len(values), BOX_COX_TRANSFORM_CHUNK_SIZE):
+        chunk = np.maximum(
+            values[start : start + BOX_COX_TRANSFORM_CHUNK_SIZE].astype(np.float64)
+            + boxcox_shift,
+            BOX_COX_MARGIN,
+        )
+        log_sum += float(np.sum(np.log(chunk)))
+        for lmbda, lambda_moments in zip(lambdas, moments):
+            lambda_moments.update(stats.boxcox(chunk, lmbda))
+    num_values = len(values)
+    return [
+        (lmbda - 1) * log_sum - num_values / 2.0 * np.log(m.m2 / num_values)
+        for lmbda, m in zip(lambdas, moments)
+    ]
+
+
+def _boxcox_moments(values, boxcox_shift, lmbda):
+    """
+    Moments of the Box-Cox transformed column, computed chunk by chunk so the
+    transformed copy of the column never exists in full.
+    """
+    moments = StreamingMoments()
+    for start in range(0, len(values), BOX_COX_TRANSFORM_CHUNK_SIZE):
+        chunk = values[start : start + BOX_COX_TRANSFORM_CHUNK_SIZE]
+        moments.update(
+            stats.boxcox(np.maximum(chunk + boxcox_shift, BOX_COX_MARGIN), lmbda)
+        )
+    return moments
+
+
+def fingerprint_values(values) -> str:
+    """Content hash of a column, used to key cached parameters."""
+    values = np.ascontiguousarray(values)
+    digest = hashlib.sha1()
+    digest.update("{}:{}".format(values.dtype.str, values.shape).encode())
+    digest.update(values.data)
+    return digest.hexdigest()
+
+
+def identify_parameter_cached(values, cache_dir, **kwargs):
+    """
+    Same as `identify_parameter`, but results are stored under `cache_dir`
+    keyed by the content of `values` and the identification arguments, so
+    unchanged features are not identified again. `fit_info` is only filled
+    when the parameters are identified rather than read from the cache.
+    """
+    key_kwargs = {k: v for k, v in kwargs.items() if k != "fit_info"}
+    digest = hashlib.sha1(fingerprint_values(values).encode())
+    digest.update(json.dumps(key_kwargs, sort_keys=True, cls=NumpyEncoder).encode())
+    cache_path = os.path.join(cache_dir, digest.hexdigest() + ".json")
+
+    if os.path.exists(cache_path):
+        with open(cache_path) as f:
+            return NormalizationParameters(**json.load(f))
+
+    parameters = identify_parameter(values, **kwargs)
+    os.makedirs(cache_dir, exist_ok=True)
+    # Write then rename so concurrent readers never see a partial file
+    fd, tmp_path = tempfile.mkstemp(dir=cache_dir, suffix=".tmp")
+    with os.fdopen(fd, "w") as f:
+        f.write(serialize_one(parameters))
+    os.replace(tmp_path, cache_path)
+    return parameters
+
+
+def get_num_output_features(normalization_parmeters, enum_as_index=False):
+    """
+    Width of the normalized matrix. ENUM features take one column per possible
+    value, or a single index column when `enum_as_index` is set.
+    """
     return sum(
         map(
             lambda np: (
-                len(np.possible_values) if np.feature_type == identify_types.ENUM else 1
+                len(np.possible_values)
+                if np.feature_type == identify_types.ENUM and not enum_as_index
+                else 1
             ),
             normalization_parmeters.values(),
         )
     )
 
 
+def get_enum_index_columns(normalization_parameters, column_offset=0):
+    """
+    For a matrix normalized with `enum_as_index`, returns (column,
+    num_embeddings) for every ENUM feature, in column order. Each column holds
+    the position of the value in `possible_values`, or the reserved index
+    `len(possible_values)` when the value is missing or unknown, so
+    num_embeddings is `len(possible_values) + 1`.
+
+    :param column_offset: Added to every column, for matrices that are
+        concatenated after another one (e.g. actions after states).
+    """
+    sorted_features, _ = sort_features_by_normalization(normalization_parameters)
+    return [
+        (column_offset + i, len(normalization_parameters[feature].possible_values) + 1)
+        for i, feature in enumerate(sorted_features)
+        if normalization_parameters[feature].feature_type == identify_types.ENUM
+    ]
+
+
+def sort_features_by_normalization(normalization_parameters):
+    """
+    Helper function to return a sorted list from a normalization map.
+    Also returns the starting index for each feature type"""
+    # Sort features by feature type
+    sorted_features = []
+    feature_starts = []
+    for feature_type in FEATURE_TYPES:
+        feature_starts.append(len(sorted_features))
+        for feature in normalization_parameters.keys():
+            norm = normalization_parameters[feature]
+            if norm.feature_type == feature_type:
+                sorted_features.append(feature)
+    return sorted_features, feature_starts
+
+
+def get_feature_type_boundaries(features, normalization_parameters):
+    """
+    Returns the index in `features` where each of FEATURE_TYPES starts.
+    `features` must already be sorted by feature type.
+    """
+    feature_starts = []
+    on_feature_type = -1
+    for i, feature in enumerate(features):
+        feature_type = normalization_parameters[feature].feature_type
+        feature_type_index = FEATURE_TYPES.index(feature_type)
+        assert (
+            feature_type_index >= on_feature_type
+        ), "Features are not sorted by feature type!"
+        while feature_type_index > on_feature_type:
+            feature_starts.append(i)
+            on_feature_type += 1
+    while on_feature_type < len(FEATURE_TYPES):
+        feature_starts.append(len(features))
+        on_feature_type += 1
+    return feature_starts
+
+
 def deserialize(parameters_json):
     parameters = {}
     for feature, feature_parameters in six.iteritems(parameters_json):
@@ -208,3 +439,32 @@ def serialize(parameters):
     for feature, feature_parameters in six.iteritems(parameters):
         parameters_json[feature] = serialize_one(feature_parameters)
     return parameters_json
+
+
+def fingerprint_parameters(parameters, features=None) -> str:
+    """
+    Stable content hash of a normalization-parameter dict and, optionally, the
+    feature ordering it is applied with. Equal parameters hash equally across
+    processes regardless of dict insertion order.
+    """
+    parameters_json = {
+        str(feature): json.loads(feature_parameters)
+        for feature, feature_parameters in six.iteritems(serialize(parameters))
+    }
+    digest = hashlib.sha1(
+        json.dumps(parameters_json, sort_keys=True, cls=NumpyEncoder).encode()
+    )
+    if features is not None:
+        digest.update(json.dumps([str(f) for f in features]).encode())
+    return digest.hexdigest()
+
+
+def check_output_dtype(output_dtype):
+    output_dtype = np.dtype(output_dtype).type
+    if output_dtype not in OUTPUT_DTYPES:
+        raise Exception(
+            "Unsupported output dtype {}, expected one of {}".format(
+                output_dtype, OUTPUT_DTYPES
+            )
+        )
+    return output_dtype
@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+
+import logging
+import multiprocessing
+import time
+from multiprocessing.sharedctypes import RawArray
+from typing import Dict, List, Optional
+
+import numpy as np
+from ml.rl.preprocessing.feature_pruning import prune_features
+from ml.rl.preprocessing.normalization import (
+    NormalizationParameters,
+    identify_parameter,
+    identify_parameter_cached,
+)
+
+
+logger = logging.getLogger(__name__)
+
+NUM_SLOWEST_FEATURES_TO_LOG = 10
+
+# Set in each worker by `_init_worker`; the columns are views into this
+# buffer so nothing is copied per feature.
+_worker_columns = None
+
+
+def _init_worker(buffer, dtype, offsets):
+    global _worker_columns
+    flat = np.frombuffer(buffer, dtype=dtype)
+    _worker_columns = [
+        flat[offsets[i] : offsets[i + 1]] for i in range(len(offsets) - 1)
+    ]
+
+
+def _identify_column(task):
+    index, feature_type, cache_dir, kwargs = task
+    start_time = time.time()
+    if cache_dir is None:
+        parameters = identify_parameter(
+            _worker_columns[index], feature_type=feature_type, **kwargs
+        )
+    else:
+        parameters = identify_parameter_cached(
+            _worker_columns[index], cache_dir, feature_type=feature_type, **kwargs
+        )
+    return index, parameters, time.time() - start_time
+
+
+def _columns_from_input(feature_values, features):
+    if isinstance(feature_values, dict):
+        if features is None:
+            features = list(feature_values.keys())
+        columns = [np.asarray(feature_values[f]).ravel() for f in features]
+    else:
+        matrix = np.asarray(feature_values)
+        assert matrix.ndim == 2, "Expected a (rows, features) matrix"
+        if features is None:
+            features = list(range(matrix.shape[1]))
+        assert len(features) == matrix.shape[1], "One name per column is required"
+        columns = [matrix[:, i] for i in range(matrix.shape[1])]
+    return features, columns
+
+
+def _to_shared_buffer(columns):
+    # float32 only if it holds every value exactly; wide integers (e.g. ENUM
+    # ids above 2^24) need float64
+    if all(np.can_cast(c.dtype, np.float32, casting="safe") for c in columns):
+        dtype = np.float32
+    else:
+        dtype = np.float64
+    offsets = np.zeros(len(columns) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(c) for c in columns])
+    buffer = RawArray("d" if dtype == np.float64 else "f", int(offsets[-1]))
+    flat = np.frombuffer(buffer, dtype=dtype)
+    for i, column in enumerate(columns):
+        flat[offsets[i] : offsets[i + 1]] = column
+    return buffer, dtype, offsets.tolist()
+
+
+def identify_parameters(
+    feature_values,
+    features: Optional[List] = None,
+    num_workers: Optional[int] = None,
+    feature_types: Optional[Dict] = None,
+    timings: Optional[Dict] = None,
+    cache_dir: Optional[str] = None,
+    aliases: Optional[Dict] = None,
+    **kwargs
+) -> Dict:
+    """
+    Runs `identify_parameter` for many features at once, fanning them out
+    across a process pool.
+
+    The columns are copied once into a shared-memory buffer which every
+    worker maps zero-copy, so the cost of starting the pool does not depend
+    on the number of features.
+
+    :param feature_values: Either a 2-D (rows, features) matrix or a dict
+        mapping feature -> 1-D array of values.
+    :param features: Feature names. Defaults to the dict keys or to the
+        column indices of the matrix.
+    :param num_workers: Size of the process pool. Defaults to the CPU count;
+        1 runs in-process.
+    :param feature_types: Optional mapping feature -> forced feature type.
+    :param timings: If given, filled with feature -> identification seconds.
+    :param cache_dir: If given, reuse parameters cached on disk for columns
+        whose content has not changed (see `identify_parameter_cached`).
+    :param aliases: If given, constant, duplicate and collinear features are
+        pruned after identification (see `feature_pruning.prune_features`)
+        and this is filled with the alias table of the dropped features,
+        which are left out of the result. Every feature must have the same
+        number of rows.
+    :param kwargs: Forwarded to `identify_parameter`.
+    :returns: Mapping feature -> NormalizationParameters, ready for
+        `normalization.serialize`.
+    """
+    features, columns = _columns_from_input(feature_values, features)
+    if num_workers is None:
+        num_workers = multiprocessing.cpu_count()
+    num_workers = max(1, min(num_workers, len(columns)))
+    feature_types = feature_types or {}
+    tasks = [
+        (i, feature_types.get(f), cache_dir, kwargs) for i, f in enumerate(features)
+    ]
+
+    buffer, dtype, offsets = _to_shared_buffer(columns)
+    del columns
+    start_time = time.time()
+    if num_workers == 1:
+        _init_worker(buffer, dtype, offsets)
+        results = [_identify_column(task) for task in tasks]
+    else:
+        pool = multiprocessing.Pool(
+            num_workers, initializer=_init_worker, initargs=(buffer, dtype, offsets)
+        )
+        try:
+            results = list(pool.imap_unordered(_identify_column, tasks))
+        finally:
+            pool.close()
+            pool.join()
+    logger.info(
+        "Identified {} features with {} workers in {:.2f}s".format(
+            len(features), num_workers, time.time() - start_time
+        )
+    )
+
+    parameters: List[Optional[NormalizationParameters]] = [None] * len(features)
+    elapsed: List[float] = [0.0] * len(features)
+    for index, feature_parameters, seconds in results:
+        parameters[index] = feature_parameters
+        elapsed[index] = seconds
+    for i in sorted(range(len(features)), key=lambda i: -elapsed[i])[
+        :NUM_SLOWEST_FEATURES_TO_LOG
+    ]:
+        logger.info(
+            "Feature {} ({}) took {:.3f}s".format(
+                features[i], parameters[i].feature_type, elapsed[i]
+            )
+        )
+    if timings is not None:
+        timings.update(zip(features, elapsed))
+    parameters = dict(zip(features, parameters))
+    if aliases is not None:
+        assert (
+            len(set(np.diff(offsets))) <= 1
+        ), "Pruning requires the same number of rows for every feature"
+        # The columns are back to back in the buffer, so the (rows, features)
+        # matrix is a view
+        matrix = np.frombuffer(buffer, dtype=dtype).reshape(len(features), -1).T
+        parameters, pruned_aliases = prune_features(matrix, parameters, features)
+        aliases.update(pruned_aliases)
+    return parameters
@@ -0,0 +1,338 @@
+#!/usr/bin/env python3
+
+import itertools
+import logging
+from typing import Dict, List, Optional
+
+import numpy as np
+from ml.rl.preprocessing import identify_types
+from ml.rl.preprocessing.feature_index import FeatureIndex
+from ml.rl.preprocessing.identify_types import FEATURE_TYPES
+from ml.rl.preprocessing.normalization import (
+    FLOAT16_MAX_EXACT_INT,
+    MISSING_VALUE,
+    NormalizationParameters,
+    check_output_dtype,
+    get_feature_type_boundaries,
+)
+
+
+logger = logging.getLogger(__name__)
+
+# Constants used by the Caffe2 operators PreprocessorNet is built from
+BINARY_TOLERANCE = 1e-3
+PROBABILITY_CLIP_MIN = 0.01
+PROBABILITY_CLIP_MAX = 0.99
+BOX_COX_EPSILON = 1e-6
+ANOMALY_CLIP = 3.0
+
+
+def _to_numpy(array):
+    """Returns (numpy view, torch device or None) for an array or tensor."""
+    if isinstance(array, np.ndarray):
+        return array, None
+    if hasattr(array, "detach") and hasattr(array, "device"):
+        # torch.Tensor: zero-copy on CPU
+        return array.detach().cpu().numpy(), array.device
+    return np.asarray(array), None
+
+
+def sparse_from_dict_list(d: List[Dict[int, float]]):
+    """
+    Returns the (lengths, keys, values) arrays for a list of sparse rows, in
+    the layout `StackedAssociativeArray.from_dict_list` feeds to Caffe2.
+    """
+    lengths = np.array([len(x) for x in d], dtype=np.int32)
+    num_entries = lengths.sum()
+    keys = np.fromiter(
+        itertools.chain.from_iterable(x.keys() for x in d),
+        dtype=np.int64,
+        count=num_entries,
+    )
+    values = np.fromiter(
+        itertools.chain.from_iterable(x.values() for x in d),
+        dtype=np.float32,
+        count=num_entries,
+    )
+    return lengths, keys, values
+
+
+def _from_numpy(array, device):
+    if device is None:
+        return array
+    import torch
+
+    return torch.from_numpy(array).to(device)
+
+
+class Preprocessor:
+    """
+    In-process NumPy implementation of the transforms built by
+    `PreprocessorNet`.
+
+    Produces the same matrices as the Caffe2 net (same column layout,
+    MISSING_VALUE handling and clipping) without constructing a net or
+    copying through the workspace. Inputs may be NumPy arrays or torch
+    tensors; tensors come back as tensors on their original device.
+
+    With `enum_as_index`, each ENUM feature yields a single column holding
+    its index in `possible_values` (see `get_enum_index_columns`) instead of
+    a one-hot block.
+
+    With `output_dtype=np.float16`, normalized matrices are stored in half
+    precision. Un-normalized output (`normalize=False`) stays float32 so
+    MISSING_VALUE remains exact.
+    """
+
+    def __init__(
+        self,
+        clip_anomalies: bool,
+        enum_as_index: bool = False,
+        output_dtype=np.float32,
+    ) -> None:
+        self.clip_anomalies = clip_anomalies
+        self.enum_as_index = enum_as_index
+        self.output_dtype = check_output_dtype(output_dtype)
+
+    def preprocess_columns(
+        self, values, normalization_parameters: List[NormalizationParameters]
+    ):
+        """
+        Counterpart of `PreprocessorNet.preprocess_blob`: normalizes a
+        (rows, len(normalization_parameters)) matrix whose columns all share
+        one feature type.
+        """
+        values, device = _to_numpy(values)
+        values = values.astype(np.float32, copy=False)
+        if values.ndim == 1:
+            values = values.reshape(-1, 1)
+
+        for i in range(len(normalization_parameters) - 1):
+            if (
+                normalization_parameters[i].feature_type
+                != normalization_parameters[i + 1].feature_type
+            ):
+                raise Exception(
+                    "Only one feature type is allowed per call to preprocess_columns!"
+                )
+        feature_type = normalization_parameters[0].feature_type
+
+        if feature_type == identify_types.ENUM:
+            return _from_numpy(
+                self._one_hot_enums(values, normalization_parameters), device
+            )
+
+        is_empty = np.logical_and(
+            values > np.float32(MISSING_VALUE - 1e-4),
+            values < np.float32(MISSING_VALUE + 1e-4),
+        )
+        if feature_type == identify_types.BINARY:
+            output = np.logical_or(
+                values > BINARY_TOLERANCE, values < -BINARY_TOLERANCE
+            ).astype(np.float32)
+        elif feature_type == identify_types.PROBABILITY:
+            clipped = np.clip(values, PROBABILITY_CLIP_MIN, PROBABILITY_CLIP_MAX)
+            output = np.log(clipped / (1 - clipped))
+        elif feature_type == identify_types.QUANTILE:
+            output = np.empty_like(values)
+            for i, norm in enumerate(normalization_parameters):
+                quantiles = np.array(norm.quantiles, dtype=np.float32)
+                labels = np.arange(len(quantiles), dtype=np.float32) / float(
+                    len(quantiles)
+                )
+                output[:, i] = np.interp(values[:, i], quantiles, labels)
+        elif (
+            feature_type == identify_types.CONTINUOUS
+            or feature_type == identify_types.BOXCOX
+        ):
+            output = values
+            if feature_type == identify_types.BOXCOX:
+                output = self._boxcox(values, normalization_parameters)
+            means = np.array(
+                [norm.mean for norm in normalization_parameters], dtype=np.float32
+            )
+            stddevs = np.array(
+                [norm.stddev for norm in normalization_parameters], dtype=np.float32
+            )
+            output = (output - means) / stddevs
+            if self.clip_anomalies:
+                output = np.clip(output, -ANOMALY_CLIP, ANOMALY_CLIP)
+        else:
+            raise NotImplementedError("Invalid feature type: {}".format(feature_type))
+
+        output = np.where(is_empty, np.float32(0), output).astype(np.float32)
+        return _from_numpy(output, device)
+
+    def _boxcox(self, values, normalization_parameters):
+        shifts = []
+        lambdas = []
+        for norm in normalization_parameters:
+            assert norm.boxcox_shift is not None and norm.boxcox_lambda is not None
+            shifts.append(norm.boxcox_shift)
+            lambdas.append(norm.boxcox_lambda)
+        shifts = np.array(shifts, dtype=np.float32)
+        lambdas = np.array(lambdas, dtype=np.float32)
+
+        shifted = np.maximum(values + shifts, np.float32(BOX_COX_EPSILON))
+        is_log = lambdas == 0
+        safe_lambdas = np.where(is_log, np.float32(1), lambdas)
+        with np.errstate(over="ignore"):
+            power = (np.power(shifted, safe_lambdas) - 1) / safe_lambdas
+        return np.where(is_log, np.log(shifted), power)
+
+    def _one_hot_enums(self, values, normalization_parameters):
+        for parameter in normalization_parameters:
+            for x in parameter.possible_values:
+                if x < 0:
+                    logger.fatal(
+                        "Invalid enum possible value for feature: "
+                        + str(x)
+                        + " "
+                        + str(parameter.possible_values)
+                    )
+                    raise Exception(
+                        "Invalid enum possible value for feature: "
+                        + str(x)
+                        + " "
+                        + str(parameter.possible_values)
+                    )
+
+        # Caffe2's Cast truncates towards zero, as does astype
+        int_values = values.astype(np.int32)
+        if self.enum_as_index:
+            return self._enum_indices(int_values, normalization_parameters)
+        outputs = []
+        for i, parameter in enumerate(normalization_parameters):
+            possible_values = np.array(parameter.possible_values, dtype=np.int32)
+            outputs.append(
+                (int_values[:, i : i + 1] == possible_values).astype(np.float32)
+            )
+        return np.concatenate(outputs, axis=1)
+
+    def _enum_indices(self, int_values, normalization_parameters):
+        output = np.empty(int_values.shape, dtype=np.float32)
+        for i, parameter in enumerate(normalization_parameters):
+            possible_values = np.array(parameter.possible_values, dtype=np.int32)
+            if (
+                self.output_dtype == np.float16
+                and len(possible_values) > FLOAT16_MAX_EXACT_INT
+            ):
+                raise Exception(
+                    "ENUM with {} values cannot be indexed in float16".format(
+                        len(possible_values)
+                    )
+                )
+            if len(possible_values) == 0:
+                # Every value is unknown
+                output[:, i] = 0
+                continue
+            order = np.argsort(possible_values, kind="stable")
+            sorted_values = possible_values[order]
+            positions = np.minimum(
+                np.searchsorted(sorted_values, int_values[:, i]),
+                len(sorted_values) - 1,
+            )
+            output[:, i] = np.where(
+                sorted_values[positions] == int_values[:, i],
+                order[positions],
+                len(possible_values),
+            )
+        return output
+
+    def normalize_dense_matrix(
+        self,
+        input_matrix,
+        features: List[str],
+        normalization_parameters: Dict[str, NormalizationParameters],
+    ):
+        """
+        Normalizes inputs according to parameters. Expects a dense matrix whose ith
+        column corresponds to feature i, with features sorted by feature type.
+
+        :param input_matrix: Input matrix (NumPy array or torch tensor).
+        :param features: Array that maps feature ids to column indices.
+        :param normalization_parameters: Mapping from feature names to
+            NormalizationParameters.
+        """
+        input_matrix, device = _to_numpy(input_matrix)
+        feature_starts = get_feature_type_boundaries(features, normalization_parameters)
+
+        outputs = []
+        for i, _ in enumerate(FEATURE_TYPES):
+            start_index = feature_starts[i]
+            if (i + 1) == len(FEATURE_TYPES):
+                end_index = len(features)
+            else:
+                end_index = feature_starts[i + 1]
+            if start_index == end_index:
+                continue  # No features of this type
+            outputs.append(
+                self.preprocess_columns(
+                    input_matrix[:, start_index:end_index],
+                    [
+                        normalization_parameters[x]
+                        for x in features[start_index:end_index]
+                    ],
+                )
+            )
+        output = np.concatenate(outputs, axis=1).astype(self.output_dtype, copy=False)
+        return _from_numpy(output, device)
+
+    def normalize_sparse_matrix(
+        self,
+        lengths,
+        keys,
+        values,
+        normalization_parameters: Dict[str, NormalizationParameters],
+        normalize: bool = True,
+        feature_index: Optional[FeatureIndex] = None,
+    ):
+        """
+        Counterpart of `PreprocessorNet.normalize_sparse_matrix`. Returns
+        the dense, normalized (rows, num_output_features) float32 matrix.
+
+        :param feature_index: Index built from `normalization_parameters`;
+            pass one to avoid rebuilding it on every call.
+        """
+        if feature_index is None:
+            feature_index = FeatureIndex.from_normalization(normalization_parameters)
+        dense_input = feature_index.densify(lengths, keys, values)
+        if not normalize:
+            return dense_input
+        return self.normalize_dense_matrix(
+            dense_input, feature_index.features, normalization_parameters
+        )
+
+    def normalize_dict_list(
+        self,
+        d: List[Dict[int, float]],
+        normalization_parameters: Dict[str, NormalizationParameters],
+        feature_index: Optional[FeatureIndex] = None,
+    ):
+        """
+        Shortcut for `normalize_sparse_matrix` on a list of sparse rows.
+        """
+        lengths, keys, values = sparse_from_dict_list(d)
+        return self.normalize_sparse_matrix(
+            lengths,
+            keys,
+            values,
+            normalization_parameters,
+            feature_index=feature_index,
+        )
+
+    def concat_states_and_possible_next_actions(
+        self,
+        next_state_matrix,
+        possible_next_actions_matrix,
+        possible_next_actions_lengths,
+    ):
+        """
+        Counterpart of `PreprocessorNet.concat_states_and_possible_next_actions`:
+        repeats each state once per possible next action and appends the
+        action columns.
+        """
+        stacked_states = np.repeat(
+            next_state_matrix, possible_next_actions_lengths, axis=0
+        )
+        return np.concatenate([stacked_states, possible_next_actions_matrix], axis=1)
@@ -2,39 +2,148 @@
 
 
 import logging
-from typing import Dict, List, Tuple
+import multiprocessing
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Tuple
 
 import caffe2.proto.caffe2_pb2 as caffe2_pb2
 import numpy as np
 from caffe2.python import core, workspace
 from ml.rl.caffe_utils import C2
 from ml.rl.preprocessing import identify_types
+from ml.rl.preprocessing.feature_index import FeatureIndex
 from ml.rl.preprocessing.identify_types import FEATURE_TYPES
-from ml.rl.preprocessing.normalization import MISSING_VALUE, NormalizationParameters
+from ml.rl.preprocessing.normalization import (
+    MISSING_VALUE,
+    NormalizationParameters,
+    check_output_dtype,
+    fingerprint_parameters,
+    get_feature_type_boundaries,
+    sort_features_by_normalization,
+)
 
 
 logger = logging.getLogger(__name__)
 
 
-def sort_features_by_normalization(normalization_parameters):
+# Chunks used by `normalize_sparse_matrix` when split_sparse_to_dense is set
+# and no explicit chunk count is given
+DEFAULT_NUM_SPARSE_TO_DENSE_CHUNKS = 8
+# Rows per sparse-to-dense chunk the cached path aims for
+DEFAULT_TARGET_CHUNK_SIZE = 4096
+
+
+def choose_num_chunks(
+    num_rows: int,
+    num_workers: Optional[int] = None,
+    target_chunk_size: int = DEFAULT_TARGET_CHUNK_SIZE,
+) -> int:
+    """
+    Number of sparse-to-dense chunks for a batch of `num_rows`: enough for
+    chunks of about `target_chunk_size` rows, capped at `num_workers`
+    (default: the CPU count).
     """
-    Helper function to return a sorted list from a normalization map.
-    Also returns the starting index for each feature type"""
-    # Sort features by feature type
-    sorted_features = []
-    feature_starts = []
-    for feature_type in FEATURE_TYPES:
-        feature_starts.append(len(sorted_features))
-        for feature in normalization_parameters.keys():
-            norm = normalization_parameters[feature]
-            if norm.feature_type == feature_type:
-                sorted_features.append(feature)
-    return sorted_features, feature_starts
+    if num_workers is None:
+        num_workers = multiprocessing.cpu_count()
+    return int(max(1, min(num_workers, -(-num_rows // target_chunk_size))))
+
+
+class PreprocessingPlan(NamedTuple):
+    net_name: str
+    input_blobs: List[str]
+    output_blob: str
+    parameters: List[str]
+    # [start, end) operator indices of each sparse-to-dense chunk
+    chunk_op_ranges: List[Tuple[int, int]]
+    # threading.Lock held while the net is fed, run and fetched
+    lock: Any
+
+
+# Nets built by the `*_cached` methods of PreprocessorNet, keyed by
+# `PreprocessorNet._plan_key`, least recently used first
+MAX_CACHED_PLANS = 32
+_PLAN_CACHE: "OrderedDict[Tuple, PreprocessingPlan]" = OrderedDict()
+# Names of the nets of evicted plans, reused by the next plans built so the
+# workspace holds at most MAX_CACHED_PLANS of them
+_FREE_NET_NAMES: List[str] = []
+
+# Fingerprints of the normalization parameters and feature lists last passed
+# to the `*_cached` methods, keyed by a snapshot of their content, so repeated
+# calls do not serialize and hash every feature again
+MAX_CACHED_FINGERPRINTS = 64
+_FINGERPRINTS: "OrderedDict[Tuple, str]" = OrderedDict()
+_CACHE_LOCK = threading.Lock()
+# Plans are built one at a time, since building sets the global C2 net
+_BUILD_LOCK = threading.Lock()
+
+
+def _parameters_snapshot(
+    normalization_parameters: Dict[str, NormalizationParameters]
+) -> Tuple:
+    """
+    Hashable copy of the content of a normalization-parameter dict, cheaper
+    to compute and compare than `fingerprint_parameters`.
+    """
+    return tuple(
+        (
+            feature,
+            tuple(
+                tuple(field) if isinstance(field, (list, np.ndarray)) else field
+                for field in parameters
+            ),
+        )
+        for feature, parameters in normalization_parameters.items()
+    )
+
+
+def _fingerprint(
+    normalization_parameters: Dict[str, NormalizationParameters],
+    features: Optional[List[str]],
+) -> str:
+    """
+    `fingerprint_parameters` of the parameters and of `features`, or of the
+    feature order `sort_features_by_normalization` gives when it is None.
+    """
+    key = (
+        _parameters_snapshot(normalization_parameters),
+        None if features is None else tuple(features),
+    )
+    with _CACHE_LOCK:
+        fingerprint = _FINGERPRINTS.get(key)
+        if fingerprint is not None:
+            _FINGERPRINTS.move_to_end(key)
+            return fingerprint
+    if features is None:
+        sorted_features, _ = sort_features_by_normalization(normalization_parameters)
+        fingerprint = fingerprint_parameters(normalization_parameters, sorted_features)
+    else:
+        fingerprint = fingerprint_parameters(normalization_parameters, features)
+    with _CACHE_LOCK:
+        _FINGERPRINTS[key] = fingerprint
+        while len(_FINGERPRINTS) > MAX_CACHED_FINGERPRINTS:
+            _FINGERPRINTS.popitem(last=False)
+    return fingerprint
 
 
 class PreprocessorNet:
-    def __init__(self, clip_anomalies: bool) -> None:
+    def __init__(
+        self,
+        clip_anomalies: bool,
+        enum_as_index: bool = False,
+        output_dtype=np.float32,
+    ) -> None:
+        """
+        :param clip_anomalies: Clip CONTINUOUS and BOXCOX outputs to [-3, 3].
+        :param enum_as_index: Output one index column per ENUM feature (see
+            `get_enum_index_columns`) instead of a one-hot block.
+        :param output_dtype: np.float16 to return half precision matrices
+            from the `*_cached` methods when they normalize. Nets built with
+            the other methods always output float32.
+        """
         self.clip_anomalies = clip_anomalies
+        self.enum_as_index = enum_as_index
+        self.output_dtype = check_output_dtype(output_dtype)
 
     def preprocess_blob(self, blob, normalization_parameters):
         """
@@ -104,6 +213,11 @@ class PreprocessorNet:
 
             int_blob = C2.Cast(blob, to=core.DataType.INT32)
 
+            if self.enum_as_index:
+                return self._enum_indices(
+                    int_blob, normalization_parameters, parameters
+                )
+
             # Batch one hot transform with MISSING_VALUE as a possible value
             feature_lengths = [
                 len(p.possible_values) + 1 for p in normalization_parameters
@@ -259,6 +373,78 @@ class PreprocessorNet:
 
         return output_blob, parameters
 
+    def _enum_indices(self, int_blob, normalization_parameters, parameters):
+        """
+        Maps each ENUM column to the index of its value in possible_values,
+        or to len(possible_values) for missing and unknown values.
+
+        Every (column, value) pair is encoded as one int64 key, value *
+        num_columns + column, and looked up with a single `Find` against the
+        concatenated keys of all possible values, so the cost is linear in
+        the batch size and in the total number of possible values.
+        """
+        num_columns = len(normalization_parameters)
+        feature_lengths = [len(p.possible_values) for p in normalization_parameters]
+        offsets = np.cumsum([0] + feature_lengths[:-1])
+        possible_keys = np.array(
+            [
+                value * num_columns + column
+                for column, p in enumerate(normalization_parameters)
+                for value in p.possible_values
+            ],
+            dtype=np.int64,
+        )
+        possible_keys_blob = self._store_parameter(
+            parameters, "possible_keys_blob", possible_keys
+        )
+        num_columns_blob = self._store_parameter(
+            parameters, "num_columns_blob", np.array([num_columns], dtype=np.int64)
+        )
+        columns_blob = self._store_parameter(
+            parameters, "columns_blob", np.arange(num_columns, dtype=np.int64)
+        )
+        offsets_blob = self._store_parameter(
+            parameters, "offsets_blob", np.array(offsets, dtype=np.float32)
+        )
+        # Find returns -1 for a miss; -1 - offset + (length + 1 + offset) is
+        # the reserved index `length`
+        missing_offsets_blob = self._store_parameter(
+            parameters,
+            "missing_offsets_blob",
+            np.array(
+                [
+                    length + 1 + offset
+                    for length, offset in zip(feature_lengths, offsets)
+                ],
+                dtype=np.float32,
+            ),
+        )
+        ZERO = self._store_parameter(
+            parameters, "ZERO", np.array([0], dtype=np.float32)
+        )
+
+        keys = C2.Add(
+            C2.Mul(
+                C2.Cast(int_blob, to=core.DataType.INT64),
+                num_columns_blob,
+                broadcast=1,
+            ),
+            columns_blob,
+            broadcast=1,
+        )
+        positions = C2.Cast(
+            C2.Find(possible_keys_blob, keys, missing_value=-1),
+            to=core.DataType.FLOAT,
+        )
+        is_missing = C2.Cast(
+            C2.LT(positions, ZERO, broadcast=1), to=core.DataType.FLOAT
+        )
+        indices = C2.Add(
+            C2.Sub(positions, offsets_blob, broadcast=1),
+            C2.Mul(is_missing, missing_offsets_blob, broadcast=1),
+        )
+        return indices, parameters
+
     def _store_parameter(self, parameters, name, value):
         c2_name = C2.NextBlob(name)
         workspace.FeedBlob(c2_name, value)
@@ -275,11 +461,37 @@ class PreprocessorNet:
         split_sparse_to_dense: bool,
         split_expensive_feature_groups: bool,
         normalize: bool = True,
+        num_chunks: Optional[int] = None,
+        chunk_lengths_blob: Optional[str] = None,
+        feature_index: Optional[FeatureIndex] = None,
     ) -> Tuple[str, List[str]]:
-        sorted_features, _ = sort_features_by_normalization(normalization_parameters)
-        int_features = [int(feature) for feature in sorted_features]
-
-        preprocess_num_batches = 8 if split_sparse_to_dense else 1
+        """
+        Densifies and normalizes sparse rows. The rows are split into chunks
+        that are densified and normalized independently, so they can run
+        concurrently under an async net executor, then concatenated.
+
+        :param split_sparse_to_dense: Use DEFAULT_NUM_SPARSE_TO_DENSE_CHUNKS
+            chunks when `num_chunks` is not given.
+        :param num_chunks: Number of chunks to split the rows into.
+        :param chunk_lengths_blob: Optional int32 blob with the number of
+            rows in each chunk. Without it the rows are split evenly, which
+            requires the row count to be divisible by the number of chunks.
+        :param feature_index: Index built from `normalization_parameters`,
+            to share one across nets instead of rebuilding it for each.
+
+        The operator index range of each chunk is left in
+        `self.chunk_op_ranges`.
+        """
+        if feature_index is None:
+            feature_index = FeatureIndex.from_normalization(normalization_parameters)
+        sorted_features = feature_index.features
+        int_features = feature_index.feature_ids.tolist()
+
+        if num_chunks is None:
+            num_chunks = (
+                DEFAULT_NUM_SPARSE_TO_DENSE_CHUNKS if split_sparse_to_dense else 1
+            )
+        preprocess_num_batches = num_chunks
 
         lengths_batch = []
         keys_batch = []
@@ -289,7 +501,10 @@ class PreprocessorNet:
             keys_batch.append(C2.NextBlob(blobname_prefix + "_key_batch"))
             values_batch.append(C2.NextBlob(blobname_prefix + "_value_batch"))
 
-        C2.net().Split([lengths_blob], lengths_batch, axis=0)
+        if chunk_lengths_blob is None:
+            C2.net().Split([lengths_blob], lengths_batch, axis=0)
+        else:
+            C2.net().Split([lengths_blob, chunk_lengths_blob], lengths_batch, axis=0)
         total_lengths_batch = []
         for x in range(preprocess_num_batches):
             total_lengths_batch.append(
@@ -309,7 +524,9 @@ class PreprocessorNet:
         )
         C2.net().GivenTensorFill([], [MISSING_SCALAR], shape=[], values=[MISSING_VALUE])
 
+        self.chunk_op_ranges: List[Tuple[int, int]] = []
         for preprocess_batch in range(preprocess_num_batches):
+            chunk_op_start = len(C2.net().Proto().op)
             dense_input_fragment = C2.SparseToDenseMask(
                 keys_batch[preprocess_batch],
                 values_batch[preprocess_batch],
@@ -319,17 +536,19 @@ class PreprocessorNet:
             )[0]
 
             if normalize:
+                # Chunks need distinct slice blobs to be independent
                 normalized_fragment, p = self.normalize_dense_matrix(
                     dense_input_fragment,
                     sorted_features,
                     normalization_parameters,
-                    blobname_prefix,
+                    "{}_chunk{}".format(blobname_prefix, preprocess_batch),
                     split_expensive_feature_groups,
                 )
                 dense_input_fragments.append(normalized_fragment)
                 parameters.extend(p)
             else:
                 dense_input_fragments.append(dense_input_fragment)
+            self.chunk_op_ranges.append((chunk_op_start, len(C2.net().Proto().op)))
 
         dense_input = C2.NextBlob(blobname_prefix + "_dense_input")
         dense_input_dims = C2.NextBlob(blobname_prefix + "_dense_input_dims")
@@ -442,26 +661,251 @@ class PreprocessorNet:
         )
         return state_action_pairs
 
+    def normalize_sparse_matrix_cached(
+        self,
+        lengths: np.ndarray,
+        keys: np.ndarray,
+        values: np.ndarray,
+        normalization_parameters: Dict[str, NormalizationParameters],
+        normalize: bool = True,
+        num_workers: Optional[int] = None,
+        target_chunk_size: int = DEFAULT_TARGET_CHUNK_SIZE,
+        chunk_timings: Optional[List[float]] = None,
+    ) -> np.ndarray:
+        """
+        Runs `normalize_sparse_matrix` on in-memory arrays and returns the
+        result. The net and its parameter blobs are built once per distinct
+        set of normalization parameters and chunk count; later calls only
+        feed the inputs.
+
+        The rows are split into `choose_num_chunks(len(lengths), num_workers,
+        target_chunk_size)` chunks which run concurrently on the async
+        scheduler.
+
+        :param chunk_timings: If given, filled with the seconds spent in each
+            chunk. Measuring runs every operator on its own, one at a time,
+            so only pass it when profiling.
+        """
+        num_rows = len(lengths)
+        num_chunks = choose_num_chunks(num_rows, num_workers, target_chunk_size)
+        chunk_lengths = np.full(num_chunks, num_rows // num_chunks, dtype=np.int32)
+        chunk_lengths[: num_rows % num_chunks] += 1
+
+        plan_key = self._plan_key(
+            "sparse", normalize, normalization_parameters, None, num_chunks
+        )
+
+        def build(input_blobs):
+            return self.normalize_sparse_matrix(
+                input_blobs[0],
+                input_blobs[1],
+                input_blobs[2],
+                normalization_parameters,
+                C2.NextBlob("plan"),
+                False,
+                False,
+                normalize,
+                num_chunks=num_chunks,
+                chunk_lengths_blob=input_blobs[3],
+            )
+
+        return self._run_plan(
+            plan_key,
+            build,
+            [
+                np.asarray(lengths, dtype=np.int32),
+                np.asarray(keys, dtype=np.int64),
+                np.asarray(values, dtype=np.float32),
+                chunk_lengths,
+            ],
+            num_chunks,
+            chunk_timings,
+        )
+
+    def normalize_dense_matrix_cached(
+        self,
+        input_matrix: np.ndarray,
+        features: List[str],
+        normalization_parameters: Dict[str, NormalizationParameters],
+    ) -> np.ndarray:
+        """
+        Runs `normalize_dense_matrix` on an in-memory matrix, reusing the net
+        built by an earlier call with the same parameters and feature order.
+        """
+        plan_key = self._plan_key("dense", True, normalization_parameters, features)
+
+        def build(input_blobs):
+            return self.normalize_dense_matrix(
+                input_blobs[0], features, normalization_parameters, C2.NextBlob("plan")
+            )
+
+        return self._run_plan(
+            plan_key, build, [np.asarray(input_matrix, dtype=np.float32)]
+        )
+
+    def _plan_key(
+        self,
+        kind: str,
+        normalize: bool,
+        normalization_parameters: Dict[str, NormalizationParameters],
+        features: Optional[List[str]],
+        num_chunks: int = 1,
+    ) -> Tuple:
+        return (
+            kind,
+            self.clip_anomalies,
+            self.enum_as_index,
+            normalize,
+            self.output_dtype.__name__,
+            num_chunks,
+            _fingerprint(normalization_parameters, features),
+        )
+
+    def _run_plan(
+        self,
+        plan_key: Tuple,
+        build: Callable[[List[str]], Tuple[str, List[str]]],
+        inputs: List[np.ndarray],
+        num_workers: int = 1,
+        chunk_timings: Optional[List[float]] = None,
+    ) -> np.ndarray:
+        while True:
+            plan = self._get_plan(plan_key, build, inputs, num_workers)
+            with plan.lock:
+                with _CACHE_LOCK:
+                    if _PLAN_CACHE.get(plan_key) is not plan:
+                        # Evicted by another thread before we could run it
+                        continue
+                return self._run_net(plan, inputs, chunk_timings)
+
+    def _get_plan(
+        self,
+        plan_key: Tuple,
+        build: Callable[[List[str]], Tuple[str, List[str]]],
+        inputs: List[np.ndarray],
+        num_workers: int,
+    ) -> PreprocessingPlan:
+        with _CACHE_LOCK:
+            plan = _PLAN_CACHE.get(plan_key)
+            if plan is not None:
+                _PLAN_CACHE.move_to_end(plan_key)
+        if plan is not None and self._plan_is_live(plan):
+            return plan
+        with _BUILD_LOCK:
+            with _CACHE_LOCK:
+                plan = _PLAN_CACHE.get(plan_key)
+            if plan is not None and self._plan_is_live(plan):
+                # Built by another thread meanwhile
+                return plan
+            with _CACHE_LOCK:
+                _PLAN_CACHE.pop(plan_key, None)
+                evicted = []
+                while len(_PLAN_CACHE) >= MAX_CACHED_PLANS:
+                    evicted.append(_PLAN_CACHE.popitem(last=False)[1])
+            for old_plan in evicted:
+                self._release_plan(old_plan)
+            plan = self._build_plan(plan_key, build, inputs, num_workers)
+            with _CACHE_LOCK:
+                _PLAN_CACHE[plan_key] = plan
+        return plan
+
+    def _run_net(
+        self,
+        plan: PreprocessingPlan,
+        inputs: List[np.ndarray],
+        chunk_timings: Optional[List[float]],
+    ) -> np.ndarray:
+        for blob, value in zip(plan.input_blobs, inputs):
+            workspace.FeedBlob(blob, value)
+        if chunk_timings is None:
+            workspace.RunNet(plan.net_name)
+        else:
+            # Element 0 is the whole net, then one entry per operator, in ms
+            op_millis = workspace.BenchmarkNet(plan.net_name, 0, 1, True)[1:]
+            chunk_timings[:] = [
+                sum(op_millis[start:end]) / 1000.0
+                for start, end in plan.chunk_op_ranges
+            ]
+            logger.info(
+                "Preprocessing chunk seconds: {}".format(
+                    ", ".join("{:.4f}".format(t) for t in chunk_timings)
+                )
+            )
+        return workspace.FetchBlob(plan.output_blob)
+
+    def _release_plan(self, plan: PreprocessingPlan) -> None:
+        # Wait for runs of the plan to finish, then empty its blobs and hand
+        # its net name to the next plan built, which overwrites the net
+        with plan.lock:
+            for blob in plan.input_blobs + plan.parameters + [plan.output_blob]:
+                if workspace.HasBlob(blob):
+                    workspace.FeedBlob(blob, np.zeros(0, dtype=np.float32))
+            with _CACHE_LOCK:
+                _FREE_NET_NAMES.append(plan.net_name)
+        logger.info("Evicted preprocessing plan {}".format(plan.net_name))
+
+    def _plan_is_live(self, plan: PreprocessingPlan) -> bool:
+        # Plans die with the workspace they were created in
+        return plan.net_name in workspace.Nets() and all(
+            workspace.HasBlob(blob) for blob in plan.parameters
+        )
+
+    def _build_plan(
+        self,
+        plan_key: Tuple,
+        build: Callable[[List[str]], Tuple[str, List[str]]],
+        inputs: List[np.ndarray],
+        num_workers: int,
+    ) -> PreprocessingPlan:
+        previous_model = C2.model()
+        previous_net = C2.net()
+        net = core.Net("preprocessing_plan_{}_{}".format(plan_key[0], plan_key[-1]))
+        with _CACHE_LOCK:
+            if _FREE_NET_NAMES:
+                # Blob names start with the net name, so the evicted plan's
+                # blobs are reused as well
+                net.Proto().name = _FREE_NET_NAMES.pop()
+        C2.set_net(net)
+        self.chunk_op_ranges = []
+        try:
+            input_blobs = [
+                C2.NextBlob("plan_input_{}".format(i)) for i in range(len(inputs))
+            ]
+            for blob, value in zip(input_blobs, inputs):
+                workspace.FeedBlob(blob, value)
+            output_blob, parameters = build(input_blobs)
+            normalize = plan_key[3]
+            if normalize and self.output_dtype == np.float16:
+                output_blob = C2.FloatToHalf(output_blob)
+        finally:
+            if previous_model is not None:
+                C2.set_model(previous_model)
+            else:
+                C2.set_net(previous_net)
+        if num_workers > 1:
+            net.Proto().type = "async_scheduling"
+            net.Proto().num_workers = num_workers
+        workspace.CreateNet(net, overwrite=True)
+        logger.info(
+            "Built preprocessing plan {} with {} workers".format(
+                net.Name(), num_workers
+            )
+        )
+        return PreprocessingPlan(
+            net.Name(),
+            input_blobs,
+            str(output_blob),
+            parameters,
+            self.chunk_op_ranges,
+            threading.Lock(),
+        )
+
     def _get_type_boundaries(
         self,
         features: List[str],
         normalization_parameters: Dict[str, NormalizationParameters],
     ) -> List[int]:
-        feature_starts = []
-        on_feature_type = -1
-        for i, feature in enumerate(features):
-            feature_type = normalization_parameters[feature].feature_type
-            feature_type_index = FEATURE_TYPES.index(feature_type)
-            assert (
-                feature_type_index >= on_feature_type
-            ), "Features are not sorted by feature type!"
-            while feature_type_index > on_feature_type:
-                feature_starts.append(i)
-                on_feature_type += 1
-        while on_feature_type < len(FEATURE_TYPES):
-            feature_starts.append(len(features))
-            on_feature_type += 1
-        return feature_starts
+        return get_feature_type_boundaries(features, normalization_parameters)
 
     def _get_input_blob(self, prefix: str, feature_type: str) -> str:
         return "{}_{}".format(prefix, feature_type)
@@ -0,0 +1,329 @@
+#!/usr/bin/env python3
+
+import logging
+
+import numpy as np
+from ml.rl.preprocessing import identify_types
+from ml.rl.preprocessing.identify_types import DEFAULT_MAX_UNIQUE_ENUM
+from ml.rl.preprocessing.moments import StreamingMoments, normaltest_from_moments
+from ml.rl.preprocessing.normalization import (
+    BOX_COX_MARGIN,
+    BOX_COX_MAX_STDDEV,
+    DEFAULT_MAX_QUANTILE_SIZE,
+    DEFAULT_QUANTILE_K2_THRESHOLD,
+    MINIMUM_SAMPLES_TO_IDENTIFY,
+    NormalizationParameters,
+)
+from scipy import stats
+from scipy.stats.mstats import mquantiles
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SKETCH_SIZE = 100000
+
+# numpy's hypergeometric sampler only accepts populations below this size
+_MAX_HYPERGEOMETRIC_POPULATION = 10 ** 9
+
+
+class ReservoirSample(object):
+    """
+    Mergeable uniform sample of at most `capacity` values from a stream.
+
+    Used as the quantile sketch: any quantile read from the reservoir has a
+    rank error of O(1 / sqrt(capacity)) regardless of the stream length.
+    """
+
+    __slots__ = ["capacity", "count", "values", "random_state"]
+
+    def __init__(self, capacity: int, random_state: np.random.RandomState) -> None:
+        self.capacity = capacity
+        self.count = 0
+        self.values = np.array([], dtype=np.float64)
+        self.random_state = random_state
+
+    def update(self, values) -> "ReservoirSample":
+        values = np.asarray(values, dtype=np.float64).ravel()
+        chunk = ReservoirSample(self.capacity, self.random_state)
+        chunk.count = len(values)
+        if len(values) > self.capacity:
+            values = values[
+                self.random_state.choice(len(values), self.capacity, replace=False)
+            ]
+        chunk.values = values
+        return self.merge(chunk)
+
+    def merge(self, other: "ReservoirSample") -> "ReservoirSample":
+        total = self.count + other.count
+        if total <= self.capacity:
+            self.values = np.concatenate([self.values, other.values])
+            self.count = total
+            return self
+
+        # Choose how many of the merged slots come from each side so that the
+        # result is a uniform sample of the union of both streams.
+        if total < _MAX_HYPERGEOMETRIC_POPULATION:
+            from_self = self.random_state.hypergeometric(
+                self.count, other.count, self.capacity
+            )
+        else:
+            from_self = self.random_state.binomial(
+                self.capacity, float(self.count) / total
+            )
+        from_self = int(
+            np.clip(
+                from_self,
+                self.capacity - len(other.values),
+                min(len(self.values), self.capacity),
+            )
+        )
+        from_other = self.capacity - from_self
+        self.values = np.concatenate(
+            [
+                self.values[
+                    self.random_state.choice(len(self.values), from_self, replace=False)
+                ],
+                other.values[
+                    self.random_state.choice(
+                        len(other.values), from_other, replace=False
+                    )
+                ],
+            ]
+        )
+        self.count = total
+        return self
+
+
+class StreamingNormalizationIdentifier(object):
+    """
+    One-pass, mergeable counterpart to `normalization.identify_parameter`.
+
+    Feed a feature in chunks with `update`, combine shards processed on
+    separate workers with `merge`, then call `identify_parameter` to get the
+    same `NormalizationParameters` the in-memory path would produce.
+
+    Type detection, min/max, ENUM possible values and the mean/stddev of
+    CONTINUOUS features are exact.  The normality test on the raw data is
+    computed from exact streaming moments.  The Box-Cox lambda, the normality
+    test of the Box-Cox candidate, the statistics of Box-Cox transformed
+    values and the QUANTILE boundaries are estimated from a uniform reservoir
+    of `sketch_size` values.
+    """
+
+    def __init__(
+        self,
+        max_unique_enum_values=DEFAULT_MAX_UNIQUE_ENUM,
+        sketch_size=DEFAULT_SKETCH_SIZE,
+        seed=None,
+    ) -> None:
+        """
+        :param max_unique_enum_values: Distinct values tracked before the
+            feature is ruled out as an ENUM.
+        :param sketch_size: Capacity of the reservoir used for Box-Cox and
+            quantile estimates.
+        :param seed: Seed for the reservoir sampler.
+        """
+        self.max_unique_enum_values = max_unique_enum_values
+        self.sketch_size = sketch_size
+        self.random_state = np.random.RandomState(seed)
+
+        self.moments = StreamingMoments()
+        self.reservoir = ReservoirSample(sketch_size, self.random_state)
+        self.min_value = None
+        self.max_value = None
+        self.all_binary = True
+        self.all_integer = True
+        self.distinct_values = np.array([], dtype=np.float64)
+        self.distinct_overflow = False
+
+    @property
+    def count(self) -> int:
+        return self.moments.count
+
+    def update(self, values) -> "StreamingNormalizationIdentifier":
+        """
+        Adds a chunk of values for this feature.
+        """
+        values = np.asarray(values).ravel()
+        if len(values) == 0:
+            return self
+
+        self.moments.update(values)
+        self.reservoir.update(values)
+        self._update_extrema(np.min(values), np.max(values))
+        self.all_binary = self.all_binary and bool(
+            np.all(np.logical_or(values == 0, values == 1))
+        )
+        self.all_integer = self.all_integer and bool(np.all(np.mod(values, 1) == 0))
+        if not self.distinct_overflow:
+            self._update_distinct(np.unique(values))
+        return self
+
+    def merge(
+        self, other: "StreamingNormalizationIdentifier"
+    ) -> "StreamingNormalizationIdentifier":
+        """
+        Folds another identifier for the same feature into this one.
+        """
+        if other.count == 0:
+            return self
+        self.moments.merge(other.moments)
+        self.reservoir.merge(other.reservoir)
+        self._update_extrema(other.min_value, other.max_value)
+        self.all_binary = self.all_binary and other.all_binary
+        self.all_integer = self.all_integer and other.all_integer
+        if other.distinct_overflow:
+            self._drop_distinct()
+        elif not self.distinct_overflow:
+            self._update_distinct(other.distinct_values)
+        return self
+
+    def _update_extrema(self, min_value, max_value):
+        if self.min_value is None or min_value < self.min_value:
+            self.min_value = min_value
+        if self.max_value is None or max_value > self.max_value:
+            self.max_value = max_value
+
+    def _update_distinct(self, unique_values):
+        self.distinct_values = np.union1d(self.distinct_values, unique_values)
+        if len(self.distinct_values) > self.max_unique_enum_values:
+            self._drop_distinct()
+
+    def _drop_distinct(self):
+        self.distinct_overflow = True
+        self.distinct_values = np.array([], dtype=np.float64)
+
+    def identify_type(self):
+        """Streaming equivalent of `identify_types.identify_type`."""
+        if self.all_binary or self.min_value == self.max_value:
+            return identify_types.BINARY
+        elif 0 <= self.min_value and self.max_value <= 1:
+            return identify_types.PROBABILITY
+        elif self.min_value >= 0 and not self.distinct_overflow and self.all_integer:
+            return identify_types.ENUM
+        else:
+            return identify_types.CONTINUOUS
+
+    def identify_parameter(
+        self,
+        quantile_size=DEFAULT_MAX_QUANTILE_SIZE,
+        quantile_k2_threshold=DEFAULT_QUANTILE_K2_THRESHOLD,
+        skip_box_cox=False,
+        skip_quantiles=False,
+        feature_type=None,
+    ) -> NormalizationParameters:
+        if feature_type is None:
+            feature_type = self.identify_type()
+
+        boxcox_lambda = None
+        boxcox_shift = 0
+        mean = 0
+        stddev = 1
+        possible_values = None
+        quantiles = None
+        assert feature_type in [
+            identify_types.CONTINUOUS,
+            identify_types.PROBABILITY,
+            identify_types.BINARY,
+            identify_types.ENUM,
+        ], "unknown type {}".format(feature_type)
+        assert (
+            self.count >= MINIMUM_SAMPLES_TO_IDENTIFY
+        ), "insufficient information to identify parameter"
+
+        min_value = self.min_value
+        max_value = self.max_value
+        boxcox_moments = None
+        if feature_type == identify_types.CONTINUOUS:
+            assert min_value < max_value, "Binary feature marked as continuous"
+            k2_original, p_original = normaltest_from_moments(
+                self.count, self.moments.skew(), self.moments.kurtosis()
+            )
+
+            # shift can be estimated but not in scipy
+            boxcox_shift = float(min_value * -1)
+            candidate_values, lmbda = stats.boxcox(
+                np.maximum(self.reservoir.values + boxcox_shift, BOX_COX_MARGIN)
+            )
+            candidate_moments = StreamingMoments().update(candidate_values)
+            # Scale the test to the full stream: K^2 grows linearly with the
+            # number of samples for a fixed departure from normality.
+            k2_boxcox, p_boxcox = normaltest_from_moments(
+                self.count, candidate_moments.skew(), candidate_moments.kurtosis()
+            )
+            logger.info(
+                "Feature stats.  Original K2: {} P: {} Boxcox K2: {} P: {}".format(
+                    k2_original, p_original, k2_boxcox, p_boxcox
+                )
+            )
+            if lmbda < 0.9 or lmbda > 1.1:
+                # Lambda is far enough from 1.0 to be worth doing boxcox
+                if k2_original > k2_boxcox * 10 and k2_boxcox <= quantile_k2_threshold:
+                    stddev = candidate_moments.std(ddof=1)
+                    if (
+                        np.isfinite(stddev)
+                        and stddev < BOX_COX_MAX_STDDEV
+                        and not np.isclose(stddev, 0)
+                    ):
+                        boxcox_moments = candidate_moments
+                        boxcox_lambda = float(lmbda)
+            if boxcox_lambda is None or skip_box_cox:
+                boxcox_shift = None
+                boxcox_lambda = None
+            if boxcox_lambda is not None:
+                feature_type = identify_types.BOXCOX
+            if (
+                boxcox_lambda is None
+                and k2_original > quantile_k2_threshold
+                and (not skip_quantiles)
+            ):
+                feature_type = identify_types.QUANTILE
+                quantiles = (
+                    np.unique(
+                        mquantiles(
+                            self.reservoir.values,
+                            np.arange(quantile_size + 1, dtype=np.float64)
+                            / float(quantile_size),
+                            alphap=0.0,
+                            betap=1.0,
+                        )
+                    )
+                    .astype(float)
+                    .tolist()
+                )
+                logger.info(
+                    "Feature is non-normal, using quantiles: {}".format(quantiles)
+                )
+
+        if feature_type == identify_types.CONTINUOUS:
+            mean = float(self.moments.mean)
+            stddev = self.moments.std(ddof=1)
+        elif feature_type == identify_types.BOXCOX:
+            mean = float(boxcox_moments.mean)
+            stddev = boxcox_moments.std(ddof=1)
+        if (
+            feature_type == identify_types.CONTINUOUS
+            or feature_type == identify_types.BOXCOX
+        ):
+            if np.isclose(stddev, 0) or not np.isfinite(stddev):
+                stddev = 1
+
+        if feature_type == identify_types.ENUM:
+            assert (
+                not self.distinct_overflow
+            ), "More than {} distinct values seen for ENUM feature".format(
+                self.max_unique_enum_values
+            )
+            possible_values = np.unique(self.distinct_values.astype(int)).tolist()
+
+        return NormalizationParameters(
+            feature_type,
+            boxcox_lambda,
+            boxcox_shift,
+            mean,
+            stddev,
+            possible_values,
+            quantiles,
+            min_value,
+            max_value,
+        )
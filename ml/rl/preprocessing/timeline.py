@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+
+"""
+Turns logged (mdp_id, sequence_number) rows into training transitions.
+
+Rows are sorted by (mdp_id, sequence_number) and every row that took an
+action is paired with the row after it in the same mdp. Terminal rows have
+no action (-1) and only end their mdp. Everything is done with array
+operations over all rows at once, so tens of millions of rows take seconds.
+"""
+
+import logging
+from typing import NamedTuple
+
+import numpy as np
+
+
+logger = logging.getLogger(__name__)
+
+
+class Timeline(NamedTuple):
+    # Index into the input rows of each transition's state row
+    rows: np.ndarray
+    # Index of the next row in the same mdp, or -1 if there is none
+    next_rows: np.ndarray
+    actions: np.ndarray
+    rewards: np.ndarray
+    # Action taken in the next row, or -1 if the transition is terminal
+    next_actions: np.ndarray
+    # Sequence number gap to the next row, 1 if there is none
+    time_diffs: np.ndarray
+    not_terminals: np.ndarray
+    # (transitions, num_actions) mask of the actions possible in the next row
+    possible_next_actions: np.ndarray
+    # Discounted sum of the rewards from the transition to the end of its mdp
+    episode_values: np.ndarray
+
+
+def discounted_suffix_sums(values, discounts) -> np.ndarray:
+    """
+    Returns x with x[i] = values[i] + discounts[i] * x[i + 1] (x[n] = 0).
+
+    A zero discount cuts the sum, which is how mdps are kept apart. The
+    recurrence is solved by pointer doubling: after k passes x[i] sums 2^k
+    terms, so the cost is O(n log(longest run of non-zero discounts)).
+    Unlike dividing a cumulative sum by gamma^t, every step multiplies
+    numbers no larger than one, so it stays accurate on long mdps.
+    """
+    sums = np.asarray(values, dtype=np.float64).copy()
+    factors = np.asarray(discounts, dtype=np.float64).copy()
+    factors[-1:] = 0
+    step = 1
+    while step < len(sums):
+        active = np.flatnonzero(factors[: len(sums) - step])
+        if len(active) == 0:
+            break
+        sums[active] += factors[active] * sums[active + step]
+        factors[active] *= factors[active + step]
+        step *= 2
+    return sums
+
+
+def build_timeline(
+    mdp_ids,
+    sequence_numbers,
+    actions,
+    rewards,
+    possible_action_offsets,
+    possible_action_ids,
+    num_actions: int,
+    gamma: float,
+    use_seq_num_diff_as_time_diff: bool = False,
+) -> Timeline:
+    """
+    :param mdp_ids: Episode id of every row. Any sortable dtype.
+    :param sequence_numbers: Position of every row in its mdp.
+    :param actions: Action id of every row, -1 for terminal rows.
+    :param rewards: Reward of every row.
+    :param possible_action_offsets: CSR offsets (rows + 1) into
+        `possible_action_ids` of the actions possible in every row.
+    :param num_actions: Number of action ids.
+    :param gamma: Discount factor of the episode values.
+    :param use_seq_num_diff_as_time_diff: Discount the episode values by
+        the sequence number gaps instead of once per row.
+    """
+    mdp_ids = np.asarray(mdp_ids)
+    sequence_numbers = np.asarray(sequence_numbers, dtype=np.int64)
+    actions = np.asarray(actions)
+    rewards = np.asarray(rewards, dtype=np.float32)
+    possible_action_offsets = np.asarray(possible_action_offsets, dtype=np.int64)
+    possible_action_ids = np.asarray(possible_action_ids)
+    num_rows = len(mdp_ids)
+
+    order = np.lexsort((sequence_numbers, mdp_ids))
+    sorted_mdp_ids = mdp_ids[order]
+    sorted_sequence_numbers = sequence_numbers[order]
+    # has_next[i]: the row after sorted row i is in the same mdp
+    has_next = np.zeros(num_rows, dtype=np.bool_)
+    has_next[:-1] = sorted_mdp_ids[1:] == sorted_mdp_ids[:-1]
+    gaps = np.ones(num_rows, dtype=np.int64)
+    gaps[:-1] = np.where(
+        has_next[:-1], sorted_sequence_numbers[1:] - sorted_sequence_numbers[:-1], 1
+    )
+
+    exponents = gaps if use_seq_num_diff_as_time_diff else 1
+    discounts = np.where(has_next, np.power(float(gamma), exponents), 0.0)
+    episode_values = discounted_suffix_sums(rewards[order], discounts)
+
+    transitions = np.flatnonzero(actions[order] >= 0)
+    rows = order[transitions]
+    next_rows = np.full(len(transitions), -1, dtype=np.int64)
+    with_next = has_next[transitions]
+    next_rows[with_next] = order[transitions[with_next] + 1]
+    next_actions = np.full(len(transitions), -1, dtype=actions.dtype)
+    next_actions[with_next] = actions[next_rows[with_next]]
+
+    possible_next_actions = np.zeros((len(transitions), num_actions), dtype=np.float32)
+    lengths = np.diff(possible_action_offsets)[next_rows[with_next]]
+    positions = np.repeat(np.flatnonzero(with_next), lengths)
+    entries = np.repeat(
+        possible_action_offsets[next_rows[with_next]] - np.cumsum(lengths) + lengths,
+        lengths,
+    ) + np.arange(lengths.sum())
+    possible_next_actions[positions, possible_action_ids[entries]] = 1
+
+    return Timeline(
+        rows=rows,
+        next_rows=next_rows,
+        actions=actions[rows],
+        rewards=rewards[rows],
+        next_actions=next_actions,
+        time_diffs=gaps[transitions],
+        not_terminals=next_actions >= 0,
+        possible_next_actions=possible_next_actions,
+        episode_values=episode_values[transitions].astype(np.float32),
+    )
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+
+import argparse
+import logging
+import sys
+import time
+
+import numpy as np
+from ml.rl.preprocessing import identify_types
+from ml.rl.preprocessing.drift_monitor import DriftMonitor
+from ml.rl.preprocessing.normalization import NormalizationParameters
+from ml.rl.preprocessing.preprocessor import Preprocessor
+
+
+logger = logging.getLogger(__name__)
+
+
+def make_parameters(num_features):
+    parameters = {}
+    for i in range(num_features):
+        if i % 2 == 0:
+            parameters[str(i)] = NormalizationParameters(
+                identify_types.CONTINUOUS, None, None, 0, 1, None, None, None, None
+            )
+        else:
+            parameters[str(i)] = NormalizationParameters(
+                identify_types.QUANTILE,
+                None,
+                None,
+                0,
+                1,
+                None,
+                np.sort(np.random.normal(size=21)).tolist(),
+                None,
+                None,
+            )
+    return parameters
+
+
+def benchmark(num_features, batch_size, num_batches, max_rows_per_batch):
+    np.random.seed(0)
+    parameters = make_parameters(num_features)
+    lengths = np.full(batch_size, num_features, dtype=np.int32)
+    keys = np.tile(np.arange(num_features, dtype=np.int64), batch_size)
+    values = np.random.normal(size=len(keys)).astype(np.float32)
+    preprocessor = Preprocessor(True)
+    monitor = DriftMonitor(
+        parameters, max_rows_per_batch=max_rows_per_batch, reference_rows=0
+    )
+
+    start_time = time.time()
+    for _ in range(num_batches):
+        preprocessor.normalize_sparse_matrix(lengths, keys, values, parameters)
+    preprocess_seconds = (time.time() - start_time) / num_batches
+
+    for _ in range(num_batches):
+        monitor.observe_sparse(lengths, keys, values)
+    monitor.log_report()
+    logger.info(
+        "{} features, batches of {}: preprocessing {:.2f}ms per batch, "
+        "drift monitor {:.2f}ms per batch ({} rows sampled)".format(
+            num_features,
+            batch_size,
+            1000 * preprocess_seconds,
+            1000 * monitor.seconds_per_batch(),
+            max_rows_per_batch,
+        )
+    )
+    return preprocess_seconds, monitor.seconds_per_batch()
+
+
+def main(args):
+    parser = argparse.ArgumentParser(
+        description="Benchmark the hot-path cost of the drift monitor."
+    )
+    parser.add_argument("--features", type=int, default=2000)
+    parser.add_argument("--batch_size", type=int, default=1024)
+    parser.add_argument("--batches", type=int, default=20)
+    parser.add_argument("--max_rows_per_batch", type=int, default=256)
+    args = parser.parse_args(args)
+    benchmark(args.features, args.batch_size, args.batches, args.max_rows_per_batch)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main(sys.argv[1:])
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+
+import argparse
+import logging
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+from ml.rl.preprocessing import binary_normalization, identify_types, normalization
+from ml.rl.preprocessing.normalization import NormalizationParameters
+
+
+logger = logging.getLogger(__name__)
+
+
+def make_parameters(num_features, seed=0):
+    """Builds a parameter map with a mix of scalar, ENUM and QUANTILE features."""
+    np.random.seed(seed)
+    parameters = {}
+    for i in range(num_features):
+        kind = i % 4
+        if kind == 0:
+            parameters[i] = NormalizationParameters(
+                identify_types.ENUM,
+                None,
+                None,
+                0,
+                1,
+                sorted(np.random.choice(1000, 50, replace=False).tolist()),
+                None,
+                0,
+                999,
+            )
+        elif kind == 1:
+            parameters[i] = NormalizationParameters(
+                identify_types.QUANTILE,
+                None,
+                None,
+                0,
+                1,
+                None,
+                np.sort(np.random.normal(size=21)).tolist(),
+                -3.0,
+                3.0,
+            )
+        elif kind == 2:
+            parameters[i] = NormalizationParameters(
+                identify_types.BOXCOX,
+                float(np.random.rand()),
+                1.0,
+                float(np.random.normal()),
+                float(np.random.rand() + 0.5),
+                None,
+                None,
+                -1.0,
+                10.0,
+            )
+        else:
+            parameters[i] = NormalizationParameters(
+                identify_types.CONTINUOUS,
+                None,
+                None,
+                float(np.random.normal()),
+                float(np.random.rand() + 0.5),
+                None,
+                None,
+                -5.0,
+                5.0,
+            )
+    return parameters
+
+
+def benchmark(num_features, num_lookups):
+    parameters = make_parameters(num_features)
+    parameters_json = normalization.serialize(parameters)
+    lookups = np.random.choice(num_features, num_lookups).tolist()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, "normalization.bin")
+        binary_normalization.save(parameters, path)
+
+        start_time = time.time()
+        from_json = normalization.deserialize(parameters_json)
+        json_seconds = time.time() - start_time
+
+        start_time = time.time()
+        loaded = binary_normalization.load(path)
+        open_seconds = time.time() - start_time
+
+        start_time = time.time()
+        for feature in lookups:
+            loaded[feature]
+        lookup_seconds = time.time() - start_time
+
+        start_time = time.time()
+        from_binary = loaded.to_dict()
+        full_seconds = time.time() - start_time
+
+    assert len(from_json) == len(from_binary)
+    logger.info(
+        "{} features: JSON deserialize {:.3f}s, binary open {:.4f}s, "
+        "{} lookups {:.4f}s, full binary load {:.3f}s".format(
+            num_features,
+            json_seconds,
+            open_seconds,
+            num_lookups,
+            lookup_seconds,
+            full_seconds,
+        )
+    )
+    return json_seconds, open_seconds, lookup_seconds, full_seconds
+
+
+def main(args):
+    parser = argparse.ArgumentParser(
+        description="Benchmark JSON vs binary normalization parameter loading."
+    )
+    parser.add_argument("--features", type=int, default=100000)
+    parser.add_argument("--lookups", type=int, default=1000)
+    args = parser.parse_args(args)
+    benchmark(args.features, args.lookups)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main(sys.argv[1:])
@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+
+import argparse
+import logging
+import sys
+import tempfile
+import time
+
+import numpy as np
+from ml.rl.training.replay_memory import PrioritizedReplayMemory, ReplayMemory
+from ml.rl.training.replay_storage import MemoryMappedColumnStorage
+
+
+logger = logging.getLogger(__name__)
+
+
+def fill(memory, num_transitions, state_dim, action_dim):
+    states = np.random.normal(size=(num_transitions, state_dim)).astype(np.float32)
+    actions = np.eye(action_dim, dtype=np.float32)[
+        np.random.randint(action_dim, size=num_transitions)
+    ]
+    possible_next_actions = [1] * action_dim
+    for i in range(num_transitions):
+        memory.insert(
+            states[i],
+            actions[i],
+            np.float32(i),
+            states[i],
+            actions[i],
+            False,
+            possible_next_actions,
+            action_dim,
+            1,
+        )
+
+
+def list_sample(replay_memory, batch_size):
+    """How minibatches were sampled from the list of tuples memory"""
+    cols = [[], [], [], [], [], [], [], [], []]
+    indices = np.random.permutation(len(replay_memory))[:batch_size]
+    for idx in indices:
+        for col, value in zip(cols, replay_memory[idx]):
+            col.append(value)
+    return [np.array(col) for col in cols]
+
+
+def benchmark(
+    capacity, state_dim, action_dim, batch_size, num_batches, prioritized, path=None
+):
+    np.random.seed(0)
+    storage = None if path is None else MemoryMappedColumnStorage(path)
+    if prioritized:
+        memory = PrioritizedReplayMemory(capacity, storage=storage)
+    else:
+        memory = ReplayMemory(capacity, storage=storage)
+    start_time = time.time()
+    fill(memory, capacity, state_dim, action_dim)
+    logger.info(
+        "Inserted {} transitions in {:.2f}s".format(capacity, time.time() - start_time)
+    )
+
+    start_time = time.time()
+    for _ in range(num_batches):
+        page = memory.sample(batch_size)
+        if prioritized:
+            memory.update_priorities(
+                page.replay_indices, np.random.normal(size=batch_size)
+            )
+    seconds = time.time() - start_time
+    logger.info(
+        "{}: {} batches of {} in {:.3f}s ({:.0f}k transitions per "
+        "second)".format(
+            type(memory).__name__,
+            num_batches,
+            batch_size,
+            seconds,
+            num_batches * batch_size / seconds / 1000,
+        )
+    )
+    if storage is not None:
+        storage.log_report()
+
+    columns = [memory.columns[name] for name in sorted(memory.columns)]
+    replay_memory = list(zip(*columns))
+    start_time = time.time()
+    for _ in range(num_batches):
+        list_sample(replay_memory, batch_size)
+    list_seconds = time.time() - start_time
+    logger.info(
+        "List of tuples: {} batches of {} in {:.3f}s ({:.1f}x slower)".format(
+            num_batches, batch_size, list_seconds, list_seconds / seconds
+        )
+    )
+    return seconds
+
+
+def main(args):
+    parser = argparse.ArgumentParser(
+        description="Benchmark sampling minibatches from replay memory."
+    )
+    parser.add_argument("--capacity", type=int, default=1000000)
+    parser.add_argument("--state_dim", type=int, default=8)
+    parser.add_argument("--action_dim", type=int, default=4)
+    parser.add_argument("--batch_size", type=int, default=1024)
+    parser.add_argument("--batches", type=int, default=100)
+    parser.add_argument(
+        "--prioritized",
+        action="store_true",
+        help="Sample by priority and update the priorities of every batch.",
+    )
+    parser.add_argument(
+        "--memory_mapped",
+        action="store_true",
+        help="Keep the memory in memory-mapped files in a temporary directory.",
+    )
+    args = parser.parse_args(args)
+    with tempfile.TemporaryDirectory() as path:
+        benchmark(
+            args.capacity,
+            args.state_dim,
+            args.action_dim,
+            args.batch_size,
+            args.batches,
+            args.prioritized,
+            path if args.memory_mapped else None,
+        )
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main(sys.argv[1:])
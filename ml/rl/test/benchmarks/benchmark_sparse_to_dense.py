@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+
+import argparse
+import logging
+import sys
+import time
+
+import numpy as np
+from ml.rl.preprocessing import identify_types
+from ml.rl.preprocessing.feature_index import FeatureIndex
+from ml.rl.preprocessing.normalization import MISSING_VALUE, NormalizationParameters
+
+
+logger = logging.getLogger(__name__)
+
+
+def make_batch(num_features, num_rows, features_per_row, seed=0):
+    """Random 64-bit feature ids and a batch of sparse rows over them."""
+    np.random.seed(seed)
+    feature_ids = np.unique(
+        np.random.randint(0, 2 ** 62, size=num_features, dtype=np.int64)
+    )
+    parameters = {
+        str(feature_id): NormalizationParameters(
+            identify_types.CONTINUOUS, None, None, 0, 1, None, None, None, None
+        )
+        for feature_id in feature_ids.tolist()
+    }
+    lengths = np.random.randint(
+        0, 2 * features_per_row, size=num_rows, dtype=np.int32
+    )
+    keys = np.random.choice(feature_ids, lengths.sum())
+    values = np.random.normal(size=lengths.sum()).astype(np.float32)
+    return parameters, lengths, keys, values
+
+
+def dict_densify(column_by_id, num_features, lengths, keys, values):
+    """Per-entry dictionary lookups, the approach FeatureIndex replaces."""
+    dense = np.full((len(lengths), num_features), MISSING_VALUE, dtype=np.float32)
+    offset = 0
+    for row, length in enumerate(lengths.tolist()):
+        for key, value in zip(
+            keys[offset : offset + length].tolist(),
+            values[offset : offset + length].tolist(),
+        ):
+            column = column_by_id.get(key)
+            if column is not None:
+                dense[row, column] = value
+        offset += length
+    return dense
+
+
+def benchmark(num_features, num_rows, features_per_row):
+    parameters, lengths, keys, values = make_batch(
+        num_features, num_rows, features_per_row
+    )
+
+    start_time = time.time()
+    index = FeatureIndex.from_normalization(parameters)
+    build_seconds = time.time() - start_time
+    column_by_id = {
+        feature_id: column
+        for column, feature_id in enumerate(index.feature_ids.tolist())
+    }
+
+    start_time = time.time()
+    expected = dict_densify(column_by_id, len(index), lengths, keys, values)
+    dict_seconds = time.time() - start_time
+
+    start_time = time.time()
+    actual = index.densify(lengths, keys, values)
+    index_seconds = time.time() - start_time
+
+    np.testing.assert_array_equal(actual, expected)
+    logger.info(
+        "{} features, {} rows, {} entries: index build {:.3f}s, "
+        "dict lookups {:.3f}s, FeatureIndex.densify {:.3f}s ({:.1f}x)".format(
+            len(index),
+            num_rows,
+            len(keys),
+            build_seconds,
+            dict_seconds,
+            index_seconds,
+            dict_seconds / max(index_seconds, 1e-9),
+        )
+    )
+    return dict_seconds, index_seconds
+
+
+def main(args):
+    parser = argparse.ArgumentParser(
+        description="Benchmark sparse-to-dense conversion over a large vocabulary."
+    )
+    parser.add_argument("--features", type=int, default=50000)
+    parser.add_argument("--rows", type=int, default=1024)
+    parser.add_argument("--features_per_row", type=int, default=32)
+    args = parser.parse_args(args)
+    benchmark(args.features, args.rows, args.features_per_row)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main(sys.argv[1:])
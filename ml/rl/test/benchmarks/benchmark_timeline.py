@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+
+import argparse
+import logging
+import sys
+import time
+
+import numpy as np
+from ml.rl.preprocessing.timeline import build_timeline
+
+
+logger = logging.getLogger(__name__)
+
+
+def make_rows(num_rows, mean_mdp_length, num_actions):
+    random = np.random.RandomState(0)
+    mdp_ids = np.sort(random.randint(0, num_rows // mean_mdp_length, num_rows))
+    starts = np.flatnonzero(np.diff(mdp_ids, prepend=-1))
+    ends = np.append(starts[1:], num_rows)
+    # Sequence numbers with gaps, counted from the start of every mdp
+    totals = np.cumsum(random.randint(1, 3, num_rows))
+    sequence_numbers = totals - np.repeat(totals[starts], ends - starts)
+    actions = random.randint(0, num_actions, num_rows).astype(np.int32)
+    actions[ends - 1] = -1
+    rewards = random.normal(size=num_rows).astype(np.float32)
+
+    # Logged rows usually arrive out of order
+    order = random.permutation(num_rows)
+    actions = actions[order]
+    lengths = np.where(actions >= 0, num_actions, 0)
+    offsets = np.concatenate([[0], np.cumsum(lengths)])
+    possible_action_ids = np.tile(np.arange(num_actions), np.sum(actions >= 0))
+    return (
+        mdp_ids[order],
+        sequence_numbers[order],
+        actions,
+        rewards[order],
+        offsets,
+        possible_action_ids,
+    )
+
+
+def benchmark(num_rows, mean_mdp_length, num_actions):
+    mdp_ids, sequence_numbers, actions, rewards, offsets, ids = make_rows(
+        num_rows, mean_mdp_length, num_actions
+    )
+    start_time = time.time()
+    timeline = build_timeline(
+        mdp_ids,
+        sequence_numbers,
+        actions,
+        rewards,
+        offsets,
+        ids,
+        num_actions,
+        0.99,
+        use_seq_num_diff_as_time_diff=True,
+    )
+    seconds = time.time() - start_time
+    logger.info(
+        "{} rows, mdps of {} rows on average: {} transitions in {:.2f}s "
+        "({:.0f}k rows per second)".format(
+            num_rows,
+            mean_mdp_length,
+            len(timeline.rows),
+            seconds,
+            num_rows / seconds / 1000,
+        )
+    )
+    return seconds
+
+
+def main(args):
+    parser = argparse.ArgumentParser(
+        description="Benchmark building transitions from logged rows."
+    )
+    parser.add_argument("--rows", type=int, default=1000000)
+    parser.add_argument("--mean_mdp_length", type=int, default=200)
+    parser.add_argument("--actions", type=int, default=4)
+    args = parser.parse_args(args)
+    benchmark(args.rows, args.mean_mdp_length, args.actions)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main(sys.argv[1:])
@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+
+import argparse
+import logging
+import sys
+import time
+
+import numpy as np
+from ml.rl.preprocessing import identify_types
+from scipy import stats
+
+
+logger = logging.getLogger(__name__)
+
+
+def make_matrix(num_rows, num_features, seed=0):
+    """Builds a matrix with an even mix of every detectable feature type."""
+    np.random.seed(seed)
+    generators = [
+        lambda: stats.bernoulli.rvs(0.5, size=num_rows),
+        lambda: stats.beta.rvs(a=2.0, b=2.0, size=num_rows),
+        lambda: stats.randint.rvs(0, 100, size=num_rows),
+        lambda: stats.norm.rvs(size=num_rows),
+        lambda: stats.randint.rvs(0, 10 * num_rows, size=num_rows),
+    ]
+    columns = [generators[i % len(generators)]() for i in range(num_features)]
+    return np.stack(columns, axis=1).astype(np.float32)
+
+
+def benchmark(num_rows, num_features):
+    matrix = make_matrix(num_rows, num_features)
+
+    start_time = time.time()
+    per_feature = [
+        identify_types.identify_type(matrix[:, i]) for i in range(num_features)
+    ]
+    per_feature_seconds = time.time() - start_time
+
+    start_time = time.time()
+    columnar = identify_types.identify_types_dense(matrix)
+    columnar_seconds = time.time() - start_time
+
+    assert per_feature == columnar, "Columnar detection disagrees with identify_type"
+    logger.info(
+        "{} rows x {} features: per-feature {:.3f}s, columnar {:.3f}s ({:.1f}x)".format(
+            num_rows,
+            num_features,
+            per_feature_seconds,
+            columnar_seconds,
+            per_feature_seconds / columnar_seconds,
+        )
+    )
+    return per_feature_seconds, columnar_seconds
+
+
+def main(args):
+    parser = argparse.ArgumentParser(
+        description="Benchmark per-feature vs columnar type identification."
+    )
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--features", type=int, default=100)
+    args = parser.parse_args(args)
+    benchmark(args.rows, args.features)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main(sys.argv[1:])
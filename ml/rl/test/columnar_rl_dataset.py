@@ -0,0 +1,618 @@
+#!/usr/bin/env python3
+
+"""
+Chunked columnar storage for RL samples.
+
+A dataset is a directory holding `metadata.json` and one row group file
+per `row_group_size` rows. Each row group stores its columns as flat
+arrays (see `ml.rl.array_file`):
+
+    mdp_id                int64
+    sequence_number       int32
+    state_offsets         int64, CSR offsets into state_keys/state_values
+    state_keys            int32
+    state_values          float32
+    action                int32 id into metadata["actions"], -1 for None
+    reward                float32
+    possible_action_offsets int64, CSR offsets into possible_action_ids
+    possible_action_ids   int32
+
+The metadata keeps the mdp_id and sequence_number range of every row
+group, so readers can skip the row groups a query does not need, and the
+row group files are memory-mapped rather than parsed.
+"""
+
+import json
+import logging
+import os
+import queue
+import threading
+from typing import Dict, Iterator, List, Optional
+
+import numpy as np
+from ml.rl.array_file import read_arrays, write_arrays
+from ml.rl.preprocessing.timeline import build_timeline
+from ml.rl.training.training_data_page import TrainingDataPage
+
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"RLCOLS01"
+METADATA_FILE = "metadata.json"
+DEFAULT_ROW_GROUP_SIZE = 65536
+# Row groups the streaming writer may hold while they wait to be written
+DEFAULT_MAX_PENDING_ROW_GROUPS = 2
+
+
+def _offsets(lengths) -> np.ndarray:
+    offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    return offsets
+
+
+def _row_group_file(index: int) -> str:
+    return "row_group_{:06d}.bin".format(index)
+
+
+class ColumnarRLDataset(object):
+    def __init__(self, path: str, row_group_size: int = DEFAULT_ROW_GROUP_SIZE):
+        """
+        Writes or reads a columnar dataset in the directory `path`.
+
+        Rows are added with `insert`, which has the same signature as
+        `RLDataset.insert`, and written out one row group at a time.
+
+        :param row_group_size: Rows per row group file.
+        """
+        self.path = path
+        self.row_group_size = row_group_size
+        self.metadata: Dict = {"actions": [], "num_state_features": 0, "row_groups": []}
+        if os.path.exists(os.path.join(path, METADATA_FILE)):
+            with open(os.path.join(path, METADATA_FILE)) as f:
+                self.metadata = json.load(f)
+        self._action_ids = {a: i for i, a in enumerate(self.metadata["actions"])}
+        # Guards the metadata, which a background writer may be saving
+        self._metadata_lock = threading.Lock()
+        self._clear_buffer()
+
+    @classmethod
+    def from_rl_dataset(
+        cls, rl_dataset, path: str, row_group_size: int = DEFAULT_ROW_GROUP_SIZE
+    ) -> "ColumnarRLDataset":
+        """Converts the rows of a loaded `RLDataset` into a columnar dataset."""
+        dataset = cls(path, row_group_size)
+        for row in rl_dataset.rows:
+            state_features = row["state_features"]
+            dataset.insert(
+                row["mdp_id"],
+                row["sequence_number"],
+                [state_features[str(i)] for i in range(len(state_features))],
+                row["action"],
+                row["reward"],
+                row["possible_actions"],
+            )
+        return dataset.save()
+
+    def _clear_buffer(self) -> None:
+        self._mdp_ids: List[int] = []
+        self._sequence_numbers: List[int] = []
+        self._state_lengths: List[int] = []
+        self._state_keys: List[int] = []
+        self._state_values: List[float] = []
+        self._actions: List[int] = []
+        self._rewards: List[float] = []
+        self._possible_action_lengths: List[int] = []
+        self._possible_action_ids: List[int] = []
+
+    def _action_id(self, action: Optional[str]) -> int:
+        if action is None:
+            return -1
+        if action not in self._action_ids:
+            with self._metadata_lock:
+                self._action_ids[action] = len(self.metadata["actions"])
+                self.metadata["actions"].append(action)
+        return self._action_ids[action]
+
+    def insert(
+        self, mdp_id, sequence_number, state, action, reward, possible_actions
+    ) -> None:
+        """
+        Buffers one sample, writing a row group once `row_group_size` rows
+        are buffered.
+
+        :param mdp_id: Integer (or integer string) episode id.
+        :param state: Dense list of state feature values.
+        :param action: Action name, or None for a terminal row.
+        :param possible_actions: Names of the actions possible in `state`.
+        """
+        self._buffer_row(
+            mdp_id, sequence_number, state, action, reward, possible_actions
+        )
+        if len(self._mdp_ids) >= self.row_group_size:
+            self.flush()
+
+    def _buffer_row(
+        self, mdp_id, sequence_number, state, action, reward, possible_actions
+    ) -> None:
+        assert isinstance(state, list)
+        assert isinstance(sequence_number, int)
+        assert action is None or isinstance(action, str)
+        assert isinstance(reward, float)
+        assert isinstance(possible_actions, list)
+        self._mdp_ids.append(int(mdp_id))
+        self._sequence_numbers.append(sequence_number)
+        self._state_lengths.append(len(state))
+        self._state_keys.extend(range(len(state)))
+        self._state_values.extend(state)
+        self._actions.append(self._action_id(action))
+        self._rewards.append(reward)
+        self._possible_action_lengths.append(len(possible_actions))
+        self._possible_action_ids.extend(self._action_id(a) for a in possible_actions)
+
+    def _buffered_columns(self) -> Dict[str, np.ndarray]:
+        return {
+            "mdp_id": np.array(self._mdp_ids, dtype=np.int64),
+            "sequence_number": np.array(self._sequence_numbers, dtype=np.int32),
+            "state_offsets": _offsets(self._state_lengths),
+            "state_keys": np.array(self._state_keys, dtype=np.int32),
+            "state_values": np.array(self._state_values, dtype=np.float32),
+            "action": np.array(self._actions, dtype=np.int32),
+            "reward": np.array(self._rewards, dtype=np.float32),
+            "possible_action_offsets": _offsets(self._possible_action_lengths),
+            "possible_action_ids": np.array(
+                self._possible_action_ids, dtype=np.int32
+            ),
+        }
+
+    def flush(self) -> None:
+        """Writes the buffered rows as a new row group."""
+        if not self._mdp_ids:
+            return
+        self.write_row_group(self._buffered_columns())
+        self._clear_buffer()
+
+    def write_row_group(self, columns: Dict[str, np.ndarray]) -> None:
+        """
+        Writes one row group of columns and records it in the metadata. The
+        metadata is only updated once the row group file is complete, so a
+        crash never leaves a listed, partial row group behind.
+        """
+        os.makedirs(self.path, exist_ok=True)
+        file_name = _row_group_file(len(self.metadata["row_groups"]))
+        write_arrays(os.path.join(self.path, file_name), MAGIC, columns)
+        mdp_ids = columns["mdp_id"]
+        sequence_numbers = columns["sequence_number"]
+        with self._metadata_lock:
+            self.metadata["num_state_features"] = max(
+                self.metadata["num_state_features"],
+                int(columns["state_keys"].max()) + 1
+                if len(columns["state_keys"])
+                else 0,
+            )
+            self.metadata["row_groups"].append(
+                {
+                    "file": file_name,
+                    "num_rows": len(mdp_ids),
+                    "min_mdp_id": int(mdp_ids.min()),
+                    "max_mdp_id": int(mdp_ids.max()),
+                    "min_sequence_number": int(sequence_numbers.min()),
+                    "max_sequence_number": int(sequence_numbers.max()),
+                }
+            )
+            # Replace atomically so readers never see a partial file
+            temp_path = os.path.join(self.path, METADATA_FILE + ".tmp")
+            with open(temp_path, "w") as f:
+                json.dump(self.metadata, f)
+            os.replace(temp_path, os.path.join(self.path, METADATA_FILE))
+
+    @property
+    def next_mdp_id(self) -> int:
+        """One more than the largest mdp_id written so far."""
+        return max(
+            (g["max_mdp_id"] + 1 for g in self.metadata["row_groups"]), default=0
+        )
+
+    def save(self):
+        """Writes any buffered rows. Same role as `RLDataset.save`."""
+        self.flush()
+        return self
+
+    def __len__(self) -> int:
+        return sum(g["num_rows"] for g in self.metadata["row_groups"]) + len(
+            self._mdp_ids
+        )
+
+    @property
+    def actions(self) -> List[str]:
+        return self.metadata["actions"]
+
+    def row_groups(
+        self, min_mdp_id: Optional[int] = None, max_mdp_id: Optional[int] = None
+    ) -> Iterator[Dict[str, np.ndarray]]:
+        """
+        Yields the columns of every written row group that may hold rows with
+        mdp_id in [min_mdp_id, max_mdp_id]. Other row groups are not opened.
+        The arrays are read-only views of a memory map.
+        """
+        for row_group in self.metadata["row_groups"]:
+            if min_mdp_id is not None and row_group["max_mdp_id"] < min_mdp_id:
+                continue
+            if max_mdp_id is not None and row_group["min_mdp_id"] > max_mdp_id:
+                continue
+            yield read_arrays(os.path.join(self.path, row_group["file"]), MAGIC)
+
+    def to_rows(self) -> List[Dict]:
+        """Returns every written row in the `RLDataset` JSON layout."""
+        rows = []
+        actions = self.actions
+        for columns in self.row_groups():
+            state_offsets = columns["state_offsets"]
+            possible_offsets = columns["possible_action_offsets"]
+            for i in range(len(columns["mdp_id"])):
+                keys = columns["state_keys"][state_offsets[i] : state_offsets[i + 1]]
+                values = columns["state_values"][
+                    state_offsets[i] : state_offsets[i + 1]
+                ]
+                action = int(columns["action"][i])
+                rows.append(
+                    {
+                        "ds": "None",
+                        "mdp_id": str(columns["mdp_id"][i]),
+                        "sequence_number": int(columns["sequence_number"][i]),
+                        "state_features": {
+                            str(k): float(v)
+                            for k, v in zip(keys.tolist(), values.tolist())
+                        },
+                        "action": None if action < 0 else actions[action],
+                        "reward": float(columns["reward"][i]),
+                        "possible_actions": [
+                            actions[a]
+                            for a in columns["possible_action_ids"][
+                                possible_offsets[i] : possible_offsets[i + 1]
+                            ].tolist()
+                        ],
+                    }
+                )
+        return rows
+
+    def _dense_states(self, columns, rows) -> np.ndarray:
+        positions, entries = _csr_entries(columns["state_offsets"], rows)
+        states = np.zeros(
+            (len(rows), self.metadata["num_state_features"]), dtype=np.float32
+        )
+        states[positions, columns["state_keys"][entries]] = columns["state_values"][
+            entries
+        ]
+        return states
+
+    def _one_hot(self, action_ids) -> np.ndarray:
+        one_hot = np.zeros((len(action_ids), len(self.actions)), dtype=np.float32)
+        valid = np.flatnonzero(action_ids >= 0)
+        one_hot[valid, action_ids[valid]] = 1
+        return one_hot
+
+    def _possible_actions_mask(self, columns, rows) -> np.ndarray:
+        positions, entries = _csr_entries(columns["possible_action_offsets"], rows)
+        mask = np.zeros((len(rows), len(self.actions)), dtype=np.float32)
+        mask[positions, columns["possible_action_ids"][entries]] = 1
+        return mask
+
+    def _transitions(
+        self, columns, final: bool, min_mdp_id=None, max_mdp_id=None
+    ) -> Optional[TrainingDataPage]:
+        """
+        Pairs every row that took an action with the row after it, when that
+        row is in the same mdp; otherwise the transition is terminal. Unless
+        `final`, the last row is skipped, as its successor may be in the
+        next row group.
+        """
+        mdp_ids = columns["mdp_id"]
+        num_rows = len(mdp_ids) if final else len(mdp_ids) - 1
+        has_action = columns["action"][:num_rows] >= 0
+        if min_mdp_id is not None:
+            has_action &= mdp_ids[:num_rows] >= min_mdp_id
+        if max_mdp_id is not None:
+            has_action &= mdp_ids[:num_rows] <= max_mdp_id
+        rows = np.flatnonzero(has_action)
+        if len(rows) == 0:
+            return None
+        next_rows = np.minimum(rows + 1, len(mdp_ids) - 1)
+        same_mdp = (rows + 1 < len(mdp_ids)) & (mdp_ids[next_rows] == mdp_ids[rows])
+
+        next_actions = np.where(same_mdp, columns["action"][next_rows], -1)
+        next_states = self._dense_states(columns, next_rows)
+        next_states[~same_mdp] = 0
+        possible_next_actions = self._possible_actions_mask(columns, next_rows)
+        possible_next_actions[~same_mdp] = 0
+        sequence_numbers = columns["sequence_number"]
+        return TrainingDataPage(
+            states=self._dense_states(columns, rows),
+            actions=self._one_hot(columns["action"][rows]),
+            propensities=np.ones((len(rows), 1), dtype=np.float32),
+            rewards=np.array(columns["reward"][rows]).reshape(-1, 1),
+            next_states=next_states,
+            next_actions=self._one_hot(next_actions),
+            possible_next_actions=possible_next_actions,
+            not_terminals=(next_actions >= 0).reshape(-1, 1),
+            time_diffs=np.where(
+                same_mdp, sequence_numbers[next_rows] - sequence_numbers[rows], 1
+            ),
+        )
+
+    def pages(
+        self,
+        minibatch_size: int,
+        min_mdp_id: Optional[int] = None,
+        max_mdp_id: Optional[int] = None,
+    ) -> Iterator[TrainingDataPage]:
+        """
+        Streams discrete-action TrainingDataPages of `minibatch_size`
+        transitions (the last one may be smaller), reading one row group at
+        a time. Rows must be stored in (mdp_id, sequence_number) order, as
+        `insert` from a simulation loop does.
+
+        :param min_mdp_id: If set, only rows with a larger or equal mdp_id
+            are used and row groups without any are skipped.
+        :param max_mdp_id: Likewise, an upper bound.
+        """
+        pending: List[TrainingDataPage] = []
+        num_pending = 0
+        previous_last_row = None
+        for columns in self.row_groups(min_mdp_id, max_mdp_id):
+            num_rows = len(columns["mdp_id"])
+            if num_rows == 0:
+                continue
+            pages = []
+            if previous_last_row is not None:
+                # The transition that spans two row groups
+                boundary = _concat_columns(
+                    [previous_last_row, _take_rows(columns, np.array([0]))]
+                )
+                pages.append(
+                    self._transitions(boundary, False, min_mdp_id, max_mdp_id)
+                )
+            pages.append(self._transitions(columns, False, min_mdp_id, max_mdp_id))
+            previous_last_row = _take_rows(columns, np.array([num_rows - 1]))
+
+            for page in pages:
+                if page is not None:
+                    pending.append(page)
+                    num_pending += len(page.states)
+            while num_pending >= minibatch_size:
+                merged = _concat_pages(pending)
+                yield _slice_page(merged, 0, minibatch_size)
+                num_pending -= minibatch_size
+                pending = [_slice_page(merged, minibatch_size, len(merged.states))]
+        if previous_last_row is not None:
+            page = self._transitions(previous_last_row, True, min_mdp_id, max_mdp_id)
+            if page is not None:
+                pending.append(page)
+                num_pending += len(page.states)
+        while num_pending > 0:
+            merged = _concat_pages(pending)
+            yield _slice_page(merged, 0, minibatch_size)
+            num_pending = max(0, num_pending - minibatch_size)
+            pending = [_slice_page(merged, minibatch_size, len(merged.states))]
+
+    def timeline_page(
+        self,
+        gamma: float,
+        use_seq_num_diff_as_time_diff: bool = False,
+        min_mdp_id: Optional[int] = None,
+        max_mdp_id: Optional[int] = None,
+    ) -> Optional[TrainingDataPage]:
+        """
+        Returns every transition as one TrainingDataPage, built with
+        `build_timeline`. Unlike `pages`, rows may be stored in any order and
+        the page has discounted `episode_values`, but all selected row groups
+        are loaded at once.
+        """
+        column_sets = list(self.row_groups(min_mdp_id, max_mdp_id))
+        if not column_sets:
+            return None
+        columns = _concat_columns(column_sets)
+        if min_mdp_id is not None or max_mdp_id is not None:
+            mdp_ids = columns["mdp_id"]
+            selected = np.ones(len(mdp_ids), dtype=np.bool_)
+            if min_mdp_id is not None:
+                selected &= mdp_ids >= min_mdp_id
+            if max_mdp_id is not None:
+                selected &= mdp_ids <= max_mdp_id
+            columns = _take_rows(columns, np.flatnonzero(selected))
+        timeline = build_timeline(
+            columns["mdp_id"],
+            columns["sequence_number"],
+            columns["action"],
+            columns["reward"],
+            columns["possible_action_offsets"],
+            columns["possible_action_ids"],
+            len(self.actions),
+            gamma,
+            use_seq_num_diff_as_time_diff,
+        )
+        has_next = timeline.next_rows >= 0
+        next_states = np.zeros(
+            (len(timeline.rows), self.metadata["num_state_features"]),
+            dtype=np.float32,
+        )
+        next_states[has_next] = self._dense_states(
+            columns, timeline.next_rows[has_next]
+        )
+        return TrainingDataPage(
+            states=self._dense_states(columns, timeline.rows),
+            actions=self._one_hot(timeline.actions),
+            propensities=np.ones((len(timeline.rows), 1), dtype=np.float32),
+            rewards=timeline.rewards.reshape(-1, 1),
+            next_states=next_states,
+            next_actions=self._one_hot(timeline.next_actions),
+            possible_next_actions=timeline.possible_next_actions,
+            episode_values=timeline.episode_values.reshape(-1, 1),
+            not_terminals=timeline.not_terminals.reshape(-1, 1),
+            time_diffs=timeline.time_diffs,
+        )
+
+
+class StreamingRLDatasetWriter(object):
+    def __init__(
+        self,
+        path: str,
+        row_group_size: int = DEFAULT_ROW_GROUP_SIZE,
+        max_pending_row_groups: int = DEFAULT_MAX_PENDING_ROW_GROUPS,
+        resume: bool = True,
+    ) -> None:
+        """
+        Append-only writer of a `ColumnarRLDataset`.
+
+        `insert` only buffers the row. Every `row_group_size` rows the buffer
+        is converted to arrays and handed to a background thread that writes
+        the row group, so memory stays bounded by `max_pending_row_groups`
+        row groups however long the run is. `insert` blocks when that many
+        are waiting to be written.
+
+        :param resume: If `path` already holds a dataset, append to it.
+            Inserted mdp_ids are shifted past the ones already written, so a
+            resumed run that numbers its episodes from 0 again does not mix
+            its episodes with the old ones. Rows buffered but not written
+            before a crash are lost; written row groups are always complete.
+        """
+        if not resume and os.path.exists(os.path.join(path, METADATA_FILE)):
+            raise Exception("Dataset already exists at {}".format(path))
+        self.dataset = ColumnarRLDataset(path, row_group_size)
+        self.mdp_id_offset = self.dataset.next_mdp_id
+        if self.mdp_id_offset > 0:
+            logger.info(
+                "Resuming dataset {} with {} rows, mdp_ids start at {}".format(
+                    path, len(self.dataset), self.mdp_id_offset
+                )
+            )
+        self._queue: queue.Queue = queue.Queue(max_pending_row_groups)
+        self._error: Optional[BaseException] = None
+        self._thread = threading.Thread(target=self._write_loop, daemon=True)
+        self._thread.start()
+
+    def _write_loop(self) -> None:
+        while True:
+            columns = self._queue.get()
+            if columns is None:
+                return
+            if self._error is not None:
+                # Keep draining after a failure so `flush` and `close` never
+                # block on a full queue
+                continue
+            try:
+                self.dataset.write_row_group(columns)
+            except BaseException as e:
+                logger.exception("Failed to write row group")
+                self._error = e
+
+    def _check_error(self) -> None:
+        if self._error is not None:
+            raise Exception("Background dataset write failed") from self._error
+
+    def insert(
+        self, mdp_id, sequence_number, state, action, reward, possible_actions
+    ) -> None:
+        """Same as `RLDataset.insert`."""
+        self.dataset._buffer_row(
+            int(mdp_id) + self.mdp_id_offset,
+            sequence_number,
+            state,
+            action,
+            reward,
+            possible_actions,
+        )
+        if len(self.dataset._mdp_ids) >= self.dataset.row_group_size:
+            self.flush()
+
+    def flush(self) -> None:
+        """Hands the buffered rows to the background thread."""
+        self._check_error()
+        if self.dataset._mdp_ids:
+            self._queue.put(self.dataset._buffered_columns())
+            self.dataset._clear_buffer()
+
+    def close(self) -> ColumnarRLDataset:
+        """Writes the remaining rows and waits for the background thread."""
+        if self._thread.is_alive():
+            try:
+                self.flush()
+            finally:
+                self._queue.put(None)
+                self._thread.join()
+        self._check_error()
+        return self.dataset
+
+    def save(self):
+        """Same as `close`, for code written against `RLDataset`."""
+        self.close()
+        return self
+
+
+# Columns with one entry per row, and CSR offsets -> the columns they index
+_ROW_COLUMNS = ["mdp_id", "sequence_number", "action", "reward"]
+_CSR_COLUMNS = {
+    "state_offsets": ["state_keys", "state_values"],
+    "possible_action_offsets": ["possible_action_ids"],
+}
+
+
+def _csr_entries(offsets, rows):
+    """
+    Returns (position of the row in `rows`, index into the value columns)
+    for every CSR entry of `rows`.
+    """
+    lengths = offsets[rows + 1] - offsets[rows]
+    positions = np.repeat(np.arange(len(rows)), lengths)
+    starts = offsets[rows] - (np.cumsum(lengths) - lengths)
+    return positions, np.repeat(starts, lengths) + np.arange(len(positions))
+
+
+def _take_rows(columns, rows):
+    taken = {name: np.array(columns[name][rows]) for name in _ROW_COLUMNS}
+    for offsets_name, value_names in _CSR_COLUMNS.items():
+        offsets = columns[offsets_name]
+        _, entries = _csr_entries(offsets, rows)
+        taken[offsets_name] = _offsets(offsets[rows + 1] - offsets[rows])
+        for name in value_names:
+            taken[name] = np.array(columns[name][entries])
+    return taken
+
+
+def _concat_columns(column_sets):
+    concatenated = {
+        name: np.concatenate([columns[name] for columns in column_sets])
+        for name in _ROW_COLUMNS
+    }
+    for offsets_name, value_names in _CSR_COLUMNS.items():
+        all_offsets = [columns[offsets_name] for columns in column_sets]
+        shifts = np.cumsum([0] + [offsets[-1] for offsets in all_offsets[:-1]])
+        concatenated[offsets_name] = np.concatenate(
+            [offsets[:-1] + shift for offsets, shift in zip(all_offsets, shifts)]
+            + [all_offsets[-1][-1:] + shifts[-1]]
+        )
+        for name in value_names:
+            concatenated[name] = np.concatenate(
+                [columns[name] for columns in column_sets]
+            )
+    return concatenated
+
+
+def _slice_page(page, start, end):
+    fields = {}
+    for name in TrainingDataPage.__slots__:
+        value = getattr(page, name)
+        fields[name] = None if value is None else value[start:end]
+    return TrainingDataPage(**fields)
+
+
+def _concat_pages(pages):
+    if len(pages) == 1:
+        return pages[0]
+    return TrainingDataPage(
+        **{
+            name: None
+            if getattr(pages[0], name) is None
+            else np.concatenate([getattr(page, name) for page in pages])
+            for name in TrainingDataPage.__slots__
+        }
+    )
@@ -3,18 +3,21 @@
 
 from typing import Dict, List
 
+import numpy as np
 from ml.rl.test.gridworld.gridworld_base import GridworldBase, Samples
 from ml.rl.training.training_data_page import TrainingDataPage
 
 
 class Gridworld(GridworldBase):
-    def generate_samples(self, num_transitions, epsilon, with_possible=True) -> Samples:
+    def generate_samples(
+        self, num_transitions, epsilon, with_possible=True, num_workers=1, seed=None
+    ) -> Samples:
         samples = self.generate_samples_discrete(
-            num_transitions, epsilon, with_possible
+            num_transitions, epsilon, with_possible, num_workers, seed
         )
         return samples
 
     def preprocess_samples(
-        self, samples: Samples, minibatch_size: int
+        self, samples: Samples, minibatch_size: int, state_dtype=np.float32
     ) -> List[TrainingDataPage]:
-        return self.preprocess_samples_discrete(samples, minibatch_size)
+        return self.preprocess_samples_discrete(samples, minibatch_size, state_dtype)
@@ -2,14 +2,15 @@
 
 
 import collections
+import itertools
+import operator
 import random
 from typing import Dict, List, NamedTuple, Optional, Tuple
 
 import numpy as np
-from caffe2.python import core, workspace
-from ml.rl.caffe_utils import C2, StackedAssociativeArray
-from ml.rl.preprocessing.preprocessor_net import PreprocessorNet
-from ml.rl.test.utils import default_normalizer
+from ml.rl.preprocessing.feature_index import FeatureIndex
+from ml.rl.preprocessing.preprocessor import Preprocessor
+from ml.rl.test.utils import default_normalizer, run_shards, shard_seeds
 from ml.rl.training.training_data_page import TrainingDataPage
 
 
@@ -57,43 +58,94 @@ class Samples(object):
         self.possible_next_actions = possible_next_actions
         self.reward_timelines = reward_timelines
 
+    @classmethod
+    def concat(cls, samples_list: List["Samples"]) -> "Samples":
+        """Concatenates the rows of `samples_list`, in order."""
+        fields = {}
+        for field in cls.__slots__:
+            values = [getattr(samples, field) for samples in samples_list]
+            if any(value is None for value in values):
+                fields[field] = None
+            else:
+                fields[field] = list(itertools.chain.from_iterable(values))
+        return cls(**fields)
+
     def shuffle(self):
-        # Shuffle
+        # Shuffles row indices, which consumes `random` exactly like shuffling
+        # the rows themselves
+        fields = Samples.__slots__
         if self.reward_timelines is None:
-            merged = list(
-                zip(
-                    self.states,
-                    self.actions,
-                    self.propensities,
-                    self.rewards,
-                    self.next_states,
-                    self.next_actions,
-                    self.is_terminal,
-                    self.possible_next_actions,
-                )
-            )
-            random.shuffle(merged)
-            self.states, self.actions, self.propensities, self.rewards, self.next_states, self.next_actions, self.is_terminal, self.possible_next_actions = zip(
-                *merged
-            )
-        else:
-            merged = list(
-                zip(
-                    self.states,
-                    self.actions,
-                    self.propensities,
-                    self.rewards,
-                    self.next_states,
-                    self.next_actions,
-                    self.is_terminal,
-                    self.possible_next_actions,
-                    self.reward_timelines,
-                )
-            )
-            random.shuffle(merged)
-            self.states, self.actions, self.propensities, self.rewards, self.next_states, self.next_actions, self.is_terminal, self.possible_next_actions, self.reward_timelines = zip(
-                *merged
-            )
+            fields = fields[:-1]
+        order = list(range(len(self.states)))
+        random.shuffle(order)
+        if len(order) < 2:
+            return
+        take = operator.itemgetter(*order)
+        for field in fields:
+            setattr(self, field, take(getattr(self, field)))
+
+
+def label_indices(labels, vocabulary: List[str]) -> np.ndarray:
+    """
+    Returns the index in `vocabulary` of every label, -1 for labels (like
+    the empty next action of terminal transitions) that are not in it.
+    """
+    if len(labels) == 0:
+        return np.zeros(0, dtype=np.int64)
+    unique_labels, inverse = np.unique(np.array(labels), return_inverse=True)
+    positions = {label: i for i, label in enumerate(vocabulary)}
+    lookup = np.array(
+        [positions.get(label, -1) for label in unique_labels.tolist()],
+        dtype=np.int64,
+    )
+    return lookup[inverse.ravel()]
+
+
+def one_hot(indices: np.ndarray, num_classes: int) -> np.ndarray:
+    """One-hot rows for `indices`, all-zero rows for -1."""
+    matrix = np.zeros([len(indices), num_classes], dtype=np.float32)
+    valid = np.flatnonzero(indices >= 0)
+    matrix[valid, indices[valid]] = 1
+    return matrix
+
+
+def flatten_lists(lists) -> Tuple[np.ndarray, List]:
+    """Returns (lengths, concatenated items): the CSR form of `lists`."""
+    lengths = np.fromiter(map(len, lists), dtype=np.int32, count=len(lists))
+    return lengths, list(itertools.chain.from_iterable(lists))
+
+
+def discounted_reward_timelines(reward_timelines) -> np.ndarray:
+    """
+    Sums reward * DISCOUNT ** time_diff over every {time_diff: reward}
+    timeline, as a (rows, 1) array.
+    """
+    num_rows = len(reward_timelines)
+    lengths = np.fromiter(map(len, reward_timelines), dtype=np.int64, count=num_rows)
+    chain = itertools.chain.from_iterable
+    time_diffs = np.fromiter(chain(reward_timelines), dtype=np.float64)
+    rewards = np.fromiter(chain(t.values() for t in reward_timelines), np.float64)
+    episode_values = np.bincount(
+        np.repeat(np.arange(num_rows), lengths),
+        weights=rewards * DISCOUNT ** time_diffs,
+        minlength=num_rows,
+    )
+    return episode_values.astype(np.float32).reshape(-1, 1)
+
+
+def minibatch_bounds(num_rows: int, minibatch_size: int) -> List[Tuple[int, int]]:
+    """(start, end) of every full minibatch; a last partial one is dropped."""
+    return [
+        (start, start + minibatch_size)
+        for start in range(0, num_rows - minibatch_size + 1, minibatch_size)
+    ]
+
+
+def slice_arrays(arrays: Dict[str, Optional[np.ndarray]], start: int, end: int):
+    return {
+        name: None if value is None else value[start:end]
+        for name, value in arrays.items()
+    }
 
 
 class GridworldBase(object):
@@ -126,6 +178,8 @@ class GridworldBase(object):
     def __init__(self):
         self.reset()
         self._optimal_policy = self._compute_optimal()
+        # (state, action) -> cumulative transition probabilities
+        self._transition_cdfs: Dict[Tuple[int, str], np.ndarray] = {}
 
     @property
     def normalization(self):
@@ -222,8 +276,14 @@ class GridworldBase(object):
         return probabilities
 
     def _no_cheat_step(self, state, action: str) -> int:
-        p = self.transition_probabilities(state, action)
-        return np.random.choice(self.size, p=p)
+        # Same draw as np.random.choice(self.size, p=p), without building p
+        # and validating it on every step
+        cdf = self._transition_cdfs.get((state, action))
+        if cdf is None:
+            cdf = np.cumsum(self.transition_probabilities(state, action))
+            cdf /= cdf[-1]
+            self._transition_cdfs[(state, action)] = cdf
+        return cdf.searchsorted(np.random.random_sample(), side="right")
 
     def step(
         self, action: str, with_possible=True
@@ -371,6 +431,47 @@ class GridworldBase(object):
         return np.array(results).reshape(-1, 1)
 
     def generate_samples_discrete(
+        self,
+        num_transitions,
+        epsilon,
+        with_possible=True,
+        num_workers: int = 1,
+        seed: Optional[int] = None,
+    ) -> Samples:
+        """
+        Generates at least `num_transitions` transitions, ending with a full
+        episode.
+
+        :param num_workers: Processes generating episodes. Unless both this
+            is 1 and `seed` is None, the transitions are split in
+            `num_workers` shards, each generated from its own seed derived
+            from `seed`, and concatenated in shard order. The result is then
+            the same for the same seed and number of workers.
+        :param seed: Seed of the shards, drawn from np.random if None.
+            Without it and with 1 worker, the global np.random state is used
+            directly.
+        """
+        if num_workers == 1 and seed is None:
+            return self._generate_samples_serial(
+                num_transitions, epsilon, with_possible
+            )
+        if seed is None:
+            seed = np.random.randint(2 ** 31)
+        shard_args = [
+            (
+                self,
+                num_transitions // num_workers + int(i < num_transitions % num_workers),
+                epsilon,
+                with_possible,
+                shard_seed,
+            )
+            for i, shard_seed in enumerate(shard_seeds(seed, num_workers))
+        ]
+        return Samples.concat(
+            run_shards(_generate_samples_shard, shard_args, num_workers)
+        )
+
+    def _generate_samples_serial(
         self, num_transitions, epsilon, with_possible=True
     ) -> Samples:
         states = []
@@ -439,94 +540,80 @@ class GridworldBase(object):
         )
 
     def preprocess_samples_discrete(
-        self, samples: Samples, minibatch_size: int
+        self, samples: Samples, minibatch_size: int, state_dtype=np.float32
     ) -> List[TrainingDataPage]:
         samples.shuffle()
-
-        net = core.Net("gridworld_preprocessing")
-        C2.set_net(net)
-        preprocessor = PreprocessorNet(True)
-        saa = StackedAssociativeArray.from_dict_list(samples.states, "states")
-        state_matrix, _ = preprocessor.normalize_sparse_matrix(
-            saa.lengths,
-            saa.keys,
-            saa.values,
-            self.normalization,
-            "state_norm",
-            False,
-            False,
-        )
-        saa = StackedAssociativeArray.from_dict_list(samples.next_states, "next_states")
-        next_state_matrix, _ = preprocessor.normalize_sparse_matrix(
-            saa.lengths,
-            saa.keys,
-            saa.values,
-            self.normalization,
-            "next_state_norm",
-            False,
-            False,
+        arrays = self.preprocess_sample_arrays(samples, state_dtype)
+        num_rows = len(arrays["states"])
+
+        action_indices = label_indices(samples.actions, self.ACTIONS)
+        assert np.all(action_indices >= 0), "Unknown action"
+        # Terminal transitions have an empty next action
+        next_action_indices = label_indices(samples.next_actions, self.ACTIONS)
+        pna_lengths, pna_flat = flatten_lists(samples.possible_next_actions)
+        pna_indices = label_indices(pna_flat, self.ACTIONS)
+        assert np.all(pna_indices >= 0), "Unknown possible next action"
+        possible_next_actions_mask = np.zeros(
+            [num_rows, self.num_actions], dtype=np.float32
         )
-        workspace.RunNetOnce(net)
-        actions_one_hot = np.zeros(
-            [len(samples.actions), len(self.ACTIONS)], dtype=np.float32
+        possible_next_actions_mask[
+            np.repeat(np.arange(num_rows), pna_lengths), pna_indices
+        ] = 1
+        is_terminals = np.array(samples.is_terminal, dtype=np.bool_).reshape(-1, 1)
+
+        arrays.update(
+            actions=one_hot(action_indices, self.num_actions),
+            next_actions=one_hot(next_action_indices, self.num_actions),
+            possible_next_actions=possible_next_actions_mask,
+            not_terminals=np.logical_not(is_terminals),
         )
-        for i, action in enumerate(samples.actions):
-            actions_one_hot[i, self.action_to_index(action)] = 1
-        rewards = np.array(samples.rewards, dtype=np.float32).reshape(-1, 1)
-        propensities = np.array(samples.propensities, dtype=np.float32).reshape(-1, 1)
-        next_actions_one_hot = np.zeros(
-            [len(samples.next_actions), len(self.ACTIONS)], dtype=np.float32
+        return [
+            TrainingDataPage(**slice_arrays(arrays, start, end))
+            for start, end in minibatch_bounds(num_rows, minibatch_size)
+        ]
+
+    def preprocess_sample_arrays(
+        self, samples: Samples, state_dtype=np.float32
+    ) -> Dict[str, Optional[np.ndarray]]:
+        """
+        Builds the TrainingDataPage fields every variant shares, over all
+        samples: normalized states and next states, propensities, rewards,
+        time_diffs and episode values.
+        """
+        preprocessor = Preprocessor(True, output_dtype=state_dtype)
+        state_index = FeatureIndex.from_normalization(self.normalization)
+        states = preprocessor.normalize_dict_list(
+            samples.states, self.normalization, state_index
         )
-        for i, action in enumerate(samples.next_actions):
-            if action == "":
-                continue
-            next_actions_one_hot[i, self.action_to_index(action)] = 1
-        possible_next_actions_mask = []
-        for pna in samples.possible_next_actions:
-            pna_mask = [0] * self.num_actions
-            for action in pna:
-                pna_mask[self.action_to_index(action)] = 1
-            possible_next_actions_mask.append(pna_mask)
-        possible_next_actions_mask = np.array(
-            possible_next_actions_mask, dtype=np.float32
+        next_states = preprocessor.normalize_dict_list(
+            samples.next_states, self.normalization, state_index
         )
-        is_terminals = np.array(samples.is_terminal, dtype=np.bool).reshape(-1, 1)
-        not_terminals = np.logical_not(is_terminals)
+        propensities = np.array(samples.propensities, dtype=np.float32).reshape(-1, 1)
+        rewards = np.array(samples.rewards, dtype=np.float32).reshape(-1, 1)
         episode_values = None
         if samples.reward_timelines is not None:
-            episode_values = np.zeros(rewards.shape, dtype=np.float32)
-            for i, reward_timeline in enumerate(samples.reward_timelines):
-                for time_diff, reward in reward_timeline.items():
-                    episode_values[i, 0] += reward * (DISCOUNT ** time_diff)
-
-        states_ndarray = workspace.FetchBlob(state_matrix)
-        next_states_ndarray = workspace.FetchBlob(next_state_matrix)
-        time_diffs = np.ones(len(states_ndarray))
-        tdps = []
-        for start in range(0, states_ndarray.shape[0], minibatch_size):
-            end = start + minibatch_size
-            if end > states_ndarray.shape[0]:
-                break
-            tdps.append(
-                TrainingDataPage(
-                    states=states_ndarray[start:end],
-                    actions=actions_one_hot[start:end],
-                    propensities=propensities[start:end],
-                    rewards=rewards[start:end],
-                    next_states=next_states_ndarray[start:end],
-                    not_terminals=not_terminals[start:end],
-                    next_actions=next_actions_one_hot[start:end],
-                    possible_next_actions=possible_next_actions_mask[start:end],
-                    episode_values=episode_values[start:end]
-                    if episode_values is not None
-                    else None,
-                    time_diffs=time_diffs[start:end],
-                )
-            )
-        return tdps
-
-    def generate_samples(self, num_transitions, epsilon, with_possible=True):
+            episode_values = discounted_reward_timelines(samples.reward_timelines)
+        return {
+            "states": states,
+            "propensities": propensities,
+            "rewards": rewards,
+            "next_states": next_states,
+            "episode_values": episode_values,
+            "time_diffs": np.ones(len(states)),
+        }
+
+    def generate_samples(
+        self, num_transitions, epsilon, with_possible=True, num_workers=1, seed=None
+    ):
         raise NotImplementedError()
 
-    def preprocess_samples(self, samples, minibatch_size):
+    def preprocess_samples(self, samples, minibatch_size, state_dtype=np.float32):
         raise NotImplementedError()
+
+
+def _generate_samples_shard(args) -> Samples:
+    environment, num_transitions, epsilon, with_possible, seed = args
+    np.random.seed(seed)
+    return environment._generate_samples_serial(
+        num_transitions, epsilon, with_possible
+    )
@@ -5,10 +5,16 @@ from typing import List
 
 import numpy as np
 import torch
-from caffe2.python import core, workspace
-from ml.rl.caffe_utils import C2, StackedArray, StackedAssociativeArray
-from ml.rl.preprocessing.preprocessor_net import PreprocessorNet
-from ml.rl.test.gridworld.gridworld_base import DISCOUNT, GridworldBase, Samples
+from ml.rl.caffe_utils import StackedArray
+from ml.rl.preprocessing.feature_index import FeatureIndex
+from ml.rl.preprocessing.preprocessor import Preprocessor
+from ml.rl.test.gridworld.gridworld_base import (
+    GridworldBase,
+    Samples,
+    flatten_lists,
+    minibatch_bounds,
+    slice_arrays,
+)
 from ml.rl.test.utils import default_normalizer
 from ml.rl.training.training_data_page import TrainingDataPage
 
@@ -53,9 +59,11 @@ class GridworldContinuous(GridworldBase):
     def features_to_state(self, state):
         return list(state.keys())[0]
 
-    def generate_samples(self, num_transitions, epsilon, with_possible=True) -> Samples:
+    def generate_samples(
+        self, num_transitions, epsilon, with_possible=True, num_workers=1, seed=None
+    ) -> Samples:
         samples = self.generate_samples_discrete(
-            num_transitions, epsilon, with_possible
+            num_transitions, epsilon, with_possible, num_workers, seed
         )
         continuous_actions = [self.action_to_features(a) for a in samples.actions]
         continuous_next_actions = [
@@ -84,126 +92,41 @@ class GridworldContinuous(GridworldBase):
         )
 
     def preprocess_samples(
-        self, samples: Samples, minibatch_size: int
+        self, samples: Samples, minibatch_size: int, state_dtype=np.float32
     ) -> List[TrainingDataPage]:
         samples.shuffle()
-
-        net = core.Net("gridworld_preprocessing")
-        C2.set_net(net)
-        preprocessor = PreprocessorNet(True)
-        saa = StackedAssociativeArray.from_dict_list(samples.states, "states")
-        state_matrix, _ = preprocessor.normalize_sparse_matrix(
-            saa.lengths,
-            saa.keys,
-            saa.values,
-            self.normalization,
-            "state_norm",
-            False,
-            False,
-        )
-        saa = StackedAssociativeArray.from_dict_list(samples.next_states, "next_states")
-        next_state_matrix, _ = preprocessor.normalize_sparse_matrix(
-            saa.lengths,
-            saa.keys,
-            saa.values,
-            self.normalization,
-            "next_state_norm",
-            False,
-            False,
-        )
-        saa = StackedAssociativeArray.from_dict_list(samples.actions, "action")
-        action_matrix, _ = preprocessor.normalize_sparse_matrix(
-            saa.lengths,
-            saa.keys,
-            saa.values,
-            self.normalization_action,
-            "action_norm",
-            False,
-            False,
-        )
-        saa = StackedAssociativeArray.from_dict_list(
-            samples.next_actions, "next_action"
-        )
-        next_action_matrix, _ = preprocessor.normalize_sparse_matrix(
-            saa.lengths,
-            saa.keys,
-            saa.values,
-            self.normalization_action,
-            "next_action_norm",
-            False,
-            False,
-        )
-        propensities = np.array(samples.propensities, dtype=np.float32).reshape(-1, 1)
-        rewards = np.array(samples.rewards, dtype=np.float32).reshape(-1, 1)
-
-        pnas_lengths_list = []
-        pnas_flat: List[List[str]] = []
-        for pnas in samples.possible_next_actions:
-            pnas_lengths_list.append(len(pnas))
-            pnas_flat.extend(pnas)
-        saa = StackedAssociativeArray.from_dict_list(pnas_flat, "possible_next_actions")
-
-        pnas_lengths = np.array(pnas_lengths_list, dtype=np.int32)
-        pna_lens_blob = "pna_lens_blob"
-        workspace.FeedBlob(pna_lens_blob, pnas_lengths)
-
-        possible_next_actions_matrix, _ = preprocessor.normalize_sparse_matrix(
-            saa.lengths,
-            saa.keys,
-            saa.values,
-            self.normalization_action,
-            "possible_next_action_norm",
-            False,
-            False,
-        )
-
-        state_pnas_blob = preprocessor.concat_states_and_possible_next_actions(
-            next_state_matrix, possible_next_actions_matrix, pna_lens_blob
+        arrays = self.preprocess_sample_arrays(samples, state_dtype)
+
+        preprocessor = Preprocessor(True, output_dtype=state_dtype)
+        action_index = FeatureIndex.from_normalization(self.normalization_action)
+        pnas_lengths, pnas_flat = flatten_lists(samples.possible_next_actions)
+        actions_ndarray, next_actions_ndarray, pnas_ndarray = [
+            preprocessor.normalize_dict_list(
+                action_dicts, self.normalization_action, action_index
+            )
+            for action_dicts in (samples.actions, samples.next_actions, pnas_flat)
+        ]
+        next_state_pnas_concat = preprocessor.concat_states_and_possible_next_actions(
+            arrays["next_states"], pnas_ndarray, pnas_lengths
         )
-
-        workspace.RunNetOnce(net)
-
-        states_ndarray = workspace.FetchBlob(state_matrix)
-        actions_ndarray = workspace.FetchBlob(action_matrix)
-        next_states_ndarray = workspace.FetchBlob(next_state_matrix)
-        next_actions_ndarray = workspace.FetchBlob(next_action_matrix)
-        possible_next_actions_ndarray = workspace.FetchBlob(
-            possible_next_actions_matrix
+        arrays.update(
+            actions=actions_ndarray,
+            next_actions=next_actions_ndarray,
+            not_terminals=(pnas_lengths > 0).reshape(-1, 1),
+            possible_next_actions_lengths=pnas_lengths,
         )
-        next_state_pnas_concat = workspace.FetchBlob(state_pnas_blob)
-        time_diffs = np.ones(len(states_ndarray))
-        episode_values = None
-        if samples.reward_timelines is not None:
-            episode_values = np.zeros(rewards.shape, dtype=np.float32)
-            for i, reward_timeline in enumerate(samples.reward_timelines):
-                for time_diff, reward in reward_timeline.items():
-                    episode_values[i, 0] += reward * (DISCOUNT ** time_diff)
 
+        pnas_offsets = np.concatenate([[0], np.cumsum(pnas_lengths)])
         tdps = []
-        pnas_start = 0
-        for start in range(0, states_ndarray.shape[0], minibatch_size):
-            end = start + minibatch_size
-            if end > states_ndarray.shape[0]:
-                break
-            pnas_end = pnas_start + np.sum(pnas_lengths[start:end])
-            pnas = possible_next_actions_ndarray[pnas_start:pnas_end]
-            pnas_start = pnas_end
+        for start, end in minibatch_bounds(len(pnas_lengths), minibatch_size):
+            pnas_start, pnas_end = pnas_offsets[start], pnas_offsets[end]
             tdps.append(
                 TrainingDataPage(
-                    states=states_ndarray[start:end],
-                    actions=actions_ndarray[start:end],
-                    propensities=propensities[start:end],
-                    rewards=rewards[start:end],
-                    next_states=next_states_ndarray[start:end],
-                    next_actions=next_actions_ndarray[start:end],
-                    possible_next_actions=StackedArray(pnas_lengths[start:end], pnas),
-                    not_terminals=(pnas_lengths[start:end] > 0).reshape(-1, 1),
-                    episode_values=episode_values[start:end]
-                    if episode_values is not None
-                    else None,
-                    time_diffs=time_diffs[start:end],
-                    possible_next_actions_lengths=pnas_lengths[start:end],
-                    next_state_pnas_concat=next_state_pnas_concat,
+                    possible_next_actions=StackedArray(
+                        pnas_lengths[start:end], pnas_ndarray[pnas_start:pnas_end]
+                    ),
+                    next_state_pnas_concat=next_state_pnas_concat[pnas_start:pnas_end],
+                    **slice_arrays(arrays, start, end),
                 )
             )
         return tdps
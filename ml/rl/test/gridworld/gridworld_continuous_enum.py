@@ -35,9 +35,11 @@ class GridworldContinuousEnum(GridworldContinuous):
             )
         }
 
-    def generate_samples(self, num_transitions, epsilon, with_possible=True) -> Samples:
+    def generate_samples(
+        self, num_transitions, epsilon, with_possible=True, num_workers=1, seed=None
+    ) -> Samples:
         samples = GridworldContinuous.generate_samples(
-            self, num_transitions, epsilon, with_possible
+            self, num_transitions, epsilon, with_possible, num_workers, seed
         )
         enum_states = []
         for state in samples.states:
@@ -28,9 +28,11 @@ class GridworldEnum(Gridworld):
             )
         }
 
-    def generate_samples(self, num_transitions, epsilon, with_possible=True) -> Samples:
+    def generate_samples(
+        self, num_transitions, epsilon, with_possible=True, num_workers=1, seed=None
+    ) -> Samples:
         samples = Gridworld.generate_samples(
-            self, num_transitions, epsilon, with_possible
+            self, num_transitions, epsilon, with_possible, num_workers, seed
         )
         enum_states = []
         for state in samples.states:
@@ -1,6 +1,6 @@
 #!/usr/bin/env python3
 
-from typing import List
+from typing import List, Optional
 
 import numpy as np
 
@@ -16,17 +16,29 @@ class GridworldEvaluator(Evaluator):
     num_j_steps_for_magic_estimator = 25
 
     def __init__(
-        self, env, assume_optimal_policy: bool, gamma, use_int_features: bool, samples
+        self,
+        env,
+        assume_optimal_policy: bool,
+        gamma,
+        use_int_features: bool,
+        samples,
+        num_workers: int = 1,
+        seed: Optional[int] = None,
     ) -> None:
+        """
+        :param num_workers: Processes generating the samples if `samples` is
+            None, see `GridworldBase.generate_samples_discrete`.
+        :param seed: Seed of the generated samples.
+        """
         super(GridworldEvaluator, self).__init__(None, 1, gamma)
 
         self._env = env
 
         if samples is None:
-            if assume_optimal_policy:
-                samples = env.generate_samples(200000, 0.25)
-            else:
-                samples = env.generate_samples(200000, 1.0)
+            epsilon = 0.25 if assume_optimal_policy else 1.0
+            samples = env.generate_samples(
+                200000, epsilon, num_workers=num_workers, seed=seed
+            )
         self.logged_states = samples.states
         self.logged_actions = samples.actions
         self.logged_propensities = np.array(samples.propensities).reshape(-1, 1)
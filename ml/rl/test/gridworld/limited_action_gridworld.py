@@ -2,9 +2,9 @@
 
 
 import numpy as np
-from typing import Tuple, List, Dict, Optional
+from typing import Tuple, List
 
-from ml.rl.test.gridworld.gridworld_base import GridworldBase, W, S, G
+from ml.rl.test.gridworld.gridworld_base import GridworldBase, Samples, W, S, G
 from ml.rl.training.training_data_page import TrainingDataPage
 
 
@@ -38,45 +38,16 @@ class LimitedActionGridworld(GridworldBase):
         return state
 
     def generate_samples(
-        self, num_transitions, epsilon, with_possible=True
-    ) -> Tuple[
-        List[Dict[int, float]],
-        List[str],
-        List[float],
-        List[float],
-        List[Dict[int, float]],
-        List[str],
-        List[bool],
-        List[List[str]],
-        List[Dict[int, float]],
-    ]:
-        return self.generate_samples_discrete(num_transitions, epsilon, with_possible)
+        self, num_transitions, epsilon, with_possible=True, num_workers=1, seed=None
+    ) -> Samples:
+        return self.generate_samples_discrete(
+            num_transitions, epsilon, with_possible, num_workers, seed
+        )
 
     def preprocess_samples(
-        self,
-        states: List[Dict[int, float]],
-        actions: List[str],
-        propensities: List[float],
-        rewards: List[float],
-        next_states: List[Dict[int, float]],
-        next_actions: List[str],
-        is_terminals: List[bool],
-        possible_next_actions: List[List[str]],
-        reward_timelines: Optional[List[Dict[int, float]]],
-        minibatch_size: int,
+        self, samples: Samples, minibatch_size: int, state_dtype=np.float32
     ) -> List[TrainingDataPage]:
-        return self.preprocess_samples_discrete(
-            states,
-            actions,
-            propensities,
-            rewards,
-            next_states,
-            next_actions,
-            is_terminals,
-            possible_next_actions,
-            reward_timelines,
-            minibatch_size,
-        )
+        return self.preprocess_samples_discrete(samples, minibatch_size, state_dtype)
 
     def possible_next_actions(self, state, ignore_terminal=False) -> List[str]:
         if ignore_terminal is False and self.is_terminal(state):
@@ -2,8 +2,10 @@
 
 import random
 import numpy as np
+import torch
 import unittest
 
+from ml.rl.preprocessing.preprocessor import Preprocessor
 from ml.rl.training.evaluator import Evaluator
 from ml.rl.thrift.core.ttypes import (
     RLParameters,
@@ -43,11 +45,12 @@ class TestGridworldContinuous(unittest.TestCase):
             knn=KnnParameters(model_type="DQN"),
         )
 
-    def get_sarsa_trainer(self, environment):
+    def get_sarsa_trainer(self, environment, enum_embedding_dim=None):
         return ParametricDQNTrainer(
             self.get_sarsa_parameters(),
             environment.normalization,
             environment.normalization_action,
+            enum_embedding_dim=enum_embedding_dim,
         )
 
     def test_trainer_sarsa(self):
@@ -90,6 +93,41 @@ class TestGridworldContinuous(unittest.TestCase):
 
         self.assertLess(evaluator.evaluate(predictor), 0.15)
 
+    def test_enum_embedding_export(self):
+        environment = GridworldContinuousEnum()
+        trainer = self.get_sarsa_trainer(environment, enum_embedding_dim=4)
+
+        # Every state with every action, plus a missing state
+        states, actions = [], []
+        for state in range(len(environment.STATES)):
+            for action in range(environment.num_actions):
+                states.append({0: float(state)})
+                actions.append(environment.index_to_action(action))
+        states.append({})
+        actions.append(environment.index_to_action(0))
+
+        preprocessor = Preprocessor(True, enum_as_index=True)
+        state_action_matrix = np.concatenate(
+            [
+                preprocessor.normalize_dict_list(states, environment.normalization),
+                preprocessor.normalize_dict_list(
+                    actions, environment.normalization_action
+                ),
+            ],
+            axis=1,
+        )
+        self.assertEqual(state_action_matrix.shape[1], 1 + environment.num_actions)
+        self.assertEqual(state_action_matrix[-1, 0], len(environment.STATES))
+
+        expected = trainer.q_network(torch.from_numpy(state_action_matrix))
+        predictions = trainer.predictor().predict(states, None, actions)
+        np.testing.assert_allclose(
+            [[p["Q"]] for p in predictions],
+            expected.detach().numpy(),
+            rtol=1e-5,
+            atol=1e-5,
+        )
+
     def test_evaluator_ground_truth(self):
         environment = GridworldContinuous()
         samples = environment.generate_samples(200000, 1.0)
@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+
+import random
+import unittest
+
+import numpy as np
+from ml.rl.test.gridworld.gridworld_base import DISCOUNT
+from ml.rl.test.gridworld.limited_action_gridworld import LimitedActionGridworld
+
+
+class TestGridworldPreprocessing(unittest.TestCase):
+    def setUp(self):
+        np.random.seed(0)
+        random.seed(0)
+
+    def test_pages_match_samples(self):
+        environment = LimitedActionGridworld()
+        samples = environment.generate_samples(1000, 0.5)
+        tdps = environment.preprocess_samples(samples, 64)
+        self.assertEqual(len(tdps), 1000 // 64)
+
+        # preprocess_samples shuffled the samples in place
+        for i in range(len(tdps) * 64):
+            tdp, row = tdps[i // 64], i % 64
+            self.assertEqual(
+                tdp.actions[row].tolist(),
+                [float(a == samples.actions[i]) for a in environment.ACTIONS],
+            )
+            self.assertEqual(
+                tdp.next_actions[row].tolist(),
+                [float(a == samples.next_actions[i]) for a in environment.ACTIONS],
+            )
+            self.assertEqual(
+                tdp.possible_next_actions[row].tolist(),
+                [
+                    float(a in samples.possible_next_actions[i])
+                    for a in environment.ACTIONS
+                ],
+            )
+            self.assertEqual(tdp.not_terminals[row, 0], not samples.is_terminal[i])
+            self.assertAlmostEqual(
+                tdp.episode_values[row, 0],
+                sum(
+                    reward * DISCOUNT ** time_diff
+                    for time_diff, reward in samples.reward_timelines[i].items()
+                ),
+                places=5,
+            )
+
+    def test_sharded_generation_is_deterministic(self):
+        environment = LimitedActionGridworld()
+        first = environment.generate_samples(2000, 0.5, num_workers=2, seed=7)
+        np.random.seed(1)
+        second = environment.generate_samples(2000, 0.5, num_workers=2, seed=7)
+        self.assertGreaterEqual(len(first.states), 2000)
+        for field in first.__slots__:
+            self.assertEqual(getattr(first, field), getattr(second, field))
+        # Each shard ends with a full episode
+        self.assertEqual(sum(first.is_terminal), sum(second.is_terminal))
+        self.assertTrue(first.is_terminal[-1])
@@ -2,10 +2,15 @@
 
 import random
 import numpy as np
+import torch
 import unittest
 
+from ml.rl.preprocessing.preprocessor import Preprocessor
 from ml.rl.training.dqn_trainer import DQNTrainer
 from ml.rl.training.evaluator import Evaluator
+from ml.rl.training.prefetching_loader import PrefetchingLoader
+from ml.rl.training.rl_trainer_pytorch import EnumEmbedding
+from ml.rl.training.training_data_page import TrainingDataPage
 from ml.rl.thrift.core.ttypes import (
     RLParameters,
     TrainingParameters,
@@ -14,7 +19,7 @@ from ml.rl.thrift.core.ttypes import (
 from ml.rl.test.gridworld.gridworld import Gridworld
 from ml.rl.test.gridworld.gridworld_enum import GridworldEnum
 from ml.rl.test.gridworld.gridworld_evaluator import GridworldEvaluator
-from ml.rl.test.gridworld.gridworld_base import DISCOUNT
+from ml.rl.test.gridworld.gridworld_base import DISCOUNT, one_hot
 
 
 class TestGridworld(unittest.TestCase):
@@ -24,10 +29,12 @@ class TestGridworld(unittest.TestCase):
         self.minibatch_size = 2048
         super(self.__class__, self).setUp()
 
-    def get_sarsa_trainer(self, environment):
-        return self.get_sarsa_trainer_reward_boost(environment, {})
+    def get_sarsa_trainer(self, environment, enum_embedding_dim=None):
+        return self.get_sarsa_trainer_reward_boost(environment, {}, enum_embedding_dim)
 
-    def get_sarsa_trainer_reward_boost(self, environment, reward_shape):
+    def get_sarsa_trainer_reward_boost(
+        self, environment, reward_shape, enum_embedding_dim=None
+    ):
         rl_parameters = RLParameters(
             gamma=DISCOUNT,
             target_update_rate=1.0,
@@ -49,6 +56,7 @@ class TestGridworld(unittest.TestCase):
                 training=training_parameters,
             ),
             environment.normalization,
+            enum_embedding_dim=enum_embedding_dim,
         )
 
     def test_trainer_sarsa_enum(self):
@@ -67,11 +75,17 @@ class TestGridworld(unittest.TestCase):
         )
         self.assertGreater(evaluator.mc_loss[-1], 0.12)
 
+        def flatten(tdp):
+            tdp.rewards = tdp.rewards.flatten()
+            tdp.not_terminals = tdp.not_terminals.flatten()
+            return tdp
+
+        # Pages are flattened on the loader's worker thread
+        loader = PrefetchingLoader(tdps, transform=flatten)
         for _ in range(2):
-            for tdp in tdps:
-                tdp.rewards = tdp.rewards.flatten()
-                tdp.not_terminals = tdp.not_terminals.flatten()
+            for tdp in loader:
                 trainer.train(tdp)
+        loader.log_report()
 
         predictor = trainer.predictor()
         evaluator.evaluate(predictor)
@@ -82,6 +96,50 @@ class TestGridworld(unittest.TestCase):
         )
         self.assertLess(evaluator.mc_loss[-1], 0.1)
 
+    def test_enum_embedding_export(self):
+        environment = GridworldEnum()
+        trainer = self.get_sarsa_trainer(environment, enum_embedding_dim=4)
+        self.assertIsInstance(trainer.q_network[0], EnumEmbedding)
+
+        # Every state, an unknown state and a missing state
+        states = [{0: float(i)} for i in range(len(environment.STATES))]
+        states += [{0: float(len(environment.STATES))}, {}]
+        normalized_states = Preprocessor(True, enum_as_index=True).normalize_dict_list(
+            states, environment.normalization
+        )
+        self.assertEqual(normalized_states.shape, (len(states), 1))
+        self.assertEqual(
+            normalized_states[:, 0].tolist(),
+            list(range(len(environment.STATES))) + [len(environment.STATES)] * 2,
+        )
+
+        num_rows = len(states)
+        actions = one_hot(
+            np.random.randint(len(environment.ACTIONS), size=num_rows),
+            len(environment.ACTIONS),
+        )
+        trainer.train(
+            TrainingDataPage(
+                states=normalized_states,
+                actions=actions,
+                propensities=np.ones([num_rows, 1], dtype=np.float32),
+                rewards=np.ones(num_rows, dtype=np.float32),
+                next_states=normalized_states,
+                next_actions=actions,
+                not_terminals=np.ones(num_rows, dtype=np.bool_),
+                time_diffs=np.ones(num_rows),
+            )
+        )
+
+        expected = trainer.q_network(torch.from_numpy(normalized_states))
+        predictions = trainer.predictor().predict(states)
+        np.testing.assert_allclose(
+            [[p[action] for action in environment.ACTIONS] for p in predictions],
+            expected.detach().numpy(),
+            rtol=1e-5,
+            atol=1e-5,
+        )
+
     def test_evaluator_ground_truth(self):
         environment = Gridworld()
         samples = environment.generate_samples(200000, 1.0)
@@ -139,3 +197,30 @@ class TestGridworld(unittest.TestCase):
             evaluator.value_doubly_robust[-1],
         )
         self.assertLess(evaluator.mc_loss[-1], 0.1)
+
+    def _train_sarsa(self, environment, samples, state_dtype):
+        np.random.seed(0)
+        random.seed(0)
+        trainer = self.get_sarsa_trainer(environment)
+        tdps = environment.preprocess_samples(
+            samples, self.minibatch_size, state_dtype
+        )
+        for tdp in tdps:
+            self.assertEqual(tdp.states.dtype, state_dtype)
+            tdp.rewards = tdp.rewards.flatten()
+            tdp.not_terminals = tdp.not_terminals.flatten()
+            trainer.train(tdp)
+        return trainer.predictor()
+
+    def test_float16_states_accuracy(self):
+        environment = Gridworld()
+        samples = environment.generate_samples(150000, 1.0)
+        evaluator = GridworldEvaluator(environment, False, DISCOUNT, False, samples)
+
+        evaluator.evaluate(self._train_sarsa(environment, samples, np.float32))
+        float32_loss = evaluator.mc_loss[-1]
+        evaluator.evaluate(self._train_sarsa(environment, samples, np.float16))
+        float16_loss = evaluator.mc_loss[-1]
+        print("float32 vs float16 states eval: ", float32_loss, float16_loss)
+        self.assertLess(float16_loss, 0.1)
+        self.assertLess(abs(float16_loss - float32_loss), 0.01)
@@ -1,5 +1,6 @@
 #!/usr/bin/env python3
 
+import itertools
 import numpy as np
 import logging
 from typing import List, Tuple
@@ -7,7 +8,8 @@ from typing import List, Tuple
 from ml.rl.training.evaluator import Evaluator
 from ml.rl.training.parametric_dqn_trainer import ParametricDQNTrainer
 from ml.rl.training.continuous_action_dqn_trainer import ContinuousActionDQNTrainer
-from ml.rl.test.gym.open_ai_gym_environment import EnvType
+from ml.rl.test.gym.open_ai_gym_environment import EnvType, OpenAIGymEnvironment
+from ml.rl.test.utils import run_shards, shard_seeds
 
 logger = logging.getLogger(__name__)
 
@@ -25,7 +27,9 @@ class GymEvaluator(Evaluator):
         "_env"
     ]
 
-    def __init__(self, env, gamma, use_int_features: bool = False) -> None:
+    def __init__(
+        self, env, gamma, use_int_features: bool = False, num_workers=1, seed=None
+    ) -> None:
         #TODO: incorporate int features
         super(GymEvaluator, self).__init__(None, 1, gamma)
 
@@ -39,7 +43,7 @@ class GymEvaluator(Evaluator):
          self.logged_rewards,
          self.logged_values,
          self.logged_is_terminals
-         ) = self._generate_samples(500, 0.05)
+         ) = self._generate_samples(500, 0.05, num_workers, seed)
 
         self.logged_states = np.array(self.logged_states).astype(np.float32)
         self.logged_propensities = np.array(self.logged_propensities).reshape(-1, 1)
@@ -55,61 +59,35 @@ class GymEvaluator(Evaluator):
             self.logged_actions_one_hot[i, action] = 1.0
 
     def _generate_samples(
-        self, num_episodes, epsilon
+        self, num_episodes, epsilon, num_workers=1, seed=None
     ) -> Tuple[List[object], List[int], List[float], List[float], List[float], List[bool]]:
         """
         Generate and log samples according to a random policy.
-        """
-
-        states: List[object] = []
-        actions: List[int] = []
-        propensities: List[float] = []
-        rewards: List[float] = []
-        values: List[float] = []
-        is_terminals: List[bool] = []
-
-        for _ in range(num_episodes):
-            last_end = len(states) - 1
 
-            state = self._env.transform_state(self._env.env.reset())
-            states.append(state)
-            values.append(0.0)
-            is_terminals.append(False)
-            terminal = False
-
-            while not terminal:
-                action = self._env.action_space.sample()
-                propensity = 1.0 / self._env.action_dim
-                actions.append(action)
-                propensities.append(propensity)
-
-                state, reward, terminal, _ = self._env.env.step(action)
-                state = self._env.transform_state(state)
-                rewards.append(reward)
-                is_terminals.append(terminal)
-
-                states.append(state)
-                values.append(0.0)
-
-            # reward, action, propensity for terminal state
-            rewards.append(0.0)
-            values[-1] = rewards[-1]
-            actions.append(self._env.action_space.sample())
-            propensities.append(1.0 / self._env.action_dim)
-
-            # calculate true values
-            i = len(states) - 2
-            while i > last_end:
-                values[i] += rewards[i] + self.gamma * values[i + 1]
-                i -= 1
-
-        return (
-            states,
-            actions,
-            propensities,
-            rewards,
-            values,
-            is_terminals
+        Unless `num_workers` is 1 and `seed` is None, the episodes are split
+        in `num_workers` shards. Each shard is generated by its own process
+        and environment, seeded from `seed`. The shards are concatenated in
+        order, so the samples are the same for the same seed and number of
+        workers.
+        """
+        if num_workers == 1 and seed is None:
+            return _generate_episodes(
+                self._env, num_episodes, self.gamma, self._env.action_space.sample
+            )
+        if seed is None:
+            seed = np.random.randint(2 ** 31)
+        shard_args = [
+            (
+                self._env.env.spec.id,
+                num_episodes // num_workers + int(i < num_episodes % num_workers),
+                self.gamma,
+                shard_seed,
+            )
+            for i, shard_seed in enumerate(shard_seeds(seed, num_workers))
+        ]
+        shards = run_shards(_generate_samples_shard, shard_args, num_workers)
+        return tuple(
+            list(itertools.chain.from_iterable(columns)) for columns in zip(*shards)
         )
 
     def evaluate(self, predictor):
@@ -260,3 +238,66 @@ class GymEvaluator(Evaluator):
         logger.info(
             "True Value P.E : {0:.3f}".format(true_value_PE)
         )
+
+
+def _generate_episodes(env, num_episodes, gamma, sample_action):
+    states: List[object] = []
+    actions: List[int] = []
+    propensities: List[float] = []
+    rewards: List[float] = []
+    values: List[float] = []
+    is_terminals: List[bool] = []
+
+    for _ in range(num_episodes):
+        last_end = len(states) - 1
+
+        state = env.transform_state(env.env.reset())
+        states.append(state)
+        values.append(0.0)
+        is_terminals.append(False)
+        terminal = False
+
+        while not terminal:
+            action = sample_action()
+            propensity = 1.0 / env.action_dim
+            actions.append(action)
+            propensities.append(propensity)
+
+            state, reward, terminal, _ = env.env.step(action)
+            state = env.transform_state(state)
+            rewards.append(reward)
+            is_terminals.append(terminal)
+
+            states.append(state)
+            values.append(0.0)
+
+        # reward, action, propensity for terminal state
+        rewards.append(0.0)
+        values[-1] = rewards[-1]
+        actions.append(sample_action())
+        propensities.append(1.0 / env.action_dim)
+
+        # calculate true values
+        i = len(states) - 2
+        while i > last_end:
+            values[i] += rewards[i] + gamma * values[i + 1]
+            i -= 1
+
+    return (
+        states,
+        actions,
+        propensities,
+        rewards,
+        values,
+        is_terminals
+    )
+
+
+def _generate_samples_shard(args):
+    env_id, num_episodes, gamma, seed = args
+    env = OpenAIGymEnvironment(env_id, 0.0, 0, 0, gamma)
+    env.env.seed(seed)
+    random_state = np.random.RandomState(seed)
+    return _generate_episodes(
+        env, num_episodes, gamma, lambda: random_state.randint(env.action_dim)
+    )
@@ -11,7 +11,8 @@ from ml.rl.test.gym.gym_predictor import (
     GymDQNPredictorPytorch,
 )
 from ml.rl.test.utils import default_normalizer
-from ml.rl.training.training_data_page import TrainingDataPage
+from ml.rl.training.replay_memory import PrioritizedReplayMemory, ReplayMemory
+from ml.rl.training.replay_storage import MemoryMappedColumnStorage
 
 
 class ModelType(enum.Enum):
@@ -28,7 +29,18 @@ class EnvType(enum.Enum):
 
 
 class OpenAIGymEnvironment:
-    def __init__(self, gymenv, epsilon, softmax_policy, max_replay_memory_size, gamma):
+    def __init__(
+        self,
+        gymenv,
+        epsilon,
+        softmax_policy,
+        max_replay_memory_size,
+        gamma,
+        prioritized_replay_alpha=0.0,
+        prioritized_replay_beta=0.4,
+        n_step=1,
+        replay_memory_path=None,
+    ):
         """
         Creates an OpenAIGymEnvironment object.
 
@@ -39,13 +51,35 @@ class OpenAIGymEnvironment:
             max q selection.
         :param max_replay_memory_size: Upper bound on the number of transitions
             to store in replay memory.
+        :param prioritized_replay_alpha: If positive, sample transitions by
+            their TD errors to this power, see `PrioritizedReplayMemory`.
+        :param prioritized_replay_beta: Importance weight exponent of
+            prioritized replay.
+        :param n_step: Number of consecutive transitions replay memory stores
+            as one, with their discounted rewards and a time diff of n.
+        :param replay_memory_path: If set, keep replay memory in memory-mapped
+            files in this directory instead of RAM, for memories larger than
+            RAM (e.g. of image states).
         """
         self.epsilon = epsilon
         self.softmax_policy = softmax_policy
-        self.replay_memory = []
         self.max_replay_memory_size = max_replay_memory_size
-        self.memory_num = 0
-        self.skip_insert_until = self.max_replay_memory_size
+        storage = None
+        if replay_memory_path is not None:
+            storage = MemoryMappedColumnStorage(replay_memory_path)
+        if prioritized_replay_alpha > 0:
+            self.replay_memory = PrioritizedReplayMemory(
+                max_replay_memory_size,
+                alpha=prioritized_replay_alpha,
+                beta=prioritized_replay_beta,
+                n_step=n_step,
+                gamma=gamma,
+                storage=storage,
+            )
+        else:
+            self.replay_memory = ReplayMemory(
+                max_replay_memory_size, n_step=n_step, gamma=gamma, storage=storage
+            )
         self.gamma = gamma
 
         self._create_env(gymenv)
@@ -98,55 +132,19 @@ class OpenAIGymEnvironment:
             )
             self.img = True
 
-    def sample_memories(self, batch_size, model_type):
+    def sample_memories(self, batch_size, model_type, state_dtype=np.float32):
         """
-        Samples transitions from replay memory uniformly at random.
+        Samples transitions from replay memory, uniformly at random unless
+        replay is prioritized.
 
         :param batch_size: Number of sampled transitions to return.
         :param model_type: Model type (discrete, parametric).
+        :param state_dtype: Storage type of the state matrices, see
+            `TrainingDataPage.astype_features`.
         """
-        cols = [[], [], [], [], [], [], [], [], []]
-        indices = np.random.permutation(len(self.replay_memory))[:batch_size]
-        for idx in indices:
-            memory = self.replay_memory[idx]
-            for col, value in zip(cols, memory):
-                col.append(value)
-
-        possible_next_actions_lengths = np.array(cols[7], dtype=np.int32)
-        next_states = np.array(cols[3], dtype=np.float32)
-
-        if model_type in (
-            ModelType.PARAMETRIC_ACTION.value,
-            ModelType.PYTORCH_PARAMETRIC_DQN.value,
-        ):
-            possible_next_actions = []
-            for pna_matrix in cols[6]:
-                for row in pna_matrix:
-                    possible_next_actions.append(row)
-
-            tiled_states = np.repeat(next_states, possible_next_actions_lengths, axis=0)
-            possible_next_actions = np.array(possible_next_actions, dtype=np.float32)
-            next_state_pnas_concat = np.concatenate(
-                (tiled_states, possible_next_actions), axis=1
-            )
-        else:
-            possible_next_actions = np.array(cols[6], dtype=np.float32)
-            next_state_pnas_concat = None
-
-        return TrainingDataPage(
-            states=np.array(cols[0], dtype=np.float32),
-            actions=np.array(cols[1], dtype=np.float32),
-            propensities=None,
-            rewards=np.array(cols[2], dtype=np.float32),
-            next_states=np.array(cols[3], dtype=np.float32),
-            next_actions=np.array(cols[4], dtype=np.float32),
-            possible_next_actions=possible_next_actions,
-            episode_values=None,
-            not_terminals=np.logical_not(np.array(cols[5]), dtype=np.bool),
-            time_diffs=np.array(cols[8], dtype=np.int32),
-            possible_next_actions_lengths=possible_next_actions_lengths,
-            next_state_pnas_concat=next_state_pnas_concat,
-        )
+        # The memory stores parametric possible next actions as matrices, so
+        # the model type is implied by what was inserted
+        return self.replay_memory.sample(batch_size, state_dtype)
 
     def sample_and_load_training_data_c2(self, num_samples, model_type):
         """
@@ -155,8 +153,19 @@ class OpenAIGymEnvironment:
 
         :param num_samples: Number of transitions to sample from replay memory.
         :param model_type: Model type (discrete, parametric).
+        :returns: The loaded TrainingDataPage, whose importance weights go to
+            the trainer's `train` and whose replay indices go to
+            `update_priorities`.
         """
         tdp = self.sample_memories(num_samples, model_type)
+        self.load_training_data_c2(tdp)
+        return tdp
+
+    def load_training_data_c2(self, tdp):
+        """
+        Loads a TrainingDataPage returned by `sample_memories` into the
+        training net.
+        """
         workspace.FeedBlob("states", tdp.states)
         workspace.FeedBlob("actions", tdp.actions)
         workspace.FeedBlob("rewards", tdp.rewards.reshape(-1, 1))
@@ -169,6 +178,21 @@ class OpenAIGymEnvironment:
             "possible_next_actions_lengths", tdp.possible_next_actions_lengths
         )
 
+    def end_episode(self):
+        """
+        Stores the n-step transitions of an episode that ended without a
+        terminal transition, e.g. at max_steps.
+        """
+        self.replay_memory.end_episode()
+
+    def update_priorities(self, tdp, td_errors):
+        """
+        Reports the TD errors a trainer just computed on `tdp` to prioritized
+        replay memory. Does nothing with uniform replay.
+        """
+        if tdp.replay_indices is not None:
+            self.replay_memory.update_priorities(tdp.replay_indices, td_errors)
+
     @property
     def normalization(self):
         if self.img:
@@ -228,7 +252,7 @@ class OpenAIGymEnvironment:
         Inserts transition into replay memory in such a way that retrieving
         transitions uniformly at random will be equivalent to reservoir sampling.
         """
-        item = (
+        self.replay_memory.insert(
             state,
             action,
             reward,
@@ -240,15 +264,6 @@ class OpenAIGymEnvironment:
             time_diff,
         )
 
-        if self.memory_num < self.max_replay_memory_size:
-            self.replay_memory.append(item)
-        elif self.memory_num >= self.skip_insert_until:
-            p = float(self.max_replay_memory_size) / self.memory_num
-            self.skip_insert_until += np.random.geometric(p)
-            rand_index = np.random.randint(self.max_replay_memory_size)
-            self.replay_memory[rand_index] = item
-        self.memory_num += 1
-
     def run_ep_n_times(self, n, predictor, max_steps=None, test=False, render=False):
         """
         Runs an episode of the environment n times and returns the average
@@ -19,6 +19,7 @@ from ml.rl.test.gym.open_ai_gym_environment import (
     ModelType,
     OpenAIGymEnvironment,
 )
+from ml.rl.test.columnar_rl_dataset import StreamingRLDatasetWriter
 from ml.rl.test.rl_dataset import RLDataset
 from ml.rl.thrift.core.ttypes import (
     CNNParameters,
@@ -36,6 +37,8 @@ from ml.rl.training.ddpg_trainer import DDPGTrainer
 from ml.rl.training.discrete_action_trainer import DiscreteActionTrainer
 from ml.rl.training.dqn_trainer import DQNTrainer
 from ml.rl.training.parametric_dqn_trainer import ParametricDQNTrainer
+from ml.rl.training.prefetching_loader import PrefetchingLoader
+from ml.rl.training.replay_memory import PrioritizedReplayMemory
 
 
 logger = logging.getLogger(__name__)
@@ -87,8 +90,12 @@ def run(
     render_every=10,
     save_timesteps_to_dataset=None,
     start_saving_from_episode=0,
+    state_dtype="float32",
+    prefetch_batches=0,
 ):
     avg_reward_history = []
+    # "float16" stores sampled state matrices in half precision
+    state_dtype = np.dtype(state_dtype).type
 
     if model_type == ModelType.CONTINUOUS_ACTION.value:
         predictor = GymDDPGPredictor(trainer)
@@ -101,6 +108,33 @@ def run(
         predictor = GymDQNPredictor(trainer, c2_device)
 
     total_timesteps = 0
+    # With prefetch_batches > 0, minibatches are sampled from replay memory
+    # on a worker thread while the previous one trains. Replay memory locks
+    # around inserts and samples, so batches are consistent, but a sampled
+    # batch can miss the last transitions inserted before it is trained on.
+    # Prioritized replay needs the slots of a batch to still hold its
+    # transitions when their TD errors are reported, so it is not prefetched.
+    assert prefetch_batches == 0 or not isinstance(
+        gym_env.replay_memory, PrioritizedReplayMemory
+    ), "Prioritized replay cannot be prefetched"
+    loader = None
+    if prefetch_batches > 0:
+        loader = PrefetchingLoader.from_function(
+            lambda: gym_env.sample_memories(
+                trainer.minibatch_size, model_type, state_dtype
+            ),
+            prefetch_batches,
+        )
+
+    def next_minibatch():
+        if loader is not None:
+            return loader.get()
+        return gym_env.sample_memories(trainer.minibatch_size, model_type, state_dtype)
+
+    def close_loader():
+        if loader is not None:
+            loader.close()
+            loader.log_report()
 
     for i in range(num_episodes):
         terminal = False
@@ -136,11 +170,13 @@ def run(
                 possible_next_actions_lengths,
             ) = get_possible_next_actions(gym_env, model_type, terminal)
 
+            # States are inserted in their own type, so replay memory keeps
+            # image frames as uint8
             gym_env.insert_into_memory(
-                np.float32(state),
+                state,
                 action,
                 np.float32(reward),
-                np.float32(next_state),
+                next_state,
                 next_action,
                 terminal,
                 possible_next_actions,
@@ -175,21 +211,21 @@ def run(
                 and len(gym_env.replay_memory) >= trainer.minibatch_size
             ):
                 for _ in range(num_train_batches):
+                    tdp = next_minibatch()
                     if model_type in (
                         ModelType.CONTINUOUS_ACTION.value,
                         ModelType.PYTORCH_DISCRETE_DQN.value,
                         ModelType.PYTORCH_PARAMETRIC_DQN.value,
                     ):
-                        samples = gym_env.sample_memories(
-                            trainer.minibatch_size, model_type
-                        )
-                        trainer.train(samples)
+                        trainer.train(tdp)
                     else:
                         with core.DeviceScope(c2_device):
-                            gym_env.sample_and_load_training_data_c2(
-                                trainer.minibatch_size, model_type
+                            gym_env.load_training_data_c2(tdp)
+                            trainer.train(
+                                tdp.importance_weights,
+                                fetch_td_errors=tdp.replay_indices is not None,
                             )
-                            trainer.train()
+                    gym_env.update_priorities(tdp, trainer.td_errors)
 
             # Evaluation loop
             if total_timesteps % test_every_ts == 0 and total_timesteps > test_after_ts:
@@ -209,11 +245,15 @@ def run(
                             test_run_name, avg_reward_history
                         )
                     )
+                    close_loader()
                     return avg_reward_history, trainer, predictor
 
             if max_steps and ep_timesteps >= max_steps:
                 break
 
+        # Stores the n-step transitions of an episode cut short by max_steps
+        gym_env.end_episode()
+
         # Always eval on last episode if previous eval loop didn't return.
         if i == num_episodes - 1:
             avg_rewards, avg_discounted_rewards = gym_env.run_ep_n_times(
@@ -230,6 +270,7 @@ def run(
     logger.info(
         "Avg. reward history for {}: {}".format(test_run_name, avg_reward_history)
     )
+    close_loader()
     return avg_reward_history, trainer, predictor
 
 
@@ -261,7 +302,9 @@ def main(args):
     parser.add_argument(
         "-f",
         "--file_path",
-        help="If set, save all collected samples as an RLDataset to this file.",
+        help="If set, save all collected samples to this path: as an RLDataset if "
+        "it ends in .json, else as a ColumnarRLDataset written while the run "
+        "goes on. An existing ColumnarRLDataset is appended to.",
         default=None,
     )
     parser.add_argument(
@@ -281,12 +324,22 @@ def main(args):
     with open(args.parameters, "r") as f:
         params = json.load(f)
 
-    dataset = RLDataset(args.file_path) if args.file_path else None
-    result, trainer, predictor = run_gym(
-        params, args.score_bar, args.gpu_id, dataset, args.start_saving_from_episode
-    )
-    if dataset:
-        dataset.save()
+    dataset = None
+    if args.file_path and args.file_path.endswith(".json"):
+        dataset = RLDataset(args.file_path)
+    elif args.file_path:
+        dataset = StreamingRLDatasetWriter(args.file_path)
+    try:
+        result, trainer, predictor = run_gym(
+            params,
+            args.score_bar,
+            args.gpu_id,
+            dataset,
+            args.start_saving_from_episode,
+        )
+    finally:
+        if dataset:
+            dataset.save()
     return result
 
 
@@ -316,7 +369,14 @@ def run_gym(
         rl_parameters.softmax_policy,
         params["max_replay_memory_size"],
         rl_parameters.gamma,
+        params.get("prioritized_replay_alpha", 0.0),
+        params.get("prioritized_replay_beta", 0.4),
+        params.get("n_step", 1),
+        params.get("replay_memory_path"),
     )
+    assert (
+        env.replay_memory.n_step == 1 or rl_parameters.use_seq_num_diff_as_time_diff
+    ), "n-step transitions need use_seq_num_diff_as_time_diff to be discounted"
     model_type = params["model_type"]
     c2_device = core.DeviceOption(
         caffe2_pb2.CPU if gpu_id == USE_CPU else caffe2_pb2.CUDA, gpu_id
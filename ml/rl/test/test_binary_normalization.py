@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+
+import os
+import tempfile
+import unittest
+
+from ml.rl.preprocessing import binary_normalization, identify_types, normalization
+from ml.rl.preprocessing.normalization import NormalizationParameters
+from ml.rl.test import preprocessing_util
+
+
+class TestBinaryNormalization(unittest.TestCase):
+    def _parameters(self):
+        _, feature_value_map = preprocessing_util.read_data()
+        parameters = {}
+        for name, values in feature_value_map.items():
+            parameters[name] = normalization.identify_parameter(values)
+        # An ENUM with no values and a feature with every optional field unset
+        parameters["empty_enum"] = NormalizationParameters(
+            identify_types.ENUM, None, None, 0, 1, [], None, None, None
+        )
+        parameters["defaults"] = NormalizationParameters(
+            identify_types.BINARY, None, None, None, None, None, None, None, None
+        )
+        return parameters
+
+    def test_round_trip(self):
+        parameters = self._parameters()
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "norm.bin")
+            binary_normalization.save(parameters, path)
+            loaded = binary_normalization.load(path)
+
+            self.assertEqual(len(loaded), len(parameters))
+            self.assertEqual(list(loaded), list(parameters))
+            self.assertEqual(
+                loaded[identify_types.QUANTILE], parameters[identify_types.QUANTILE]
+            )
+            self.assertEqual(loaded.to_dict(), parameters)
+            self.assertEqual(dict(loaded), parameters)
+
+            # Round trip through the JSON format
+            parameters_json = binary_normalization.binary_to_json(path)
+            self.assertEqual(normalization.deserialize(parameters_json), parameters)
+            json_path = os.path.join(tmpdir, "from_json.bin")
+            binary_normalization.json_to_binary(parameters_json, json_path)
+            self.assertEqual(binary_normalization.load(json_path).to_dict(), parameters)
+
+    def test_integer_features(self):
+        parameters = {
+            i: NormalizationParameters(
+                identify_types.CONTINUOUS, None, None, float(i), 1.0, None, None, 0, 1
+            )
+            for i in range(100)
+        }
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "norm.bin")
+            binary_normalization.save(parameters, path)
+            loaded = binary_normalization.load(path)
+            self.assertIn(42, loaded)
+            self.assertNotIn("42", loaded)
+            self.assertEqual(loaded[42].mean, 42.0)
+            self.assertEqual(
+                normalization.get_num_output_features(loaded),
+                normalization.get_num_output_features(parameters),
+            )
+
+    def test_negative_enum_rejected(self):
+        parameters = {
+            "f": NormalizationParameters(
+                identify_types.ENUM, None, None, 0, 1, [1, -2], None, None, None
+            )
+        }
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "norm.bin")
+            binary_normalization.save(parameters, path)
+            with self.assertRaises(Exception):
+                binary_normalization.load(path)
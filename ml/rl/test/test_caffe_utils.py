@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+
+import unittest
+
+import numpy as np
+from ml.rl.caffe_utils import StackedArray, StackedAssociativeArray
+from scipy import sparse
+
+
+class TestStackedArrays(unittest.TestCase):
+    def test_associative_array_csr(self):
+        rows = [{1: 1.0, 5: 2.0}, {}, {3: 3.0}]
+        from_dicts = StackedAssociativeArray.from_dict_list(rows, "from_dicts")
+        self.assertEqual(
+            [
+                {int(k): float(v) for k, v in row.items()}
+                for row in from_dicts.to_python()
+            ],
+            rows,
+        )
+
+        from_csr = StackedAssociativeArray.from_csr(
+            np.array([2, 0, 1], dtype=np.int32),
+            np.array([1, 5, 3], dtype=np.int64),
+            np.array([1.0, 2.0, 3.0], dtype=np.float32),
+            "from_csr",
+        )
+        keys, values = from_csr.to_numpy()
+        self.assertEqual([k.tolist() for k in keys], [[1, 5], [], [3]])
+        self.assertEqual([v.tolist() for v in values], [[1.0, 2.0], [], [3.0]])
+
+        matrix = sparse.csr_matrix(
+            (np.array([1.0, 2.0, 3.0]), np.array([1, 5, 3]), np.array([0, 2, 2, 3])),
+            shape=(3, 6),
+        )
+        from_matrix = StackedAssociativeArray.from_csr_matrix(matrix, "from_matrix")
+        self.assertEqual(from_matrix.to_python(), from_csr.to_python())
+
+    def test_stacked_array(self):
+        rows = [[1.0, 2.0], [], [3.0]]
+        from_lists = StackedArray.from_list_list(rows, "from_lists")
+        self.assertEqual([r.tolist() for r in from_lists.to_numpy()], rows)
+
+        from_numpy = StackedArray.from_numpy(
+            np.array([2, 0, 1]), np.array([1.0, 2.0, 3.0]), "from_numpy"
+        )
+        self.assertEqual([r.tolist() for r in from_numpy.to_numpy()], rows)
@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+
+import os
+import tempfile
+import threading
+import unittest
+
+import numpy as np
+from ml.rl.test.columnar_rl_dataset import ColumnarRLDataset, StreamingRLDatasetWriter
+from ml.rl.test.rl_dataset import RLDataset
+
+
+class TestColumnarRLDataset(unittest.TestCase):
+    def _insert_episodes(self, datasets, num_episodes=6):
+        np.random.seed(0)
+        for mdp_id in range(num_episodes):
+            num_steps = np.random.randint(2, 6)
+            for sequence_number in range(num_steps):
+                state = np.random.normal(size=3).astype(np.float32).tolist()
+                action = str(np.random.randint(2))
+                for dataset in datasets:
+                    dataset.insert(
+                        mdp_id,
+                        sequence_number,
+                        state,
+                        action,
+                        float(sequence_number),
+                        ["0", "1"],
+                    )
+            if mdp_id % 2 == 0:
+                # Episodes that end in a terminal state get a row without action
+                state = np.random.normal(size=3).astype(np.float32).tolist()
+                for dataset in datasets:
+                    dataset.insert(mdp_id, num_steps, state, None, 0.0, [])
+
+    def _expected_transitions(self, rows, mdp_ids=None):
+        states, next_states, not_terminals = [], [], []
+        for i, row in enumerate(rows):
+            if row["action"] is None:
+                continue
+            if mdp_ids is not None and int(row["mdp_id"]) not in mdp_ids:
+                continue
+            next_row = None
+            if i + 1 < len(rows) and rows[i + 1]["mdp_id"] == row["mdp_id"]:
+                next_row = rows[i + 1]
+            states.append([row["state_features"][str(k)] for k in range(3)])
+            next_states.append(
+                [next_row["state_features"][str(k)] for k in range(3)]
+                if next_row is not None
+                else [0.0] * 3
+            )
+            not_terminals.append(
+                next_row is not None and next_row["action"] is not None
+            )
+        return np.array(states), np.array(next_states), np.array(not_terminals)
+
+    def test_round_trip_and_pages(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "dataset")
+            dataset = ColumnarRLDataset(path, row_group_size=7)
+            json_dataset = RLDataset(os.path.join(tmpdir, "dataset.json"))
+            self._insert_episodes([dataset, json_dataset])
+            dataset.save()
+            self.assertGreater(len(dataset.metadata["row_groups"]), 2)
+
+            loaded = ColumnarRLDataset(path)
+            self.assertEqual(len(loaded), len(json_dataset.rows))
+            self.assertEqual(loaded.to_rows(), json_dataset.rows)
+
+            pages = list(loaded.pages(4))
+            self.assertTrue(all(len(page.states) == 4 for page in pages[:-1]))
+            states, next_states, not_terminals = self._expected_transitions(
+                json_dataset.rows
+            )
+            np.testing.assert_allclose(
+                np.concatenate([page.states for page in pages]), states
+            )
+            np.testing.assert_allclose(
+                np.concatenate([page.next_states for page in pages]), next_states
+            )
+            np.testing.assert_array_equal(
+                np.concatenate([page.not_terminals for page in pages]).ravel(),
+                not_terminals,
+            )
+
+            # Row groups outside the mdp_id range are skipped
+            pages = list(loaded.pages(100, min_mdp_id=2, max_mdp_id=3))
+            states, _, _ = self._expected_transitions(json_dataset.rows, {2, 3})
+            np.testing.assert_allclose(
+                np.concatenate([page.states for page in pages]), states
+            )
+
+            page = loaded.timeline_page(0.9)
+            states, next_states, not_terminals = self._expected_transitions(
+                json_dataset.rows
+            )
+            np.testing.assert_allclose(page.states, states)
+            np.testing.assert_allclose(page.next_states, next_states)
+            np.testing.assert_array_equal(page.not_terminals.ravel(), not_terminals)
+            first_mdp = [r for r in json_dataset.rows if r["mdp_id"] == "0"]
+            self.assertAlmostEqual(
+                page.episode_values[0, 0],
+                sum(r["reward"] * 0.9 ** i for i, r in enumerate(first_mdp)),
+                places=5,
+            )
+
+            converted = ColumnarRLDataset.from_rl_dataset(
+                json_dataset, os.path.join(tmpdir, "converted")
+            )
+            self.assertEqual(converted.to_rows(), json_dataset.rows)
+
+    def test_streaming_writer_resumes(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "dataset")
+            json_dataset = RLDataset(os.path.join(tmpdir, "dataset.json"))
+            writer = StreamingRLDatasetWriter(path, row_group_size=5)
+            self._insert_episodes([writer, json_dataset], num_episodes=4)
+            # Only the rows of the row group being filled stay in memory
+            self.assertLess(len(writer.dataset._mdp_ids), 5)
+            writer.save()
+            self.assertEqual(ColumnarRLDataset(path).to_rows(), json_dataset.rows)
+
+            # A resumed run numbers its episodes from 0 again
+            writer = StreamingRLDatasetWriter(path, row_group_size=5)
+            self.assertEqual(writer.mdp_id_offset, 4)
+            resumed_rows = RLDataset(os.path.join(tmpdir, "resumed.json"))
+            self._insert_episodes([writer, resumed_rows], num_episodes=3)
+            writer.save()
+            for row in resumed_rows.rows:
+                row["mdp_id"] = str(int(row["mdp_id"]) + 4)
+            self.assertEqual(
+                ColumnarRLDataset(path).to_rows(),
+                json_dataset.rows + resumed_rows.rows,
+            )
+
+            with self.assertRaises(Exception):
+                StreamingRLDatasetWriter(path, resume=False)
+
+    def test_streaming_writer_failure_does_not_block(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            writer = StreamingRLDatasetWriter(
+                os.path.join(tmpdir, "dataset"),
+                row_group_size=1,
+                max_pending_row_groups=1,
+            )
+            started = threading.Event()
+            release = threading.Event()
+
+            def write_row_group(columns):
+                started.set()
+                release.wait()
+                raise IOError("Disk full")
+
+            writer.dataset.write_row_group = write_row_group
+            writer.insert(0, 0, [0.0], "0", 0.0, ["0"])
+            started.wait()
+            # Fills the queue while the first row group is being written
+            writer.insert(0, 1, [0.0], "0", 0.0, ["0"])
+            threading.Timer(0.1, release.set).start()
+            # Blocks on the full queue until the failed write drains it
+            writer.insert(0, 2, [0.0], "0", 0.0, ["0"])
+            writer.dataset._buffer_row(0, 3, [0.0], "0", 0.0, ["0"])
+            with self.assertRaises(Exception):
+                writer.close()
+            self.assertFalse(writer._thread.is_alive())
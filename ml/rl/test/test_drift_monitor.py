@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+
+import unittest
+
+import numpy as np
+from ml.rl.preprocessing import identify_types, normalization
+from ml.rl.preprocessing.drift_monitor import DriftMonitor
+from ml.rl.preprocessing.preprocessor import Preprocessor
+
+
+class TestDriftMonitor(unittest.TestCase):
+    def _sample(self, num_rows, shift=0.0):
+        return {
+            1: np.random.normal(loc=shift, size=num_rows),
+            # Bimodal, so no Box-Cox transform makes it normal
+            2: np.random.normal(size=num_rows)
+            + np.random.choice([-5.0, 5.0], size=num_rows),
+            3: np.random.randint(0, 2, size=num_rows).astype(np.float64),
+            4: np.random.choice([3, 7, 11], size=num_rows).astype(np.float64),
+        }
+
+    def _sparse(self, sample):
+        num_rows = len(sample[1])
+        lengths = np.full(num_rows, len(sample), dtype=np.int32)
+        keys = np.tile(np.array(list(sample.keys()), dtype=np.int64), num_rows)
+        values = np.stack(list(sample.values()), axis=1).ravel().astype(np.float32)
+        return lengths, keys, values
+
+    def test_detects_shift(self):
+        np.random.seed(0)
+        sample = self._sample(10000)
+        parameters = {
+            str(f): normalization.identify_parameter(v) for f, v in sample.items()
+        }
+        self.assertEqual(parameters["2"].feature_type, identify_types.QUANTILE)
+        self.assertEqual(parameters["4"].feature_type, identify_types.ENUM)
+
+        monitor = DriftMonitor(parameters, max_rows_per_batch=512, reference_rows=2000)
+        for _ in range(40):
+            monitor.observe_sparse(*self._sparse(self._sample(1000)))
+        scores = monitor.drift_scores()
+        self.assertEqual(set(scores.keys()), set(parameters.keys()))
+        for score in scores.values():
+            self.assertLess(score.psi, 0.05)
+            self.assertLess(score.ks, 0.05)
+        self.assertGreater(scores["1"].num_rows, 10000)
+        self.assertGreater(monitor.seconds_per_batch(), 0)
+
+        monitor.reset()
+        for _ in range(20):
+            monitor.observe_sparse(*self._sparse(self._sample(1000, shift=1.0)))
+        scores = monitor.drift_scores()
+        self.assertGreater(scores["1"].psi, 0.25)
+        self.assertGreater(scores["1"].ks, 0.3)
+        for feature in ["2", "3", "4"]:
+            self.assertLess(scores[feature].psi, 0.05)
+
+    def test_normalized_pages(self):
+        np.random.seed(0)
+        sample = self._sample(10000)
+        parameters = {
+            str(f): normalization.identify_parameter(v) for f, v in sample.items()
+        }
+        for enum_as_index in [False, True]:
+            preprocessor = Preprocessor(True, enum_as_index)
+            monitor = DriftMonitor(
+                parameters, enum_as_index=enum_as_index, reference_rows=1000
+            )
+            sparse_monitor = DriftMonitor(
+                parameters, enum_as_index=enum_as_index, reference_rows=1000
+            )
+            for _ in range(10):
+                lengths, keys, values = self._sparse(self._sample(1000))
+                monitor.observe_normalized(
+                    preprocessor.normalize_sparse_matrix(
+                        lengths, keys, values, parameters
+                    )
+                )
+                sparse_monitor.observe_sparse(lengths, keys, values)
+            scores = monitor.drift_scores()
+            for score in scores.values():
+                self.assertLess(score.psi, 0.05)
+            # Raw rows normalized by the monitor histogram the same way
+            self.assertEqual(sparse_monitor.drift_scores(), scores)
+
+    def test_batch_counts(self):
+        np.random.seed(0)
+        sample = self._sample(10000)
+        parameters = {
+            str(f): normalization.identify_parameter(v) for f, v in sample.items()
+        }
+        monitor = DriftMonitor(parameters, max_rows_per_batch=1000, reference_rows=1500)
+        for _ in range(3):
+            monitor.observe_sparse(*self._sparse(self._sample(1000)))
+        # The second batch is split between the reference and the live rows
+        self.assertEqual(monitor.num_reference_rows, 1500)
+        self.assertEqual(monitor.num_rows, 1500)
+        self.assertEqual(monitor.num_batches, 2)
+        self.assertEqual(monitor.drift_scores()["3"].num_rows, 1500)
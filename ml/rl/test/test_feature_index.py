@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+
+import os
+import tempfile
+import unittest
+
+import numpy as np
+from ml.rl.preprocessing import identify_types, normalization
+from ml.rl.preprocessing.feature_index import FeatureIndex
+from ml.rl.preprocessing.normalization import NormalizationParameters
+
+
+class TestFeatureIndex(unittest.TestCase):
+    def _parameters(self):
+        continuous = NormalizationParameters(
+            identify_types.CONTINUOUS, None, None, 0, 1, None, None, None, None
+        )
+        binary = NormalizationParameters(
+            identify_types.BINARY, None, None, 0, 1, None, None, None, None
+        )
+        # Large, unordered 64-bit ids
+        return {
+            str(2 ** 62 + 5): continuous,
+            "17": binary,
+            str(2 ** 40): continuous,
+            "3": binary,
+        }
+
+    def test_columns_follow_type_order(self):
+        parameters = self._parameters()
+        index = FeatureIndex.from_normalization(parameters)
+        sorted_features, _ = normalization.sort_features_by_normalization(parameters)
+        self.assertEqual(index.features, sorted_features)
+
+        columns, known = index.lookup(
+            np.array([3, 2 ** 40, 4, 2 ** 62 + 5, 17, 2 ** 63 - 1], dtype=np.int64)
+        )
+        self.assertEqual(known.tolist(), [True, True, False, True, True, False])
+        self.assertEqual(
+            [index.features[c] for c in columns[known]],
+            ["3", str(2 ** 40), str(2 ** 62 + 5), "17"],
+        )
+
+    def test_densify(self):
+        index = FeatureIndex.from_normalization(self._parameters())
+        dense = index.densify(
+            np.array([2, 0, 2], dtype=np.int32),
+            np.array([17, 99, 2 ** 40, 3], dtype=np.int64),
+            np.array([1.0, 2.0, 3.0, 4.0], dtype=np.float32),
+        )
+        expected = np.full((3, 4), normalization.MISSING_VALUE, dtype=np.float32)
+        expected[0, index.features.index("17")] = 1.0
+        expected[2, index.features.index(str(2 ** 40))] = 3.0
+        expected[2, index.features.index("3")] = 4.0
+        np.testing.assert_array_equal(dense, expected)
+
+    def test_save_load(self):
+        index = FeatureIndex.from_normalization(self._parameters())
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "index.npz")
+            index.save(path)
+            loaded = FeatureIndex.load(path)
+        self.assertEqual(loaded.features, index.features)
+        np.testing.assert_array_equal(loaded.feature_ids, index.feature_ids)
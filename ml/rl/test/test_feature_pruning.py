@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+
+import unittest
+
+import numpy as np
+from ml.rl.preprocessing import identify_types, normalization
+from ml.rl.preprocessing.feature_pruning import (
+    FeatureAlias,
+    prune_features,
+    restore_pruned_features,
+)
+from ml.rl.preprocessing.parallel_normalization import identify_parameters
+
+
+class TestFeaturePruning(unittest.TestCase):
+    def _feature_values(self):
+        np.random.seed(0)
+        num_rows = 10000
+        base = np.random.normal(size=num_rows).astype(np.float32)
+        other = np.random.normal(size=num_rows).astype(np.float32)
+        with_missing = base.copy()
+        with_missing[::5] = normalization.MISSING_VALUE
+        return {
+            "base": base,
+            "other": other,
+            "constant": np.full(num_rows, 3.0, dtype=np.float32),
+            "duplicate": base.copy(),
+            "scaled": (2.0 * base + 1.0).astype(np.float32),
+            "duplicate_of_scaled": (2.0 * base + 1.0).astype(np.float32),
+            # Almost, but not quite, the same values as `base`
+            "noisy": (base + 0.5 * other).astype(np.float32),
+            "with_missing": with_missing,
+            "binary": (base > 0).astype(np.float32),
+        }
+
+    def test_prune(self):
+        feature_values = self._feature_values()
+        parameters = {
+            f: normalization.identify_parameter(v) for f, v in feature_values.items()
+        }
+        pruned, aliases = prune_features(feature_values, parameters, sketch_rows=1000)
+
+        self.assertEqual(
+            set(pruned.keys()), {"base", "other", "noisy", "with_missing", "binary"}
+        )
+        self.assertEqual(aliases["constant"], FeatureAlias(None, 0.0, 3.0))
+        self.assertEqual(aliases["duplicate"], FeatureAlias("base", 1.0, 0.0))
+        for feature in ["scaled", "duplicate_of_scaled"]:
+            self.assertEqual(aliases[feature].source, "base")
+            self.assertAlmostEqual(aliases[feature].scale, 2.0, places=4)
+            self.assertAlmostEqual(aliases[feature].offset, 1.0, places=4)
+        self.assertEqual(parameters["constant"].feature_type, identify_types.BINARY)
+        self.assertLess(
+            normalization.get_num_output_features(pruned),
+            normalization.get_num_output_features(parameters),
+        )
+
+        restored = restore_pruned_features(
+            {f: feature_values[f] for f in pruned}, aliases
+        )
+        self.assertEqual(set(restored.keys()), set(feature_values.keys()))
+        for feature, values in feature_values.items():
+            np.testing.assert_allclose(restored[feature], values, atol=1e-4)
+
+    def test_identify_parameters_with_pruning(self):
+        feature_values = self._feature_values()
+        aliases = {}
+        parameters = identify_parameters(
+            feature_values, num_workers=1, aliases=aliases
+        )
+        self.assertEqual(
+            set(parameters.keys()) | set(aliases.keys()), set(feature_values.keys())
+        )
+        self.assertEqual(
+            set(aliases.keys()),
+            {"constant", "duplicate", "scaled", "duplicate_of_scaled"},
+        )
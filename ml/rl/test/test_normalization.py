@@ -1,12 +1,15 @@
 #!/usr/bin/env python3
 
+import os
+import tempfile
 import unittest
+from unittest.mock import patch
 
 import numpy as np
 import six
 from caffe2.python import core, workspace
 from ml.rl.caffe_utils import C2
-from ml.rl.preprocessing import identify_types, normalization
+from ml.rl.preprocessing import identify_types, normalization, preprocessor_net
 from ml.rl.preprocessing.identify_types import BOXCOX, CONTINUOUS, ENUM
 from ml.rl.preprocessing.normalization import NormalizationParameters
 from ml.rl.preprocessing.preprocessor_net import PreprocessorNet
@@ -314,3 +317,133 @@ class TestNormalization(unittest.TestCase):
             probability_values, feature_type=identify_types.BINARY
         )
         self.assertEqual(parameter.feature_type, "BINARY")
+
+    def test_boxcox_subsampled(self):
+        _, feature_value_map = preprocessing_util.read_data()
+        values = feature_value_map[BOXCOX]
+        expected = normalization.identify_parameter(values)
+        fit_info = {}
+        parameter = normalization.identify_parameter(
+            values, boxcox_subsample_size=2000, fit_info=fit_info
+        )
+        self.assertEqual(parameter.feature_type, BOXCOX)
+        self.assertAlmostEqual(parameter.boxcox_lambda, expected.boxcox_lambda, 1)
+        # The Newton step estimate of the error matches the actual error
+        self.assertAlmostEqual(
+            fit_info["boxcox_lambda_error"],
+            abs(parameter.boxcox_lambda - expected.boxcox_lambda),
+            4,
+        )
+        self.assertAlmostEqual(parameter.mean, expected.mean, 1)
+        self.assertAlmostEqual(parameter.stddev, expected.stddev, 1)
+
+        # Columns smaller than the subsample use the exact fit
+        self.assertEqual(
+            normalization.identify_parameter(values, boxcox_subsample_size=20000),
+            expected,
+        )
+
+    def test_identify_parameter_cached(self):
+        _, feature_value_map = preprocessing_util.read_data()
+        values = feature_value_map[BOXCOX]
+        with tempfile.TemporaryDirectory() as cache_dir:
+            parameter = normalization.identify_parameter_cached(values, cache_dir)
+            self.assertEqual(parameter, normalization.identify_parameter(values))
+            self.assertEqual(len(os.listdir(cache_dir)), 1)
+
+            cached = normalization.identify_parameter_cached(values, cache_dir)
+            self.assertEqual(cached, parameter)
+            self.assertEqual(len(os.listdir(cache_dir)), 1)
+
+            # Different content or arguments are cached separately
+            normalization.identify_parameter_cached(values + 1, cache_dir)
+            normalization.identify_parameter_cached(
+                values, cache_dir, skip_box_cox=True
+            )
+            self.assertEqual(len(os.listdir(cache_dir)), 3)
+
+    def test_plan_cache(self):
+        features, feature_value_map = preprocessing_util.read_data()
+        normalization_parameters = {}
+        for name, values in feature_value_map.items():
+            normalization_parameters[name] = normalization.identify_parameter(values)
+        input_matrix = np.zeros([10000, len(features)], dtype=np.float32)
+        for i, feature in enumerate(features):
+            input_matrix[:, i] = feature_value_map[feature]
+
+        norm_net = core.Net("net")
+        C2.set_net(norm_net)
+        preprocessor = PreprocessorNet(False)
+        input_matrix_blob = "input_matrix_blob"
+        workspace.FeedBlob(input_matrix_blob, np.array([], dtype=np.float32))
+        output_blob, _ = preprocessor.normalize_dense_matrix(
+            input_matrix_blob, features, normalization_parameters, ""
+        )
+        workspace.FeedBlob(input_matrix_blob, input_matrix)
+        workspace.RunNetOnce(norm_net)
+        expected = workspace.FetchBlob(output_blob)
+
+        num_nets = len(workspace.Nets())
+        first = preprocessor.normalize_dense_matrix_cached(
+            input_matrix, features, normalization_parameters
+        )
+        self.assertEqual(len(workspace.Nets()), num_nets + 1)
+        np.testing.assert_allclose(first, expected)
+        # The global net is left alone
+        self.assertIs(C2.net(), norm_net)
+
+        # Equal parameters in a different dict order reuse the plan
+        reordered = dict(reversed(list(normalization_parameters.items())))
+        second = PreprocessorNet(False).normalize_dense_matrix_cached(
+            input_matrix[:100], features, reordered
+        )
+        self.assertEqual(len(workspace.Nets()), num_nets + 1)
+        np.testing.assert_allclose(second, expected[:100])
+
+        # Clipping changes the plan
+        PreprocessorNet(True).normalize_dense_matrix_cached(
+            input_matrix, features, normalization_parameters
+        )
+        self.assertEqual(len(workspace.Nets()), num_nets + 2)
+
+        # Only the most recently used plans are kept, and their nets replace
+        # those of the evicted plans
+        with patch.object(preprocessor_net, "MAX_CACHED_PLANS", 1):
+            for _ in range(3):
+                half_preprocessor = PreprocessorNet(False, output_dtype=np.float16)
+                half_preprocessor.normalize_dense_matrix_cached(
+                    input_matrix, features, normalization_parameters
+                )
+                self.assertEqual(len(preprocessor_net._PLAN_CACHE), 1)
+                # The evicted plan is built again
+                third = PreprocessorNet(False).normalize_dense_matrix_cached(
+                    input_matrix, features, normalization_parameters
+                )
+                self.assertEqual(len(workspace.Nets()), num_nets + 2)
+                np.testing.assert_allclose(third, expected)
+
+        # Parameters changed in place are not served by the old plan
+        column = features.index(CONTINUOUS)
+        parameter = normalization_parameters[CONTINUOUS]
+        normalization_parameters[CONTINUOUS] = parameter._replace(
+            mean=parameter.mean + 1.0
+        )
+        changed = preprocessor.normalize_dense_matrix_cached(
+            input_matrix, features, normalization_parameters
+        )
+        np.testing.assert_allclose(
+            changed[:, column],
+            expected[:, column] - 1.0 / parameter.stddev,
+            rtol=1e-5,
+            atol=1e-5,
+        )
+        np.testing.assert_allclose(
+            np.delete(changed, column, axis=1), np.delete(expected, column, axis=1)
+        )
+
+        self.assertNotEqual(
+            normalization.fingerprint_parameters(normalization_parameters, features),
+            normalization.fingerprint_parameters(
+                normalization_parameters, list(reversed(features))
+            ),
+        )
@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+
+import unittest
+
+import numpy as np
+from ml.rl.preprocessing import identify_types, normalization
+from ml.rl.preprocessing.parallel_normalization import identify_parameters
+from ml.rl.test import preprocessing_util
+
+
+class TestParallelNormalization(unittest.TestCase):
+    def test_matches_serial_identification(self):
+        features, feature_value_map = preprocessing_util.read_data()
+        expected = {
+            name: normalization.identify_parameter(values)
+            for name, values in feature_value_map.items()
+        }
+
+        timings = {}
+        parameters = identify_parameters(
+            feature_value_map, num_workers=2, timings=timings
+        )
+        self.assertEqual(parameters, expected)
+        self.assertEqual(set(timings.keys()), set(feature_value_map.keys()))
+        self.assertTrue(all(t >= 0 for t in timings.values()))
+
+        matrix = np.stack([feature_value_map[f] for f in features], axis=1)
+        parameters = identify_parameters(matrix, features=features, num_workers=1)
+        self.assertEqual(parameters, expected)
+        self.assertEqual(
+            normalization.deserialize(normalization.serialize(parameters)), expected
+        )
+
+    def test_feature_type_override(self):
+        _, feature_value_map = preprocessing_util.read_data()
+        parameters = identify_parameters(
+            feature_value_map,
+            num_workers=2,
+            feature_types={identify_types.PROBABILITY: identify_types.BINARY},
+        )
+        self.assertEqual(
+            parameters[identify_types.PROBABILITY].feature_type, identify_types.BINARY
+        )
+
+    def test_wide_integer_enum_is_not_rounded(self):
+        # 2^24 + 1 is not representable in float32
+        ids = np.array([1 << 24, (1 << 24) + 1, (1 << 24) + 3] * 10, dtype=np.int64)
+        noise = np.random.RandomState(0).normal(size=len(ids)).astype(np.float32)
+        parameters = identify_parameters(
+            {"enum": ids, "continuous": noise},
+            num_workers=1,
+            feature_types={"enum": identify_types.ENUM},
+        )
+        self.assertEqual(
+            sorted(parameters["enum"].possible_values), sorted(set(ids.tolist()))
+        )
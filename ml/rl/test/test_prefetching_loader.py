@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+
+import time
+import unittest
+
+from ml.rl.training.prefetching_loader import PrefetchingLoader
+
+
+class TestPrefetchingLoader(unittest.TestCase):
+    def test_order_and_transform(self):
+        loader = PrefetchingLoader(range(10), num_prefetch=3, transform=lambda x: 2 * x)
+        for _ in range(2):
+            self.assertEqual(list(loader), [2 * x for x in range(10)])
+        self.assertEqual(loader.num_batches, 20)
+
+    def test_back_pressure(self):
+        produced = []
+
+        def produce():
+            produced.append(len(produced))
+            return produced[-1]
+
+        loader = PrefetchingLoader.from_function(produce, num_prefetch=2)
+        self.assertEqual(loader.get(), 0)
+        time.sleep(0.2)
+        # Two batches waiting in the queue and one blocked on putting
+        self.assertLessEqual(len(produced), 4)
+        thread = loader._thread
+        loader.close()
+        self.assertFalse(thread.is_alive())
+
+    def test_wait_time(self):
+        def slow_batches():
+            for i in range(3):
+                time.sleep(0.05)
+                yield i
+
+        loader = PrefetchingLoader(slow_batches())
+        self.assertEqual(list(loader), [0, 1, 2])
+        self.assertGreater(loader.wait_seconds, 0.1)
+        self.assertGreater(loader.produce_seconds, 0.1)
+
+    def test_worker_error(self):
+        def failing_batches():
+            yield 0
+            raise ValueError("bad batch")
+
+        loader = PrefetchingLoader(failing_batches())
+        with self.assertRaises(ValueError):
+            list(loader)
@@ -0,0 +1,283 @@
+#!/usr/bin/env python3
+
+import unittest
+
+import numpy as np
+from caffe2.python import core, workspace
+from ml.rl.caffe_utils import C2
+from ml.rl.preprocessing import identify_types, normalization
+from ml.rl.preprocessing.normalization import NormalizationParameters
+from ml.rl.preprocessing.preprocessor import Preprocessor
+from ml.rl.preprocessing.preprocessor_net import PreprocessorNet, choose_num_chunks
+from ml.rl.test import preprocessing_util
+
+
+class TestPreprocessor(unittest.TestCase):
+    def _read_data(self):
+        features, feature_value_map = preprocessing_util.read_data()
+        normalization_parameters = {}
+        for name, values in feature_value_map.items():
+            normalization_parameters[name] = normalization.identify_parameter(
+                values, 10
+            )
+        input_matrix = np.zeros([10000, len(features)], dtype=np.float32)
+        for i, feature in enumerate(features):
+            input_matrix[:, i] = feature_value_map[feature]
+        # Exercise the missing-value path of every feature type
+        input_matrix[::7, :] = normalization.MISSING_VALUE
+        return features, normalization_parameters, input_matrix
+
+    def _run_net_dense(self, input_matrix, features, normalization_parameters, clip):
+        norm_net = core.Net("net")
+        C2.set_net(norm_net)
+        preprocessor = PreprocessorNet(clip)
+        input_matrix_blob = "input_matrix_blob"
+        workspace.FeedBlob(input_matrix_blob, np.array([], dtype=np.float32))
+        output_blob, _ = preprocessor.normalize_dense_matrix(
+            input_matrix_blob, features, normalization_parameters, ""
+        )
+        workspace.FeedBlob(input_matrix_blob, input_matrix)
+        workspace.RunNetOnce(norm_net)
+        return workspace.FetchBlob(output_blob)
+
+    def test_dense_parity(self):
+        features, normalization_parameters, input_matrix = self._read_data()
+        for clip_anomalies in [False, True]:
+            expected = self._run_net_dense(
+                input_matrix, features, normalization_parameters, clip_anomalies
+            )
+            actual = Preprocessor(clip_anomalies).normalize_dense_matrix(
+                input_matrix, features, normalization_parameters
+            )
+            self.assertEqual(actual.dtype, np.float32)
+            self.assertEqual(actual.shape, expected.shape)
+            np.testing.assert_allclose(actual, expected, rtol=1e-4, atol=1e-4)
+
+    def test_float16_output(self):
+        features, normalization_parameters, input_matrix = self._read_data()
+        expected = Preprocessor(True).normalize_dense_matrix(
+            input_matrix, features, normalization_parameters
+        )
+        actual = Preprocessor(True, output_dtype=np.float16).normalize_dense_matrix(
+            input_matrix, features, normalization_parameters
+        )
+        self.assertEqual(actual.dtype, np.float16)
+        # Outputs are clipped to [-3, 3], where float16 keeps ~3 digits
+        np.testing.assert_allclose(actual, expected, rtol=1e-3, atol=2e-3)
+
+        lengths, keys, values, sparse_parameters = self._sparse_data()
+        expected = Preprocessor(True).normalize_sparse_matrix(
+            lengths, keys, values, sparse_parameters
+        )
+        actual = PreprocessorNet(
+            True, output_dtype=np.float16
+        ).normalize_sparse_matrix_cached(lengths, keys, values, sparse_parameters)
+        self.assertEqual(actual.dtype, np.float16)
+        np.testing.assert_allclose(actual, expected, rtol=1e-3, atol=2e-3)
+
+    def test_dense_enum(self):
+        normalization_parameters = {
+            "f1": NormalizationParameters(
+                identify_types.ENUM,
+                None,
+                None,
+                None,
+                None,
+                [12, 4, 2],
+                None,
+                None,
+                None,
+            ),
+            "f2": NormalizationParameters(
+                identify_types.CONTINUOUS, None, 0, 0, 1, None, None, None, None
+            ),
+            "f3": NormalizationParameters(
+                identify_types.ENUM, None, None, None, None, [15, 3], None, None, None
+            ),
+        }
+        inputs = np.zeros([4, 3], dtype=np.float32)
+        feature_ids = ["f2", "f1", "f3"]  # Sorted according to feature type
+        inputs[:, feature_ids.index("f1")] = [12, 4, 2, 2]
+        inputs[:, feature_ids.index("f2")] = [1.0, 2.0, 3.0, 3.0]
+        inputs[:, feature_ids.index("f3")] = [15, 3, 15, normalization.MISSING_VALUE]
+
+        normalized_feature_matrix = Preprocessor(False).normalize_dense_matrix(
+            inputs, feature_ids, normalization_parameters
+        )
+        np.testing.assert_allclose(
+            np.array(
+                [
+                    [1.0, 1, 0, 0, 1, 0],
+                    [2.0, 0, 1, 0, 0, 1],
+                    [3.0, 0, 0, 1, 1, 0],
+                    [3.0, 0, 0, 1, 0, 0],  # Missing values should go to all 0
+                ]
+            ),
+            normalized_feature_matrix,
+        )
+        np.testing.assert_allclose(
+            self._run_net_dense(inputs, feature_ids, normalization_parameters, False),
+            normalized_feature_matrix,
+        )
+
+    def _sparse_data(self):
+        np.random.seed(0)
+        normalization_parameters = {}
+        for feature in range(1, 6):
+            normalization_parameters[str(feature)] = normalization.identify_parameter(
+                np.random.normal(size=1000).astype(np.float32)
+            )
+        normalization_parameters["7"] = normalization.identify_parameter(
+            np.random.randint(0, 2, size=1000).astype(np.float32)
+        )
+
+        lengths = []
+        keys = []
+        values = []
+        for _ in range(100):
+            # Feature 6 has no parameters and must be ignored
+            row_keys = [k for k in range(1, 8) if np.random.rand() < 0.6]
+            lengths.append(len(row_keys))
+            keys.extend(row_keys)
+            values.extend(np.random.normal(size=len(row_keys)).tolist())
+        lengths = np.array(lengths, dtype=np.int32)
+        keys = np.array(keys, dtype=np.int64)
+        values = np.array(values, dtype=np.float32)
+        return lengths, keys, values, normalization_parameters
+
+    def test_sparse_parity(self):
+        lengths, keys, values, normalization_parameters = self._sparse_data()
+        net = core.Net("net")
+        C2.set_net(net)
+        workspace.FeedBlob("lengths", lengths)
+        workspace.FeedBlob("keys", keys)
+        workspace.FeedBlob("values", values)
+        for normalize in [False, True]:
+            output_blob, _ = PreprocessorNet(True).normalize_sparse_matrix(
+                "lengths",
+                "keys",
+                "values",
+                normalization_parameters,
+                "input",
+                False,
+                False,
+                normalize,
+            )
+            workspace.RunNetOnce(net)
+            expected = workspace.FetchBlob(output_blob)
+            actual = Preprocessor(True).normalize_sparse_matrix(
+                lengths, keys, values, normalization_parameters, normalize
+            )
+            np.testing.assert_allclose(actual, expected, rtol=1e-5, atol=1e-5)
+
+    def test_chunked_sparse_plan(self):
+        lengths, keys, values, normalization_parameters = self._sparse_data()
+        expected = Preprocessor(True).normalize_sparse_matrix(
+            lengths, keys, values, normalization_parameters
+        )
+
+        self.assertEqual(choose_num_chunks(100, 3, 7), 3)
+        self.assertEqual(choose_num_chunks(100, 32, 40), 3)
+        self.assertEqual(choose_num_chunks(10, 8, 4096), 1)
+
+        chunk_timings = []
+        # 100 rows do not divide evenly into 3 chunks
+        actual = PreprocessorNet(True).normalize_sparse_matrix_cached(
+            lengths,
+            keys,
+            values,
+            normalization_parameters,
+            num_workers=3,
+            target_chunk_size=7,
+            chunk_timings=chunk_timings,
+        )
+        np.testing.assert_allclose(actual, expected, rtol=1e-5, atol=1e-5)
+        self.assertEqual(len(chunk_timings), 3)
+
+        num_entries = lengths[:10].sum()
+        actual = PreprocessorNet(True).normalize_sparse_matrix_cached(
+            lengths[:10],
+            keys[:num_entries],
+            values[:num_entries],
+            normalization_parameters,
+        )
+        np.testing.assert_allclose(actual, expected[:10], rtol=1e-5, atol=1e-5)
+
+    def test_torch_tensor_round_trip(self):
+        import torch
+
+        features, normalization_parameters, input_matrix = self._read_data()
+        preprocessor = Preprocessor(False)
+        expected = preprocessor.normalize_dense_matrix(
+            input_matrix, features, normalization_parameters
+        )
+        actual = preprocessor.normalize_dense_matrix(
+            torch.from_numpy(input_matrix), features, normalization_parameters
+        )
+        self.assertTrue(isinstance(actual, torch.Tensor))
+        np.testing.assert_allclose(actual.numpy(), expected)
+
+    def test_enum_as_index(self):
+        normalization_parameters = {
+            "f1": NormalizationParameters(
+                identify_types.ENUM,
+                None,
+                None,
+                None,
+                None,
+                [12, 4, 2],
+                None,
+                None,
+                None,
+            ),
+            "f2": NormalizationParameters(
+                identify_types.CONTINUOUS, None, 0, 0, 1, None, None, None, None
+            ),
+            "f3": NormalizationParameters(
+                identify_types.ENUM, None, None, None, None, [15, 3], None, None, None
+            ),
+        }
+        inputs = np.zeros([4, 3], dtype=np.float32)
+        feature_ids = ["f2", "f1", "f3"]  # Sorted according to feature type
+        # 3 is a possible value of f3 only, so it is unknown for f1
+        inputs[:, feature_ids.index("f1")] = [12, 4, 2, 3]
+        inputs[:, feature_ids.index("f2")] = [1.0, 2.0, 3.0, 3.0]
+        inputs[:, feature_ids.index("f3")] = [15, 3, 15, normalization.MISSING_VALUE]
+        expected = np.array(
+            [
+                [1.0, 0, 0],
+                [2.0, 1, 1],
+                [3.0, 2, 0],
+                [3.0, 3, 2],  # Unknown and missing values get the reserved index
+            ]
+        )
+
+        actual = Preprocessor(False, enum_as_index=True).normalize_dense_matrix(
+            inputs, feature_ids, normalization_parameters
+        )
+        np.testing.assert_allclose(actual, expected)
+
+        norm_net = core.Net("net")
+        C2.set_net(norm_net)
+        input_blob = C2.NextBlob("input_blob")
+        workspace.FeedBlob(input_blob, np.array([0], dtype=np.float32))
+        output_blob, _ = PreprocessorNet(
+            False, enum_as_index=True
+        ).normalize_dense_matrix(input_blob, feature_ids, normalization_parameters, "")
+        workspace.FeedBlob(input_blob, inputs)
+        workspace.RunNetOnce(norm_net)
+        np.testing.assert_allclose(workspace.FetchBlob(output_blob), expected)
+
+        self.assertEqual(
+            normalization.get_num_output_features(normalization_parameters), 6
+        )
+        self.assertEqual(
+            normalization.get_num_output_features(
+                normalization_parameters, enum_as_index=True
+            ),
+            3,
+        )
+        self.assertEqual(
+            normalization.get_enum_index_columns(normalization_parameters),
+            [(1, 4), (2, 3)],
+        )
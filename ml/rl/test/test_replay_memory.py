@@ -0,0 +1,288 @@
+#!/usr/bin/env python3
+
+import os
+import tempfile
+import threading
+import unittest
+
+import numpy as np
+from ml.rl.training.replay_memory import (
+    PrioritizedReplayMemory,
+    ReplayMemory,
+    SumTree,
+    sample_without_replacement,
+)
+from ml.rl.training.replay_storage import MemoryMappedColumnStorage
+
+
+def insert_rewards(memory, rewards):
+    for reward in rewards:
+        memory.insert(
+            np.full(3, reward),
+            [1.0, 0.0],
+            reward,
+            np.zeros(3),
+            [0.0, 1.0],
+            False,
+            [1, 1],
+            2,
+            1,
+        )
+
+
+class TestReplayMemory(unittest.TestCase):
+    def test_reservoir_matches_list_memory(self):
+        np.random.seed(0)
+        memory = ReplayMemory(100)
+        insert_rewards(memory, range(1000))
+
+        # The list based reservoir the memory replaced
+        np.random.seed(0)
+        expected, skip_insert_until = [], 100
+        for memory_num in range(1000):
+            if memory_num < 100:
+                expected.append(memory_num)
+            elif memory_num >= skip_insert_until:
+                skip_insert_until += np.random.geometric(100.0 / memory_num)
+                expected[np.random.randint(100)] = memory_num
+
+        self.assertEqual(len(memory), 100)
+        self.assertEqual(memory.columns["rewards"].tolist(), expected)
+        self.assertEqual(memory.columns["states"][:, 0].tolist(), expected)
+
+    def test_ring_overwrites_oldest(self):
+        memory = ReplayMemory(10, reservoir=False)
+        insert_rewards(memory, range(25))
+        self.assertEqual(
+            sorted(memory.columns["rewards"].tolist()), list(range(15, 25))
+        )
+
+    def test_zero_capacity(self):
+        for memory in [ReplayMemory(0), PrioritizedReplayMemory(0, n_step=2)]:
+            insert_rewards(memory, range(5))
+            memory.end_episode()
+            self.assertEqual(len(memory), 0)
+            self.assertEqual(memory.memory_num, 5)
+            self.assertEqual(memory.columns, {})
+
+    def test_sample_discrete(self):
+        np.random.seed(0)
+        memory = ReplayMemory(50)
+        insert_rewards(memory, range(20))
+        page = memory.sample(8, np.float16)
+        self.assertEqual(page.size(), 8)
+        self.assertEqual(len(set(page.rewards.tolist())), 8)
+        self.assertEqual(page.states.dtype, np.float16)
+        np.testing.assert_array_equal(page.states[:, 0], page.rewards)
+        self.assertEqual(page.possible_next_actions.tolist(), [[1.0, 1.0]] * 8)
+        self.assertTrue(page.not_terminals.all())
+        self.assertIsNone(page.next_state_pnas_concat)
+        # Asking for more than is stored returns everything
+        self.assertEqual(memory.sample(100).size(), 20)
+
+    def test_sample_parametric(self):
+        memory = ReplayMemory(10)
+        for i in range(4):
+            terminal = i % 2 == 1
+            memory.insert(
+                np.full(2, i),
+                np.eye(3)[i % 3],
+                0.0,
+                np.full(2, i),
+                np.eye(3)[0],
+                terminal,
+                np.array([]) if terminal else np.eye(3),
+                0 if terminal else 3,
+                1,
+            )
+        page = memory.get_page(np.array([3, 0, 2]))
+        self.assertEqual(page.possible_next_actions_lengths.tolist(), [0, 3, 3])
+        self.assertEqual(page.not_terminals.tolist(), [False, True, True])
+        np.testing.assert_array_equal(
+            page.possible_next_actions, np.tile(np.eye(3), (2, 1))
+        )
+        np.testing.assert_array_equal(
+            page.next_state_pnas_concat[:, :2], [[0, 0]] * 3 + [[2, 2]] * 3
+        )
+
+    def test_n_step(self):
+        memory = ReplayMemory(20, n_step=3, gamma=0.5)
+        # Two episodes, the second cut short before it terminates
+        episodes = [[(1.0, 1), (2.0, 1), (4.0, 2), (8.0, 1), (16.0, 1)], [(1.0, 1)]]
+        for episode, steps in enumerate(episodes):
+            for i, (reward, time_diff) in enumerate(steps):
+                terminal = episode == 0 and i == len(steps) - 1
+                memory.insert(
+                    np.full(2, 10 * episode + i),
+                    [1.0, 0.0],
+                    reward,
+                    np.full(2, 10 * episode + i + 1),
+                    [0.0, 1.0],
+                    terminal,
+                    [1, 1],
+                    2,
+                    time_diff,
+                )
+            # The terminal transition stored the rest of the first episode,
+            # the cut short second one waits
+            self.assertEqual(len(memory), 5)
+        memory.end_episode()
+
+        page = memory.get_page(np.arange(len(memory)))
+        self.assertEqual(page.states[:, 0].tolist(), [0, 1, 2, 3, 4, 10])
+        self.assertEqual(page.next_states[:, 0].tolist(), [3, 4, 5, 5, 5, 11])
+        self.assertEqual(page.time_diffs.tolist(), [4, 4, 4, 2, 1, 1])
+        np.testing.assert_allclose(
+            page.rewards,
+            [
+                1 + 0.5 * 2 + 0.25 * 4,
+                2 + 0.5 * 4 + 0.125 * 8,
+                4 + 0.25 * 8 + 0.125 * 16,
+                8 + 0.5 * 16,
+                16,
+                1,
+            ],
+        )
+        self.assertEqual(
+            page.not_terminals.tolist(), [True, True, False, False, False, True]
+        )
+
+    def test_memory_mapped_storage(self):
+        with tempfile.TemporaryDirectory() as path:
+            # A cache of 4 pages of 2 rows, smaller than the columns
+            storage = MemoryMappedColumnStorage(path, page_rows=2, cache_rows=8)
+            memory = ReplayMemory(20, reservoir=False, storage=storage)
+            in_ram = ReplayMemory(20, reservoir=False)
+            for start in (0, 30):
+                # The second round overwrites rows of cached pages
+                for m in (memory, in_ram):
+                    insert_rewards(m, range(start, start + 30))
+                # Batches touching fewer pages than the cache holds, which
+                # reuse and evict cached pages, and one touching more
+                batches = list(np.random.RandomState(start).randint(20, size=(30, 3)))
+                for indices in batches + [[3, 17, 2, 3, 9], np.arange(20)[::-1]]:
+                    page = memory.get_page(np.array(indices))
+                    expected = in_ram.get_page(np.array(indices))
+                    np.testing.assert_array_equal(page.states, expected.states)
+                    np.testing.assert_array_equal(page.rewards, expected.rewards)
+                    np.testing.assert_array_equal(
+                        page.possible_next_actions, expected.possible_next_actions
+                    )
+            # Writing a row of a cached page drops the page
+            slot = memory.memory_num % 20
+            memory.get_page(np.array([slot]))
+            for m in (memory, in_ram):
+                insert_rewards(m, [100])
+            self.assertEqual(memory.get_page(np.array([slot])).rewards.tolist(), [100])
+
+            self.assertTrue(os.path.exists(os.path.join(path, "states.npy")))
+            self.assertGreater(storage.num_page_hits, 0)
+
+    def test_state_dtype(self):
+        with tempfile.TemporaryDirectory() as path:
+            storage = MemoryMappedColumnStorage(path, page_rows=2, cache_rows=8)
+            memory = ReplayMemory(4, reservoir=False, storage=storage)
+            for i in range(4):
+                frame = np.full((2, 3, 3), 250 + i, dtype=np.uint8)
+                memory.insert(
+                    frame, [1.0, 0.0], i, frame, [0.0, 1.0], False, [1, 1], 2, 1
+                )
+            # Image frames are stored as uint8, not float32
+            states = np.load(os.path.join(path, "states.npy"), mmap_mode="r")
+            self.assertEqual(states.dtype, np.uint8)
+            page = memory.get_page(np.array([3, 0]))
+            self.assertEqual(page.states.dtype, np.float32)
+            self.assertEqual(page.next_states[:, 0, 0, 0].tolist(), [253, 250])
+        # Types float32 does not hold exactly are stored as float32
+        memory = ReplayMemory(4)
+        insert_rewards(memory, [1])
+        self.assertEqual(memory.columns["states"].dtype, np.float32)
+
+    def test_sample_while_inserting(self):
+        np.random.seed(0)
+        memory = ReplayMemory(64, reservoir=False)
+        insert_rewards(memory, range(64))
+
+        def insert():
+            for reward in range(64, 20000):
+                memory.insert(
+                    np.full(3, reward),
+                    [1.0, 0.0],
+                    reward,
+                    np.full(3, reward),
+                    [0.0, 1.0],
+                    False,
+                    [1, 1],
+                    2,
+                    1,
+                )
+
+        thread = threading.Thread(target=insert)
+        thread.start()
+        while thread.is_alive():
+            page = memory.sample(32)
+            # Every field of a sampled row comes from the same transition
+            np.testing.assert_array_equal(page.states[:, 0], page.rewards)
+            np.testing.assert_array_equal(page.next_states[:, 0], page.rewards)
+        thread.join()
+
+    def test_sample_without_replacement(self):
+        np.random.seed(0)
+        for population, num_samples in ((1000000, 100), (10, 7), (5, 9)):
+            indices = sample_without_replacement(population, num_samples)
+            self.assertEqual(len(set(indices.tolist())), min(population, num_samples))
+            self.assertTrue(((indices >= 0) & (indices < population)).all())
+
+
+class TestPrioritizedReplayMemory(unittest.TestCase):
+    def test_sum_tree(self):
+        np.random.seed(0)
+        tree = SumTree(37)
+        values = np.random.random(37)
+        values[[3, 20]] = 0
+        tree.update(np.arange(37), values)
+        tree.update([5, 5, 36], [0.0, 2.0, 1.5])
+        values[[5, 36]] = [2.0, 1.5]
+        self.assertAlmostEqual(tree.total, values.sum())
+        ends = np.cumsum(values)
+        prefix_sums = np.random.random(1000) * tree.total
+        np.testing.assert_array_equal(
+            tree.find(prefix_sums), np.searchsorted(ends, prefix_sums, side="right")
+        )
+        # Sums at the very end never land on an empty leaf
+        self.assertEqual(tree.find([tree.total])[0], 36)
+
+    def test_sampling_follows_priorities(self):
+        np.random.seed(0)
+        memory = PrioritizedReplayMemory(4, alpha=1.0, beta=1.0, epsilon=0.0)
+        insert_rewards(memory, range(4))
+        # New transitions start at the largest priority
+        np.testing.assert_array_equal(memory.tree.get(np.arange(4)), [1, 1, 1, 1])
+        memory.update_priorities([0, 1, 2, 3], [1.0, -3.0, 0.0, 4.0])
+        self.assertEqual(memory.max_priority, 4.0)
+
+        page = memory.sample(8000)
+        counts = np.bincount(page.replay_indices, minlength=4)
+        np.testing.assert_allclose(counts / 8000.0, [0.125, 0.375, 0, 0.5], atol=0.01)
+        np.testing.assert_array_equal(page.rewards, page.replay_indices)
+        # (N P(i)) ^ -1, divided by the largest weight
+        weights = dict(zip(page.replay_indices.tolist(), page.importance_weights))
+        self.assertAlmostEqual(weights[0], 1.0)
+        self.assertAlmostEqual(weights[1], 1.0 / 3)
+        self.assertAlmostEqual(weights[3], 0.25)
+
+        # The first insert into a full memory always replaces a transition
+        insert_rewards(memory, [4])
+        slot = memory.columns["rewards"].tolist().index(4)
+        self.assertEqual(memory.tree.get([slot])[0], 4.0)
+
+    def test_empty_priority_update(self):
+        memory = PrioritizedReplayMemory(4)
+        insert_rewards(memory, range(4))
+        total = memory.tree.total
+        memory.update_priorities([], [])
+        memory.tree.update([], [])
+        self.assertEqual(memory.tree.total, total)
+        self.assertEqual(memory.max_priority, 1.0)
+        page = memory.get_page(np.zeros(0, dtype=np.int64))
+        self.assertEqual(len(page.importance_weights), 0)
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+
+import unittest
+
+import numpy as np
+from ml.rl.preprocessing import identify_types, normalization
+from ml.rl.preprocessing.moments import StreamingMoments, normaltest_from_moments
+from ml.rl.preprocessing.streaming_normalization import (
+    StreamingNormalizationIdentifier,
+)
+from ml.rl.test import preprocessing_util
+from scipy import stats
+
+
+class TestStreamingNormalization(unittest.TestCase):
+    def _identify_sharded(self, values, num_shards, chunk_size):
+        shards = []
+        for shard_id, shard in enumerate(np.array_split(values, num_shards)):
+            identifier = StreamingNormalizationIdentifier(seed=shard_id)
+            for start in range(0, len(shard), chunk_size):
+                identifier.update(shard[start : start + chunk_size])
+            shards.append(identifier)
+        merged = shards[0]
+        for shard in shards[1:]:
+            merged.merge(shard)
+        return merged
+
+    def test_moments_merge(self):
+        np.random.seed(0)
+        values = stats.expon.rvs(size=10000)
+        moments = StreamingMoments()
+        for chunk in np.array_split(values, 7):
+            moments.merge(StreamingMoments().update(chunk))
+
+        self.assertEqual(moments.count, len(values))
+        self.assertAlmostEqual(moments.mean, np.mean(values))
+        self.assertAlmostEqual(moments.std(ddof=1), np.std(values, ddof=1))
+        self.assertAlmostEqual(moments.skew(), stats.skew(values))
+        self.assertAlmostEqual(
+            moments.kurtosis(), stats.kurtosis(values, fisher=False)
+        )
+
+        k2, p = normaltest_from_moments(
+            moments.count, moments.skew(), moments.kurtosis()
+        )
+        expected_k2, expected_p = stats.normaltest(values)
+        self.assertAlmostEqual(k2, expected_k2, places=5)
+        self.assertAlmostEqual(p, expected_p, places=5)
+
+    def test_matches_in_memory_identification(self):
+        _, feature_value_map = preprocessing_util.read_data()
+        for name, values in feature_value_map.items():
+            expected = normalization.identify_parameter(values)
+            actual = self._identify_sharded(values, 3, 1000).identify_parameter()
+
+            self.assertEqual(actual.feature_type, expected.feature_type, name)
+            self.assertEqual(actual.min_value, expected.min_value)
+            self.assertEqual(actual.max_value, expected.max_value)
+            if expected.feature_type == identify_types.ENUM:
+                self.assertEqual(actual.possible_values, expected.possible_values)
+            elif expected.feature_type == identify_types.CONTINUOUS:
+                self.assertAlmostEqual(actual.mean, expected.mean, places=5)
+                self.assertAlmostEqual(actual.stddev, expected.stddev, places=5)
+            elif expected.feature_type == identify_types.BOXCOX:
+                self.assertAlmostEqual(
+                    actual.boxcox_lambda, expected.boxcox_lambda, places=2
+                )
+                self.assertAlmostEqual(actual.mean, expected.mean, places=2)
+                self.assertAlmostEqual(actual.stddev, expected.stddev, places=2)
+            elif expected.feature_type == identify_types.QUANTILE:
+                np.testing.assert_allclose(
+                    actual.quantiles, expected.quantiles, atol=0.05
+                )
+
+    def test_sketch_bounds_memory(self):
+        np.random.seed(0)
+        identifier = StreamingNormalizationIdentifier(sketch_size=1000, seed=0)
+        for _ in range(20):
+            identifier.update(stats.norm.rvs(size=5000))
+
+        self.assertEqual(identifier.count, 100000)
+        self.assertEqual(len(identifier.reservoir.values), 1000)
+        self.assertTrue(identifier.distinct_overflow)
+        self.assertEqual(len(identifier.distinct_values), 0)
+        self.assertEqual(
+            identifier.identify_parameter().feature_type, identify_types.CONTINUOUS
+        )
+
+    def test_enum_overflow_becomes_continuous(self):
+        values = np.arange(2000, dtype=np.float32)
+        identifier = StreamingNormalizationIdentifier(max_unique_enum_values=10)
+        identifier.update(values[:5]).update(values[5:])
+        self.assertEqual(identifier.identify_type(), identify_types.CONTINUOUS)
+        self.assertEqual(
+            identifier.identify_type(),
+            identify_types.identify_type(values, enum_threshold=10),
+        )
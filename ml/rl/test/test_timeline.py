@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+
+import unittest
+
+import numpy as np
+from ml.rl.preprocessing.timeline import build_timeline, discounted_suffix_sums
+
+
+class TestTimeline(unittest.TestCase):
+    def _random_rows(self, num_mdps=30):
+        random = np.random.RandomState(0)
+        rows = []
+        for mdp_id in range(num_mdps):
+            num_steps = random.randint(1, 40)
+            sequence_numbers = np.cumsum(random.randint(1, 4, size=num_steps))
+            for i, sequence_number in enumerate(sequence_numbers):
+                terminal = i == num_steps - 1 and mdp_id % 3 == 0
+                possible_actions = [] if terminal else [0, 2] if i % 2 else [1]
+                rows.append(
+                    (
+                        mdp_id,
+                        int(sequence_number),
+                        -1 if terminal else random.choice(possible_actions),
+                        float(random.normal()),
+                        possible_actions,
+                    )
+                )
+        order = random.permutation(len(rows))
+        return [rows[i] for i in order]
+
+    def _expected(self, rows, gamma, use_seq_num_diff_as_time_diff):
+        by_mdp = {}
+        for i, row in enumerate(rows):
+            by_mdp.setdefault(row[0], []).append(i)
+        expected = {}
+        for indices in by_mdp.values():
+            indices.sort(key=lambda i: rows[i][1])
+            for position, i in enumerate(indices):
+                if rows[i][2] < 0:
+                    continue
+                value = 0.0
+                for later in indices[position:]:
+                    if use_seq_num_diff_as_time_diff:
+                        exponent = rows[later][1] - rows[i][1]
+                    else:
+                        exponent = indices.index(later) - position
+                    value += rows[later][3] * gamma ** exponent
+                if position + 1 < len(indices):
+                    next_row = indices[position + 1]
+                    expected[i] = (
+                        next_row,
+                        rows[next_row][2],
+                        rows[next_row][1] - rows[i][1],
+                        rows[next_row][4],
+                        value,
+                    )
+                else:
+                    expected[i] = (-1, -1, 1, [], value)
+        return expected
+
+    def test_matches_python_loop(self):
+        rows = self._random_rows()
+        lengths = [len(row[4]) for row in rows]
+        for use_seq_num_diff_as_time_diff in (False, True):
+            timeline = build_timeline(
+                [row[0] for row in rows],
+                [row[1] for row in rows],
+                np.array([row[2] for row in rows], dtype=np.int32),
+                [row[3] for row in rows],
+                np.concatenate([[0], np.cumsum(lengths)]),
+                [a for row in rows for a in row[4]],
+                3,
+                0.9,
+                use_seq_num_diff_as_time_diff,
+            )
+            expected = self._expected(rows, 0.9, use_seq_num_diff_as_time_diff)
+            self.assertEqual(sorted(timeline.rows.tolist()), sorted(expected))
+            for t, row in enumerate(timeline.rows):
+                next_row, next_action, time_diff, pna, value = expected[row]
+                self.assertEqual(timeline.next_rows[t], next_row)
+                self.assertEqual(timeline.next_actions[t], next_action)
+                self.assertEqual(timeline.not_terminals[t], next_action >= 0)
+                self.assertEqual(timeline.time_diffs[t], time_diff)
+                self.assertEqual(
+                    np.flatnonzero(timeline.possible_next_actions[t]).tolist(),
+                    sorted(pna),
+                )
+                self.assertAlmostEqual(timeline.episode_values[t], value, places=4)
+
+    def test_long_mdp_is_stable(self):
+        rewards = np.ones(100000)
+        discounts = np.full(100000, 0.999)
+        sums = discounted_suffix_sums(rewards, discounts)
+        expected = (1 - 0.999 ** np.arange(100000, 0, -1)) / (1 - 0.999)
+        np.testing.assert_allclose(sums, expected, rtol=1e-9)
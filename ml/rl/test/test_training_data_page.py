@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+
+import unittest
+
+import numpy as np
+from ml.rl.training.training_data_page import PackedTrainingDataPage, TrainingDataPage
+
+
+class TestTrainingDataPage(unittest.TestCase):
+    def _page(self, num_rows=10):
+        random = np.random.RandomState(0)
+        return TrainingDataPage(
+            states=random.normal(size=(num_rows, 5)).astype(np.float32),
+            actions=np.eye(3, dtype=np.float32)[random.randint(3, size=num_rows)],
+            rewards=random.normal(size=num_rows).astype(np.float32),
+            next_states=random.normal(size=(num_rows, 5)).astype(np.float16),
+            not_terminals=random.randint(2, size=(num_rows, 1)).astype(np.bool_),
+            time_diffs=np.ones(num_rows, dtype=np.int64),
+        )
+
+    def _assert_pages_equal(self, page, expected):
+        for field in TrainingDataPage.__slots__:
+            if getattr(expected, field) is None:
+                self.assertIsNone(getattr(page, field))
+            else:
+                np.testing.assert_array_equal(
+                    getattr(page, field), getattr(expected, field)
+                )
+
+    def test_size_and_sub_page(self):
+        page = self._page()
+        self.assertEqual(page.size(), 10)
+        page.possible_next_actions = np.ones((10, 3), dtype=np.float32)
+        sub_page = page.get_sub_page(2, 6)
+        self.assertEqual(sub_page.size(), 4)
+        self.assertIsNone(sub_page.next_state_pnas_concat)
+        self.assertIsNone(sub_page.propensities)
+        self.assertEqual(sub_page.possible_next_actions.shape, (4, 3))
+
+    def test_packed_page(self):
+        page = self._page()
+        packed = PackedTrainingDataPage.from_page(page)
+        self._assert_pages_equal(packed, page)
+        self.assertEqual(packed.size(), 10)
+        self.assertEqual(packed.buffer.shape[1] % 8, 0)
+        for field in packed.schema:
+            self.assertTrue(np.shares_memory(getattr(packed, field), packed.buffer))
+
+        sub_page = packed.get_sub_page(3, 7)
+        self.assertTrue(np.shares_memory(sub_page.buffer, packed.buffer))
+        self._assert_pages_equal(sub_page, page.get_sub_page(3, 7))
+
+        shuffled = packed.shuffle(np.random.RandomState(1))
+        order = np.random.RandomState(1).permutation(10)
+        self.assertFalse(np.shares_memory(shuffled.buffer, packed.buffer))
+        np.testing.assert_array_equal(shuffled.states, page.states[order])
+        np.testing.assert_array_equal(shuffled.not_terminals, page.not_terminals[order])
+
+    def test_packed_page_to_device(self):
+        import torch
+
+        page = self._page()
+        packed = PackedTrainingDataPage.from_page(page).get_sub_page(2, 8)
+        tensors = packed.to("cpu")
+        self.assertEqual(set(tensors.keys()), set(packed.schema.keys()))
+        device_buffer = tensors["states"]
+        for field, tensor in tensors.items():
+            # Every field views the one transferred buffer
+            self.assertEqual(
+                tensor.storage().data_ptr(), device_buffer.storage().data_ptr()
+            )
+            np.testing.assert_array_equal(tensor.numpy(), getattr(page, field)[2:8])
@@ -2,6 +2,7 @@
 
 import unittest
 
+import numpy as np
 from ml.rl.preprocessing import identify_types
 from ml.rl.test import preprocessing_util
 
@@ -33,3 +34,30 @@ class TestTypeIdentification(unittest.TestCase):
         self.assertEqual(
             types[identify_types.PROBABILITY], identify_types.PROBABILITY
         )
+
+    def test_dense_identification_matches_per_feature(self):
+        features, feature_value_map = preprocessing_util.read_data()
+        matrix = np.stack([feature_value_map[f] for f in features], axis=1)
+        # Edge cases: constant, negative integers, too many distinct integers
+        extra_columns = [
+            np.full(matrix.shape[0], 7.0),
+            np.arange(matrix.shape[0]) % 50 - 25.0,
+            np.arange(matrix.shape[0], dtype=np.float64),
+            np.arange(matrix.shape[0]) % 1001 * 1.0,
+        ]
+        matrix = np.concatenate(
+            [matrix, np.stack(extra_columns, axis=1).astype(np.float32)], axis=1
+        )
+
+        expected = [
+            identify_types.identify_type(matrix[:, i])
+            for i in range(matrix.shape[1])
+        ]
+        self.assertEqual(identify_types.identify_types_dense(matrix), expected)
+        self.assertEqual(
+            identify_types.identify_types_dense(matrix, enum_threshold=5),
+            [
+                identify_types.identify_type(matrix[:, i], enum_threshold=5)
+                for i in range(matrix.shape[1])
+            ],
+        )
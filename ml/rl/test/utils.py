@@ -1,7 +1,10 @@
 #!/usr/bin/env python3
 
 import collections
+import multiprocessing
+from typing import Any, Callable, List, Sequence
 
+import numpy as np
 from ml.rl.preprocessing.normalization import NormalizationParameters
 
 
@@ -26,3 +29,29 @@ def default_normalizer(feats, min_value=None, max_value=None):
         ]
     )
     return normalization
+
+
+def shard_seeds(seed: int, num_shards: int) -> List[int]:
+    """Derives one seed per shard from `seed`."""
+    return np.random.RandomState(seed).randint(2 ** 31, size=num_shards).tolist()
+
+
+def run_shards(function: Callable, shard_args: Sequence, num_workers: int) -> List[Any]:
+    """
+    Returns [function(args) for args in shard_args], computed on a pool of
+    `num_workers` processes. With 1 worker the shards run in-process and the
+    global NumPy random state is restored afterwards, so a function that
+    seeds it gives the same results either way.
+    """
+    if num_workers == 1:
+        random_state = np.random.get_state()
+        try:
+            return [function(args) for args in shard_args]
+        finally:
+            np.random.set_state(random_state)
+    pool = multiprocessing.Pool(num_workers)
+    try:
+        return pool.map(function, shard_args)
+    finally:
+        pool.close()
+        pool.join()
@@ -97,7 +97,10 @@ class ContinuousActionDQNTrainer(RLTrainer):
             model, state_action_pairs, q_values, False
         )
 
-        self.loss_blob = self.ml_trainer.generateLossOps(model, q_values, q_vals_target)
+        self.loss_blob = self.ml_trainer.generateLossOps(
+            model, q_values, q_vals_target, "importance_weights"
+        )
+        self.td_error_blob = C2.Sub(q_vals_target, q_values)
         model.AddGradientOperators([self.loss_blob])
         for param in model.params:
             if param in model.param_to_grad:
@@ -6,7 +6,6 @@ from typing import Dict
 import numpy as np
 import torch
 import torch.nn as nn
-import torch.nn.functional as F
 import torch.nn.init as init
 from ml.rl.preprocessing.normalization import (
     NormalizationParameters,
@@ -18,6 +17,7 @@ from ml.rl.training.rl_trainer_pytorch import (
     DEFAULT_ADDITIONAL_FEATURE_TYPES,
     RLTrainer,
     rescale_torch_tensor,
+    weighted_mse_loss,
 )
 from ml.rl.training.training_data_page import TrainingDataPage
 from torch.autograd import Variable
@@ -157,7 +157,12 @@ class DDPGTrainer(RLTrainer):
             target_q_values = rewards
         # compute loss and update the critic network
         critic_predictions = q_s1_a1.squeeze()
-        loss_critic = F.mse_loss(critic_predictions, target_q_values)
+        loss_critic = weighted_mse_loss(
+            critic_predictions,
+            target_q_values,
+            self._importance_weights(training_samples),
+        )
+        self.td_errors = (target_q_values - critic_predictions).detach().cpu().numpy()
         self.critic_optimizer.zero_grad()
         loss_critic.backward()
         self.critic_optimizer.step()
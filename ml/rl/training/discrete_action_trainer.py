@@ -120,7 +120,10 @@ class DiscreteActionTrainer(RLTrainer):
         q_val_select = C2.ReduceBackSum(C2.Mul(output_blob, actions))
         q_values = C2.ExpandDims(q_val_select, dims=[1])
 
-        self.loss_blob = self.ml_trainer.generateLossOps(model, q_values, q_vals_target)
+        self.loss_blob = self.ml_trainer.generateLossOps(
+            model, q_values, q_vals_target, "importance_weights"
+        )
+        self.td_error_blob = C2.Sub(q_vals_target, q_values)
         model.AddGradientOperators([self.loss_blob])
         for param in model.params:
             if param in model.param_to_grad:
@@ -105,7 +105,9 @@ class DQNPredictor(RLPredictor):
             C2.net().Copy(["input/float_features.values"], [input_feature_values])
 
         if state_normalization_parameters is not None:
-            preprocessor = PreprocessorNet(clip_anomalies=True)
+            preprocessor = PreprocessorNet(
+                clip_anomalies=True, enum_as_index=trainer.enum_as_index
+            )
             state_normalized_dense_matrix, new_parameters = preprocessor.normalize_sparse_matrix(
                 input_feature_lengths,
                 input_feature_keys,
@@ -10,6 +10,7 @@ from torch.autograd import Variable
 
 from ml.rl.preprocessing.normalization import (
     NormalizationParameters,
+    get_enum_index_columns,
     get_num_output_features,
 )
 from ml.rl.thrift.core.ttypes import (
@@ -20,8 +21,9 @@ from ml.rl.training.dqn_predictor import DQNPredictor
 from ml.rl.training.evaluator import Evaluator
 from ml.rl.training.rl_trainer_pytorch import (
     DEFAULT_ADDITIONAL_FEATURE_TYPES,
-    GenericFeedForwardNetwork,
     RLTrainer,
+    build_feed_forward_network,
+    weighted_mse_loss,
 )
 from ml.rl.training.training_data_page import TrainingDataPage
 
@@ -33,7 +35,13 @@ class DQNTrainer(RLTrainer):
         state_normalization_parameters: Dict[int, NormalizationParameters],
         use_gpu=False,
         additional_feature_types: AdditionalFeatureTypes = DEFAULT_ADDITIONAL_FEATURE_TYPES,
+        enum_embedding_dim: Optional[int] = None,
     ) -> None:
+        """
+        :param enum_embedding_dim: If set, training data is expected to be
+            normalized with `enum_as_index` and ENUM features are fed through
+            embeddings of this width instead of one-hot columns.
+        """
 
         self.warm_start_model_path = parameters.training.warm_start_model_path
         self.minibatch_size = parameters.training.minibatch_size
@@ -45,20 +53,30 @@ class DQNTrainer(RLTrainer):
                 i = self._actions.index(k)
                 self.reward_shape[i] = parameters.rl.reward_boost[k]
 
+        enum_columns = None
         if parameters.training.cnn_parameters is None:
             self.state_normalization_parameters: Optional[
                 Dict[int, NormalizationParameters]
             ] = state_normalization_parameters
-            self.num_features = get_num_output_features(state_normalization_parameters)
+            self.enum_as_index = enum_embedding_dim is not None
+            self.num_features = get_num_output_features(
+                state_normalization_parameters, self.enum_as_index
+            )
+            if self.enum_as_index:
+                enum_columns = get_enum_index_columns(state_normalization_parameters)
             parameters.training.layers[0] = self.num_features
         else:
             self.state_normalization_parameters = None
+            self.enum_as_index = False
         parameters.training.layers[-1] = self.num_actions
 
         RLTrainer.__init__(self, parameters, use_gpu, additional_feature_types)
 
-        self.q_network = GenericFeedForwardNetwork(
-            parameters.training.layers, parameters.training.activations
+        self.q_network = build_feed_forward_network(
+            parameters.training.layers,
+            parameters.training.activations,
+            enum_columns,
+            enum_embedding_dim,
         )
         self.q_network_target = deepcopy(self.q_network)
         self._set_optimizer(parameters.training.optimizer)
@@ -66,8 +84,11 @@ class DQNTrainer(RLTrainer):
             self.q_network.parameters(), lr=parameters.training.learning_rate
         )
 
-        self.reward_network = GenericFeedForwardNetwork(
-            parameters.training.layers, parameters.training.activations
+        self.reward_network = build_feed_forward_network(
+            parameters.training.layers,
+            parameters.training.activations,
+            enum_columns,
+            enum_embedding_dim,
         )
         self.reward_network_optimizer = self.optimizer_func(
             self.reward_network.parameters(), lr=parameters.training.learning_rate
@@ -165,8 +186,11 @@ class DQNTrainer(RLTrainer):
         self.all_action_scores = deepcopy(all_q_values.detach())
         q_values = torch.sum(all_q_values * actions, 1)
 
-        loss = F.mse_loss(q_values, target_q_values)
+        loss = weighted_mse_loss(
+            q_values, target_q_values, self._importance_weights(training_samples)
+        )
         self.loss = loss.detach()
+        self.td_errors = (target_q_values - q_values).detach().cpu().numpy()
 
         self.q_network_optimizer.zero_grad()
         loss.backward()
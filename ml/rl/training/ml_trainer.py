@@ -1,7 +1,7 @@
 #!/usr/bin/env python3
 
 
-from typing import List
+from typing import List, Optional
 
 from enum import Enum
 
@@ -43,7 +43,11 @@ class MLTrainer(DNN):
         DNN.__init__(self, name, parameters)
 
     def generateLossOps(
-        self, model: ModelHelper, output_blob: str, label_blob: str
+        self,
+        model: ModelHelper,
+        output_blob: str,
+        label_blob: str,
+        weight_blob: Optional[str] = None,
     ) -> str:
         """
         Adds loss operators to net. The loss function is computed by a squared L2
@@ -54,10 +58,14 @@ class MLTrainer(DNN):
         :param output_blob: Blob containing output of net.
         :param label_blob: Blob containing labels.
         :param loss_blob: Blob in which to store loss.
+        :param weight_blob: Optional blob with the weight of every item's
+            distance in the average.
         """
         dist = model.SquaredL2Distance(
             [label_blob, output_blob], model.net.NextBlob("dist")
         )
+        if weight_blob is not None:
+            dist = model.net.Mul([dist, weight_blob], model.net.NextBlob("dist"))
         loss = model.net.NextBlob("loss")
         model.AveragedLoss(dist, loss)
         return loss
@@ -127,7 +127,9 @@ class ParametricDQNPredictor(RLPredictor):
             C2.net().Copy(["input/float_features.keys"], [input_feature_keys])
             C2.net().Copy(["input/float_features.values"], [input_feature_values])
 
-        preprocessor = PreprocessorNet(clip_anomalies=True)
+        preprocessor = PreprocessorNet(
+            clip_anomalies=True, enum_as_index=trainer.enum_as_index
+        )
 
         state_normalized_dense_matrix, new_parameters = preprocessor.normalize_sparse_matrix(
             input_feature_lengths,
@@ -11,6 +11,7 @@ from torch.autograd import Variable
 from ml.rl.caffe_utils import StackedArray, WeightedEmbeddingBag
 from ml.rl.preprocessing.normalization import (
     NormalizationParameters,
+    get_enum_index_columns,
     get_num_output_features,
 )
 from ml.rl.thrift.core.ttypes import (
@@ -19,8 +20,9 @@ from ml.rl.thrift.core.ttypes import (
 )
 from ml.rl.training.rl_trainer_pytorch import (
     DEFAULT_ADDITIONAL_FEATURE_TYPES,
-    GenericFeedForwardNetwork,
     RLTrainer,
+    build_feed_forward_network,
+    weighted_mse_loss,
 )
 from ml.rl.training.evaluator import Evaluator
 from ml.rl.training.parametric_dqn_predictor import ParametricDQNPredictor
@@ -35,15 +37,32 @@ class ParametricDQNTrainer(RLTrainer):
         action_normalization_parameters: Dict[int, NormalizationParameters],
         use_gpu=False,
         additional_feature_types: AdditionalFeatureTypes = DEFAULT_ADDITIONAL_FEATURE_TYPES,
+        enum_embedding_dim: Optional[int] = None,
     ) -> None:
+        """
+        :param enum_embedding_dim: If set, states and actions are expected to
+            be normalized with `enum_as_index` and ENUM features are fed
+            through embeddings of this width instead of one-hot columns.
+        """
 
         self.warm_start_model_path = parameters.training.warm_start_model_path
         self.minibatch_size = parameters.training.minibatch_size
         self.state_normalization_parameters = state_normalization_parameters
         self.action_normalization_parameters = action_normalization_parameters
-        self.num_features = get_num_output_features(
-            state_normalization_parameters
-        ) + get_num_output_features(action_normalization_parameters)
+        self.enum_as_index = enum_embedding_dim is not None
+        num_state_features = get_num_output_features(
+            state_normalization_parameters, self.enum_as_index
+        )
+        self.num_features = num_state_features + get_num_output_features(
+            action_normalization_parameters, self.enum_as_index
+        )
+        enum_columns = None
+        if self.enum_as_index:
+            enum_columns = get_enum_index_columns(
+                state_normalization_parameters
+            ) + get_enum_index_columns(
+                action_normalization_parameters, num_state_features
+            )
 
         # ensure state and action IDs have no intersection
         overlapping_features = set(state_normalization_parameters.keys()) & set(
@@ -59,8 +78,11 @@ class ParametricDQNTrainer(RLTrainer):
 
         RLTrainer.__init__(self, parameters, use_gpu, additional_feature_types)
 
-        self.q_network = GenericFeedForwardNetwork(
-            parameters.training.layers, parameters.training.activations
+        self.q_network = build_feed_forward_network(
+            parameters.training.layers,
+            parameters.training.activations,
+            enum_columns,
+            enum_embedding_dim,
         )
         self.q_network_target = deepcopy(self.q_network)
         self._set_optimizer(parameters.training.optimizer)
@@ -68,8 +90,11 @@ class ParametricDQNTrainer(RLTrainer):
             self.q_network.parameters(), lr=parameters.training.learning_rate
         )
 
-        self.reward_network = GenericFeedForwardNetwork(
-            parameters.training.layers, parameters.training.activations
+        self.reward_network = build_feed_forward_network(
+            parameters.training.layers,
+            parameters.training.activations,
+            enum_columns,
+            enum_embedding_dim,
         )
         self.reward_network_optimizer = self.optimizer_func(
             self.reward_network.parameters(), lr=parameters.training.learning_rate
@@ -159,8 +184,12 @@ class ParametricDQNTrainer(RLTrainer):
         q_values = self.q_network(state_action_pairs)
         self.all_action_scores = deepcopy(q_values.detach())
 
-        value_loss = F.mse_loss(q_values.squeeze(), target_q_values)
+        q_values = q_values.squeeze()
+        value_loss = weighted_mse_loss(
+            q_values, target_q_values, self._importance_weights(training_samples)
+        )
         self.loss = value_loss.detach()
+        self.td_errors = (target_q_values - q_values).detach().cpu().numpy()
 
         self.q_network_optimizer.zero_grad()
         value_loss.backward()
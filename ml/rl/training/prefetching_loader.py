@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+
+import logging
+import queue
+import threading
+import time
+from typing import Any, Callable, Iterable, Optional
+
+
+logger = logging.getLogger(__name__)
+
+# Batches built ahead of the one being trained on
+DEFAULT_NUM_PREFETCH = 2
+# How often a blocked worker checks whether the loader was closed
+_POLL_SECONDS = 0.1
+_END = object()
+
+
+class PrefetchingLoader(object):
+    def __init__(
+        self,
+        batches: Iterable,
+        num_prefetch: int = DEFAULT_NUM_PREFETCH,
+        transform: Optional[Callable[[Any], Any]] = None,
+    ) -> None:
+        """
+        Builds batches (usually TrainingDataPages) on a worker thread while
+        the current one trains. The worker stays at most `num_prefetch`
+        batches ahead and blocks once that many are waiting, so a fast
+        producer never piles up pages in memory.
+
+        The time the trainer spends waiting for a batch is recorded in
+        `wait_seconds`, and the time the worker spends building batches in
+        `produce_seconds`. Waits close to the build time mean the input is
+        the bottleneck; waits close to zero mean training is.
+
+        :param batches: Iterable of batches, consumed on the worker thread.
+        :param num_prefetch: Maximum number of batches built ahead.
+        :param transform: Optional function applied to every batch on the
+            worker thread, e.g. to reshape or convert a TrainingDataPage.
+        """
+        assert num_prefetch > 0, "num_prefetch must be positive"
+        self.batches = batches
+        self.num_prefetch = num_prefetch
+        self.transform = transform
+        self.num_batches = 0
+        self.wait_seconds = 0.0
+        self.produce_seconds = 0.0
+        self._queue: Optional[queue.Queue] = None
+        self._stop: Optional[threading.Event] = None
+        self._thread: Optional[threading.Thread] = None
+
+    @classmethod
+    def from_function(
+        cls,
+        produce: Callable[[], Any],
+        num_prefetch: int = DEFAULT_NUM_PREFETCH,
+        transform: Optional[Callable[[Any], Any]] = None,
+    ) -> "PrefetchingLoader":
+        """Loads an endless stream of `produce()` batches."""
+        return cls(iter(produce, _END), num_prefetch, transform)
+
+    def start(self) -> "PrefetchingLoader":
+        """Starts the worker over `batches`, if it is not running yet."""
+        if self._thread is None:
+            self._queue = queue.Queue(self.num_prefetch)
+            self._stop = threading.Event()
+            self._thread = threading.Thread(
+                target=self._produce, args=(self._queue, self._stop), daemon=True
+            )
+            self._thread.start()
+        return self
+
+    def _produce(self, batch_queue: queue.Queue, stop: threading.Event) -> None:
+        def put(item) -> bool:
+            while not stop.is_set():
+                try:
+                    batch_queue.put(item, timeout=_POLL_SECONDS)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        try:
+            iterator = iter(self.batches)
+            while not stop.is_set():
+                start_time = time.time()
+                batch = next(iterator, _END)
+                if batch is _END:
+                    break
+                if self.transform is not None:
+                    batch = self.transform(batch)
+                self.produce_seconds += time.time() - start_time
+                if not put((batch, None)):
+                    return
+        except BaseException as e:
+            logger.exception("Failed to build a batch")
+            put((_END, e))
+            return
+        put((_END, None))
+
+    def get(self) -> Any:
+        """
+        Returns the next batch, starting the worker if needed. Raises
+        StopIteration once `batches` is exhausted, and re-raises errors of
+        the worker.
+        """
+        self.start()
+        assert self._queue is not None
+        start_time = time.time()
+        batch, error = self._queue.get()
+        self.wait_seconds += time.time() - start_time
+        if batch is _END:
+            self._thread = None
+            if error is not None:
+                raise error
+            raise StopIteration
+        self.num_batches += 1
+        return batch
+
+    def __iter__(self):
+        try:
+            while True:
+                try:
+                    batch = self.get()
+                except StopIteration:
+                    return
+                yield batch
+        finally:
+            self.close()
+
+    def close(self) -> None:
+        """Stops the worker. Batches built ahead are dropped."""
+        if self._stop is not None:
+            self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self._queue = None
+        self._stop = None
+        self._thread = None
+
+    def log_report(self) -> None:
+        num_batches = max(1, self.num_batches)
+        logger.info(
+            "Loaded {} batches: waited {:.2f}ms per batch for data, building "
+            "took {:.2f}ms per batch".format(
+                self.num_batches,
+                1000 * self.wait_seconds / num_batches,
+                1000 * self.produce_seconds / num_batches,
+            )
+        )
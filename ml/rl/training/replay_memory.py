@@ -0,0 +1,468 @@
+#!/usr/bin/env python3
+
+import threading
+from typing import Dict, List, Optional
+
+import numpy as np
+from ml.rl.preprocessing.timeline import discounted_suffix_sums
+from ml.rl.training.replay_storage import ColumnStorage
+from ml.rl.training.training_data_page import TrainingDataPage
+
+
+# Below this fraction of the memory, minibatches are drawn by rejecting
+# repeated indices instead of permuting every stored transition
+_REJECTION_SAMPLING_FRACTION = 0.25
+
+
+def sample_without_replacement(population: int, num_samples: int) -> np.ndarray:
+    """
+    Returns min(num_samples, population) distinct indices in
+    [0, population) in random order, without the O(population) permutation
+    when only a few of them are needed.
+    """
+    if num_samples >= population * _REJECTION_SAMPLING_FRACTION:
+        return np.random.permutation(population)[:num_samples]
+    indices = np.random.randint(population, size=num_samples)
+    while True:
+        _, first = np.unique(indices, return_index=True)
+        if len(first) == num_samples:
+            return indices
+        indices = np.concatenate(
+            [
+                indices[np.sort(first)],
+                np.random.randint(population, size=num_samples - len(first)),
+            ]
+        )
+
+
+class ReplayMemory(object):
+    def __init__(
+        self,
+        capacity: int,
+        reservoir: bool = True,
+        max_possible_actions: Optional[int] = None,
+        n_step: int = 1,
+        gamma: float = 1.0,
+        storage: Optional[ColumnStorage] = None,
+    ) -> None:
+        """
+        Fixed-capacity replay memory stored as one preallocated array per
+        transition field. Columns are allocated on the first insert, from the
+        shapes of its state, action and possible next actions, and sampling
+        gathers a minibatch with one fancy index per column. States are kept
+        in the type of the first one if float32 holds it exactly (e.g. uint8
+        image frames), and in float32 otherwise.
+
+        With `n_step` > 1 every stored transition spans up to n inserted ones:
+        its reward is their discounted sum, its next state (and next action,
+        terminal and possible next actions) those of the last one, and its
+        time diff the sum of theirs. Transitions near the end of an episode
+        span fewer. Trainers discount the next state's value by
+        gamma ^ time_diff only if `use_seq_num_diff_as_time_diff` is set.
+
+        Inserting, sampling and updating priorities hold one lock, so pages
+        can be sampled on a prefetching thread: a page never mixes fields of
+        different transitions, but it can miss transitions inserted after it
+        was sampled.
+
+        :param capacity: Maximum number of stored transitions. A memory of
+            capacity 0 stores nothing, e.g. for environments that only
+            generate samples.
+        :param reservoir: Once full, overwrite a random slot at the insertion
+            rate of reservoir sampling, so the memory stays a uniform sample
+            of every transition inserted so far. Otherwise overwrite the
+            oldest transition, like a ring buffer.
+        :param max_possible_actions: Maximum number of rows of a possible next
+            actions matrix (parametric actions). Defaults to the action
+            width.
+        :param n_step: Number of inserted transitions stored as one.
+        :param gamma: Discount of the rewards summed into n-step transitions.
+        :param storage: Where the columns are kept, in RAM by default. See
+            `MemoryMappedColumnStorage` for memories larger than RAM.
+        """
+        assert capacity >= 0, "capacity must not be negative"
+        assert n_step > 0, "n_step must be positive"
+        self.capacity = capacity
+        self.reservoir = reservoir
+        self.max_possible_actions = max_possible_actions
+        self.n_step = n_step
+        self.gamma = gamma
+        self.storage = storage if storage is not None else ColumnStorage()
+        self._lock = threading.RLock()
+        # Inserted transitions waiting for the ones after them, n-step only
+        self._pending: List[tuple] = []
+        self.size = 0
+        # Number of transitions ever inserted, stored or not
+        self.memory_num = 0
+        self.skip_insert_until = capacity
+        self.columns: Dict[str, np.ndarray] = {}
+        # Whether possible next actions are matrices with one row per action
+        # (parametric) rather than one mask per transition (discrete)
+        self.parametric = False
+
+    def __len__(self) -> int:
+        return self.size
+
+    def _allocate(self, state, action, possible_next_actions) -> None:
+        state = np.asarray(state)
+        state_dtype = state.dtype
+        if not np.can_cast(state_dtype, np.float32):
+            state_dtype = np.float32
+        action = np.asarray(action, dtype=np.float32)
+        specs = [
+            ("states", state.shape, state_dtype),
+            ("actions", action.shape, np.float32),
+            ("rewards", (), np.float32),
+            ("next_states", state.shape, state_dtype),
+            ("next_actions", action.shape, np.float32),
+            ("terminals", (), np.bool_),
+            ("possible_next_actions_lengths", (), np.int32),
+            ("time_diffs", (), np.int32),
+        ]
+        if possible_next_actions is not None:
+            possible_next_actions = np.asarray(possible_next_actions, np.float32)
+            self.parametric = (
+                possible_next_actions.ndim == 2 or possible_next_actions.size == 0
+            )
+            if self.parametric:
+                max_rows = self.max_possible_actions or action.size
+                shape = (max_rows, action.size)
+            else:
+                shape = possible_next_actions.shape
+            specs.append(("possible_next_actions", shape, np.float32))
+        for name, shape, dtype in specs:
+            self.columns[name] = self.storage.allocate(
+                name, self.capacity, shape, dtype
+            )
+
+    def _next_slot(self) -> Optional[int]:
+        """
+        Slot of the next transition, or None if it should not be stored.
+        """
+        if self.memory_num < self.capacity:
+            return self.memory_num
+        if not self.reservoir:
+            return self.memory_num % self.capacity
+        if self.memory_num >= self.skip_insert_until:
+            p = float(self.capacity) / self.memory_num
+            self.skip_insert_until += np.random.geometric(p)
+            return np.random.randint(self.capacity)
+        return None
+
+    def insert(
+        self,
+        state,
+        action,
+        reward,
+        next_state,
+        next_action,
+        terminal,
+        possible_next_actions,
+        possible_next_actions_lengths,
+        time_diff,
+    ) -> None:
+        """
+        Inserts a transition. With n-step transitions it is stored once the
+        n - 1 transitions after it, or the end of its episode, are inserted.
+        """
+        transition = (
+            state,
+            action,
+            reward,
+            next_state,
+            next_action,
+            terminal,
+            possible_next_actions,
+            possible_next_actions_lengths,
+            time_diff,
+        )
+        with self._lock:
+            if self.n_step == 1:
+                self._store(*transition)
+                return
+            self._pending.append(transition)
+            if terminal:
+                self.end_episode()
+            elif len(self._pending) == self.n_step:
+                self._store_pending(1)
+
+    def end_episode(self) -> None:
+        """
+        Stores the n-step transitions still waiting at the end of an episode,
+        which terminal transitions do on their own. Call it when an episode
+        is cut short, so that its transitions do not run into the next one.
+        """
+        with self._lock:
+            self._store_pending(len(self._pending))
+
+    def _store_pending(self, count: int) -> None:
+        """
+        Stores the first `count` pending transitions, each summed with every
+        pending transition after it.
+        """
+        if count == 0:
+            return
+        pending = self._pending
+        time_diffs = np.array([t[8] for t in pending], dtype=np.int64)
+        rewards = discounted_suffix_sums(
+            [t[2] for t in pending], np.power(self.gamma, time_diffs)
+        )
+        spans = np.cumsum(time_diffs[::-1])[::-1]
+        last = pending[-1]
+        for i in range(count):
+            self._store(pending[i][0], pending[i][1], rewards[i], *last[3:8], spans[i])
+        del pending[:count]
+
+    def _store(
+        self,
+        state,
+        action,
+        reward,
+        next_state,
+        next_action,
+        terminal,
+        possible_next_actions,
+        possible_next_actions_lengths,
+        time_diff,
+    ) -> Optional[int]:
+        """
+        Stores a transition and returns its slot, or None if reservoir
+        sampling skipped it.
+        """
+        if self.capacity == 0:
+            self.memory_num += 1
+            return None
+        if not self.columns:
+            self._allocate(state, action, possible_next_actions)
+        slot = self._next_slot()
+        self.memory_num += 1
+        if slot is None:
+            return None
+
+        columns = self.columns
+        columns["states"][slot] = state
+        columns["actions"][slot] = action
+        columns["rewards"][slot] = reward
+        columns["next_states"][slot] = next_state
+        columns["next_actions"][slot] = next_action
+        columns["terminals"][slot] = terminal
+        columns["possible_next_actions_lengths"][slot] = possible_next_actions_lengths
+        columns["time_diffs"][slot] = time_diff
+        if "possible_next_actions" in columns:
+            if self.parametric:
+                num_rows = possible_next_actions_lengths
+                matrix = columns["possible_next_actions"][slot]
+                matrix[:num_rows] = np.reshape(
+                    possible_next_actions, (num_rows, matrix.shape[1])
+                )
+                matrix[num_rows:] = 0
+            else:
+                columns["possible_next_actions"][slot] = possible_next_actions
+        self.storage.invalidate(slot)
+        self.size = min(self.size + 1, self.capacity)
+        return slot
+
+    def sample_indices(self, batch_size: int) -> np.ndarray:
+        """Slots of `batch_size` distinct transitions, uniformly at random."""
+        return sample_without_replacement(self.size, batch_size)
+
+    def _gather(self, name: str, indices) -> np.ndarray:
+        return self.storage.gather(name, self.columns[name], indices)
+
+    def get_page(self, indices, state_dtype=np.float32) -> TrainingDataPage:
+        """
+        Gathers the transitions in `indices` into a TrainingDataPage.
+
+        :param state_dtype: Storage type of the state matrices, see
+            `TrainingDataPage.astype_features`.
+        """
+        with self._lock:
+            columns = self.columns
+            gather = self._gather
+            lengths = gather("possible_next_actions_lengths", indices)
+            next_states = gather("next_states", indices).astype(state_dtype, copy=False)
+
+            next_state_pnas_concat = None
+            possible_next_actions = None
+            if "possible_next_actions" in columns:
+                possible_next_actions = gather("possible_next_actions", indices)
+                if self.parametric:
+                    max_rows = possible_next_actions.shape[1]
+                    possible_next_actions = possible_next_actions[
+                        np.arange(max_rows) < lengths[:, np.newaxis]
+                    ]
+                    tiled_states = np.repeat(next_states, lengths, axis=0)
+                    next_state_pnas_concat = np.concatenate(
+                        (tiled_states, possible_next_actions), axis=1
+                    ).astype(state_dtype, copy=False)
+
+            return TrainingDataPage(
+                states=gather("states", indices).astype(state_dtype, copy=False),
+                actions=gather("actions", indices),
+                propensities=None,
+                rewards=gather("rewards", indices),
+                next_states=next_states,
+                next_actions=gather("next_actions", indices),
+                possible_next_actions=possible_next_actions,
+                episode_values=None,
+                not_terminals=np.logical_not(gather("terminals", indices)),
+                time_diffs=gather("time_diffs", indices),
+                possible_next_actions_lengths=lengths,
+                next_state_pnas_concat=next_state_pnas_concat,
+            )
+
+    def sample(self, batch_size: int, state_dtype=np.float32) -> TrainingDataPage:
+        """
+        Samples up to `batch_size` distinct transitions uniformly at random.
+        """
+        with self._lock:
+            return self.get_page(self.sample_indices(batch_size), state_dtype)
+
+
+class SumTree(object):
+    def __init__(self, capacity: int) -> None:
+        """
+        Complete binary tree over `capacity` non-negative leaf values, stored
+        in one array: node i has children 2i and 2i + 1 and leaf j is node
+        `self.leaf_offset + j`. Every node holds the sum of its leaves, so
+        finding the leaf a prefix sum falls in and updating a leaf both walk
+        one root to leaf path. Both work on whole batches at once, one tree
+        level per numpy operation.
+        """
+        self.capacity = capacity
+        self.leaf_offset = 1
+        while self.leaf_offset < capacity:
+            self.leaf_offset *= 2
+        self.nodes = np.zeros(2 * self.leaf_offset, dtype=np.float64)
+
+    @property
+    def total(self) -> float:
+        return self.nodes[1]
+
+    def get(self, indices) -> np.ndarray:
+        return self.nodes[self.leaf_offset + np.asarray(indices)]
+
+    def set(self, index: int, value: float) -> None:
+        """Sets one leaf, cheaper than `update` for a single index."""
+        nodes = self.nodes
+        node = self.leaf_offset + index
+        nodes[node] = value
+        node //= 2
+        while node > 0:
+            nodes[node] = nodes[2 * node] + nodes[2 * node + 1]
+            node //= 2
+
+    def update(self, indices, values) -> None:
+        """Sets the leaves at `indices` to `values` and fixes their sums."""
+        if len(indices) == 0:
+            return
+        nodes = np.unique(self.leaf_offset + np.asarray(indices))
+        self.nodes[self.leaf_offset + np.asarray(indices)] = values
+        while nodes[0] > 1:
+            nodes = np.unique(nodes // 2)
+            self.nodes[nodes] = self.nodes[2 * nodes] + self.nodes[2 * nodes + 1]
+
+    def find(self, prefix_sums) -> np.ndarray:
+        """
+        Returns, for every value in `prefix_sums` (in [0, total)), the leaf j
+        with sum(leaves[:j]) <= value < sum(leaves[:j + 1]).
+        """
+        values = np.array(prefix_sums, dtype=np.float64)
+        nodes = np.ones(len(values), dtype=np.int64)
+        while nodes[0] < self.leaf_offset:
+            left = 2 * nodes
+            left_sums = self.nodes[left]
+            go_right = values >= left_sums
+            values -= np.where(go_right, left_sums, 0.0)
+            nodes = left + go_right
+        # Rounding can step past the last non-empty leaf; clamp back into it
+        leaves = np.minimum(nodes - self.leaf_offset, self.capacity - 1)
+        empty = self.nodes[self.leaf_offset + leaves] == 0
+        if empty.any():
+            non_empty = np.flatnonzero(self.nodes[self.leaf_offset :][: self.capacity])
+            positions = np.searchsorted(non_empty, leaves[empty], side="right")
+            leaves[empty] = non_empty[np.maximum(positions - 1, 0)]
+        return leaves
+
+
+class PrioritizedReplayMemory(ReplayMemory):
+    def __init__(
+        self,
+        capacity: int,
+        alpha: float = 0.6,
+        beta: float = 0.4,
+        epsilon: float = 1e-6,
+        reservoir: bool = True,
+        max_possible_actions: Optional[int] = None,
+        n_step: int = 1,
+        gamma: float = 1.0,
+        storage: Optional[ColumnStorage] = None,
+    ) -> None:
+        """
+        Replay memory that samples transition i with probability proportional
+        to p_i ^ alpha, where p_i is the absolute TD error it had when it was
+        last trained on (Schaul et al., Prioritized Experience Replay). New
+        transitions get the largest priority seen so far, so each is trained
+        on at least once soon after it is inserted. Priorities live in a
+        SumTree, so sampling and updating a batch cost O(batch log capacity).
+
+        Sampled pages carry the slots they came from in `replay_indices`, to
+        pass back to `update_priorities` with the trainer's TD errors, and
+        the importance weights (N P(i)) ^ -beta, divided by the largest one
+        in the batch, that correct the loss for the non-uniform sampling in
+        `importance_weights`.
+
+        :param alpha: How much the TD errors skew sampling, 0 is uniform.
+        :param beta: Importance weight exponent, 1 fully corrects the bias.
+            Usually annealed towards 1 over training by setting `beta`.
+        :param epsilon: Added to the TD errors so that no transition stops
+            being sampled.
+        """
+        super(PrioritizedReplayMemory, self).__init__(
+            capacity, reservoir, max_possible_actions, n_step, gamma, storage
+        )
+        self.alpha = alpha
+        self.beta = beta
+        self.epsilon = epsilon
+        self.max_priority = 1.0
+        self.tree = SumTree(capacity)
+
+    def _store(self, *transition) -> Optional[int]:
+        slot = super(PrioritizedReplayMemory, self)._store(*transition)
+        if slot is not None:
+            self.tree.set(slot, self.max_priority ** self.alpha)
+        return slot
+
+    def sample_indices(self, batch_size: int) -> np.ndarray:
+        """
+        Draws one slot from each of `batch_size` equal slices of the total
+        priority, so high priority transitions can be drawn more than once.
+        """
+        if self.size == 0:
+            return np.zeros(0, dtype=np.int64)
+        segment = self.tree.total / batch_size
+        prefix_sums = (np.arange(batch_size) + np.random.random(batch_size)) * segment
+        return self.tree.find(prefix_sums)
+
+    def get_page(self, indices, state_dtype=np.float32) -> TrainingDataPage:
+        with self._lock:
+            page = super(PrioritizedReplayMemory, self).get_page(indices, state_dtype)
+            probabilities = self.tree.get(indices) / self.tree.total
+            weights = (self.size * probabilities) ** -self.beta
+        if len(weights) > 0:
+            weights /= weights.max()
+        page.importance_weights = weights.astype(np.float32)
+        page.replay_indices = np.asarray(indices)
+        return page
+
+    def update_priorities(self, indices, td_errors) -> None:
+        """
+        Sets the priorities of the transitions at `indices` to the absolute
+        TD errors they were just trained with.
+        """
+        if len(indices) == 0:
+            return
+        priorities = np.abs(np.ravel(td_errors)).astype(np.float64) + self.epsilon
+        with self._lock:
+            self.max_priority = max(self.max_priority, priorities.max())
+            self.tree.update(indices, priorities ** self.alpha)
@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+
+import logging
+import os
+from typing import Dict
+
+import numpy as np
+
+
+logger = logging.getLogger(__name__)
+
+# Rows read from disk at once by a memory-mapped replay memory, and rows of
+# every column it keeps in RAM
+DEFAULT_PAGE_ROWS = 16
+DEFAULT_CACHE_ROWS = 1 << 16
+
+
+class ColumnStorage(object):
+    """
+    Where a ReplayMemory keeps its columns. This one keeps them in RAM;
+    subclasses can keep them elsewhere and change how rows are read back.
+    The memory writes, gathers and invalidates rows under its own lock.
+    """
+
+    def allocate(self, name: str, num_rows: int, shape, dtype) -> np.ndarray:
+        """Returns a zeroed (num_rows,) + shape column."""
+        return np.zeros((num_rows,) + tuple(shape), dtype=dtype)
+
+    def gather(self, name: str, column: np.ndarray, indices) -> np.ndarray:
+        """Returns the rows of `column` at `indices`."""
+        return column[indices]
+
+    def invalidate(self, row: int) -> None:
+        """Called after `row` of every column was written."""
+        pass
+
+
+class _PageCache(object):
+    def __init__(self, column: np.ndarray, page_rows: int, num_pages: int) -> None:
+        """
+        RAM copies of `num_pages` pages (runs of `page_rows` rows) of
+        `column`, replaced first in, first out. The length of `column` must
+        be a multiple of `page_rows`.
+        """
+        self.column = column
+        self.page_rows = page_rows
+        # The column as a (pages, page_rows, ...) array, to read whole pages
+        self.column_pages = column.reshape((-1, page_rows) + column.shape[1:])
+        self.pages = np.zeros(
+            (num_pages, page_rows) + column.shape[1:], dtype=column.dtype
+        )
+        # Cache slot of every page of the column, -1 if it is not cached
+        self.slot_of_page = np.full(len(self.column_pages), -1, dtype=np.int64)
+        # Page in every cache slot, -1 if the slot is empty
+        self.page_in_slot = np.full(num_pages, -1, dtype=np.int64)
+        self.next_slot = 0
+        self.num_page_reads = 0
+        self.num_page_hits = 0
+
+    def gather(self, indices: np.ndarray) -> np.ndarray:
+        pages = np.unique(indices // self.page_rows)
+        cached = self.slot_of_page[pages] >= 0
+        self.num_page_reads += len(pages) - np.count_nonzero(cached)
+        self.num_page_hits += np.count_nonzero(cached)
+        if len(pages) > len(self.pages):
+            # More pages than the cache holds; read the rows themselves
+            order = np.argsort(indices)
+            rows = np.empty((len(indices),) + self.column.shape[1:], self.column.dtype)
+            rows[order] = self.column[indices[order]]
+            return rows
+        self._load(pages[~cached], self.slot_of_page[pages[cached]])
+        slots = self.slot_of_page[indices // self.page_rows]
+        return self.pages[slots, indices % self.page_rows]
+
+    def _load(self, pages: np.ndarray, keep_slots: np.ndarray) -> None:
+        """
+        Reads the sorted, uncached `pages` into the cache in one pass,
+        evicting the oldest pages except those in `keep_slots`.
+        """
+        if len(pages) == 0:
+            return
+        num_slots = len(self.pages)
+        candidates = (self.next_slot + np.arange(num_slots)) % num_slots
+        kept = np.zeros(num_slots, dtype=np.bool_)
+        kept[keep_slots] = True
+        slots = candidates[~kept[candidates]][: len(pages)]
+        self.next_slot = (slots[-1] + 1) % num_slots
+        evicted = self.page_in_slot[slots]
+        self.slot_of_page[evicted[evicted >= 0]] = -1
+        self.page_in_slot[slots] = pages
+        self.slot_of_page[pages] = slots
+        self.pages[slots] = self.column_pages[pages]
+
+    def invalidate(self, row: int) -> None:
+        page = row // self.page_rows
+        slot = self.slot_of_page[page]
+        if slot >= 0:
+            self.slot_of_page[page] = -1
+            self.page_in_slot[slot] = -1
+
+
+class MemoryMappedColumnStorage(ColumnStorage):
+    def __init__(
+        self,
+        path: str,
+        page_rows: int = DEFAULT_PAGE_ROWS,
+        cache_rows: int = DEFAULT_CACHE_ROWS,
+    ) -> None:
+        """
+        Keeps every column in a memory-mapped .npy file under `path`, so a
+        replay memory can hold more transitions (e.g. image frames) than fit
+        in RAM. The files are scratch space and are overwritten.
+
+        Columns are read in pages of `page_rows` rows. A minibatch is grouped
+        by page: the pages it touches that are not in RAM are read in file
+        order, in one pass, into a hot cache of `cache_rows` rows per column,
+        and the minibatch is gathered from the cache with one fancy index.
+        Transitions stored near sampled ones are then gathered from RAM.
+        Writing a row drops its cached pages.
+
+        :param path: Directory of the column files, created if missing.
+        :param page_rows: Rows read at once.
+        :param cache_rows: Rows of every column kept in RAM, rounded up to
+            whole pages. Minibatches touching more pages are read from the
+            files directly.
+        """
+        self.path = path
+        self.page_rows = page_rows
+        self.cache_rows = cache_rows
+        self.columns: Dict[str, np.ndarray] = {}
+        self._caches: Dict[str, _PageCache] = {}
+
+    def allocate(self, name: str, num_rows: int, shape, dtype) -> np.ndarray:
+        os.makedirs(self.path, exist_ok=True)
+        # The file is padded to whole pages so pages are read as blocks
+        num_file_pages = -(-num_rows // self.page_rows)
+        padded = np.lib.format.open_memmap(
+            os.path.join(self.path, "{}.npy".format(name)),
+            mode="w+",
+            dtype=dtype,
+            shape=(num_file_pages * self.page_rows,) + tuple(shape),
+        )
+        num_pages = min(-(-self.cache_rows // self.page_rows), num_file_pages)
+        self._caches[name] = _PageCache(padded, self.page_rows, num_pages)
+        column = padded[:num_rows]
+        self.columns[name] = column
+        return column
+
+    def gather(self, name: str, column: np.ndarray, indices) -> np.ndarray:
+        indices = np.asarray(indices, dtype=np.int64)
+        return self._caches[name].gather(indices)
+
+    def invalidate(self, row: int) -> None:
+        for cache in self._caches.values():
+            cache.invalidate(row)
+
+    def flush(self) -> None:
+        """Writes the columns to their files."""
+        for column in self.columns.values():
+            column.flush()
+
+    @property
+    def num_page_reads(self) -> int:
+        return sum(cache.num_page_reads for cache in self._caches.values())
+
+    @property
+    def num_page_hits(self) -> int:
+        return sum(cache.num_page_hits for cache in self._caches.values())
+
+    def log_report(self) -> None:
+        reads, hits = self.num_page_reads, self.num_page_hits
+        logger.info(
+            "Replay memory pages: {} read from disk, {} found in RAM "
+            "({:.1f}% hits)".format(reads, hits, 100.0 * hits / max(reads + hits, 1))
+        )
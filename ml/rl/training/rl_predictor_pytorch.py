@@ -51,6 +51,8 @@ class RLPredictor:
         ]
         self._parameters = parameters
         self.is_discrete = None
+        # Optional DriftMonitor fed with the float features of every predict
+        self.drift_monitor = None
 
     def predict(self, float_state_features, int_state_features=None):
         """ Returns values for each state
@@ -63,22 +65,18 @@ class RLPredictor:
             for k, v in example.items():
                 float_state_keys.append(k)
                 float_state_values.append(v)
-        workspace.FeedBlob(
-            "input/float_features.lengths",
-            np.array([len(e) for e in float_state_features], dtype=np.int32),
-        )
-        workspace.FeedBlob(
-            "input/float_features.keys",
-            np.array(
-                float_state_keys, dtype=np.int64
-            ),
-        )
-        workspace.FeedBlob(
-            "input/float_features.values",
-            np.array(
-                float_state_values, dtype=np.float32
-            ).flatten(),
+        float_state_lengths = np.array(
+            [len(e) for e in float_state_features], dtype=np.int32
         )
+        float_state_keys = np.array(float_state_keys, dtype=np.int64)
+        float_state_values = np.array(float_state_values, dtype=np.float32).flatten()
+        workspace.FeedBlob("input/float_features.lengths", float_state_lengths)
+        workspace.FeedBlob("input/float_features.keys", float_state_keys)
+        workspace.FeedBlob("input/float_features.values", float_state_values)
+        if self.drift_monitor is not None:
+            self.drift_monitor.observe_sparse(
+                float_state_lengths, float_state_keys, float_state_values
+            )
 
         if int_state_features is not None:
             workspace.FeedBlob(
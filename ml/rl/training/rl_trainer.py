@@ -91,6 +91,12 @@ class RLTrainer:
         self.minibatch_size = parameters.training.minibatch_size
         self.parameters = parameters
         self.loss_blob: Optional[str] = None
+        # Set by update_model to the TD error blob of the net being built
+        self.td_error_blob: Optional[str] = None
+        self.reward_td_error_blob: Optional[str] = None
+        self.rl_td_error_blob: Optional[str] = None
+        # TD errors of the last trained minibatch, for prioritized replay
+        self.td_errors: Optional[np.ndarray] = None
 
         workspace.FeedBlob("states", np.array([0], dtype=np.float32))
         workspace.FeedBlob("actions", np.array([0], dtype=np.float32))
@@ -106,12 +112,15 @@ class RLTrainer:
             workspace.FeedBlob("next_actions", np.array([0], dtype=np.float32))
         # Setting to 1 serves as a 1 unit time_diff if not set by user
         workspace.FeedBlob("time_diff", np.array([1], dtype=np.float32))
+        workspace.FeedBlob("importance_weights", np.array([1], dtype=np.float32))
 
         self.rl_train_model: Optional[ModelHelper] = None
         self.reward_train_model: Optional[ModelHelper] = None
         self.q_score_model: Optional[ModelHelper] = None
         self._create_reward_train_net()
+        self.reward_td_error_blob = self.td_error_blob
         self._create_rl_train_net()
+        self.rl_td_error_blob = self.td_error_blob
         self._create_q_score_net()
         assert self.rl_train_model is not None
         assert self.reward_train_model is not None
@@ -200,15 +209,34 @@ class RLTrainer:
                 workspace.FeedBlob("possible_next_actions", tdp.possible_next_actions)
         else:
             workspace.FeedBlob("next_actions", tdp.next_actions)
-        self.train()
+        self.train(
+            tdp.importance_weights, fetch_td_errors=tdp.replay_indices is not None
+        )
         if evaluator is not None:
             self.evaluate(evaluator, tdp.actions, tdp.propensities, tdp.episode_values)
 
-    def train(self) -> None:
+    def train(
+        self,
+        importance_weights: Optional[np.ndarray] = None,
+        fetch_td_errors: bool = False,
+    ) -> None:
+        """
+        Trains on the minibatch fed to the workspace.
+
+        :param importance_weights: Optional weight of every transition in the
+            loss, e.g. from prioritized replay. Defaults to equal weights.
+        :param fetch_td_errors: Whether to fetch the TD errors of the net that
+            ran into `self.td_errors`, e.g. to update replay priorities.
+        """
         assert self.rl_train_model is not None
         assert self.reward_train_model is not None
         assert self.q_score_model is not None
 
+        if importance_weights is None:
+            batch_size = len(workspace.FetchBlob("states"))
+            importance_weights = np.ones(batch_size, dtype=np.float32)
+        workspace.FeedBlob("importance_weights", importance_weights)
+
         if self.training_iteration >= self.reward_burnin:
             if self.training_iteration == self.reward_burnin:
                 logger.info("Minibatch number == reward_burnin. Starting RL updates.")
@@ -216,8 +244,15 @@ class RLTrainer:
                 if self.conv_target_network:
                     self.conv_target_network.enable_slow_updates()
             workspace.RunNet(self.rl_train_model.net)
+            td_error_blob = self.rl_td_error_blob
         else:
             workspace.RunNet(self.reward_train_model.net)
+            td_error_blob = self.reward_td_error_blob
+
+        if fetch_td_errors:
+            self.td_errors = workspace.FetchBlob(td_error_blob)
+        else:
+            self.td_errors = None
 
         workspace.RunNet(self.target_network._update_model.net)
         if self.conv_target_network:
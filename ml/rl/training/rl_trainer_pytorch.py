@@ -2,6 +2,7 @@
 
 import logging
 import math
+from typing import Optional
 
 import numpy as np
 import torch
@@ -31,6 +32,8 @@ class RLTrainer:
         self.gamma = parameters.rl.gamma
         self.tau = parameters.rl.target_update_rate
         self.use_seq_num_diff_as_time_diff = parameters.rl.use_seq_num_diff_as_time_diff
+        # TD errors of the last trained minibatch, for prioritized replay
+        self.td_errors: Optional[np.ndarray] = None
 
         if use_gpu and torch.cuda.is_available():
             logger.info("Using GPU: GPU requested and available.")
@@ -67,6 +70,11 @@ class RLTrainer:
     def train(self, training_samples, evaluator=None, episode_values=None) -> None:
         raise NotImplementedError()
 
+    def _importance_weights(self, training_samples) -> Optional[torch.Tensor]:
+        if training_samples.importance_weights is None:
+            return None
+        return torch.from_numpy(training_samples.importance_weights).type(self.dtype)
+
     def internal_prediction(self, input):
         """ Q-network forward pass method for internal domains.
         :param input input to network
@@ -88,6 +96,15 @@ class RLTrainer:
         return reward_estimates.cpu().data.numpy()
 
 
+def weighted_mse_loss(input, target, weights=None):
+    """ Mean squared error, with every row's squared error scaled by its weight
+    if `weights` are given (importance weights of prioritized replay).
+    """
+    if weights is None:
+        return F.mse_loss(input, target)
+    return torch.mean(weights * (input - target) ** 2)
+
+
 def guassian_fill_w_gain(tensor, activation, dim_in) -> None:
     """ Gaussian initialization with gain."""
     gain = math.sqrt(2) if activation == "relu" else 1
@@ -145,3 +162,61 @@ class GenericFeedForwardNetwork(nn.Module):
             fc_func = self.layers[i]
             x = fc_func(x) if activation == "linear" else activation_func(fc_func(x))
         return x
+
+
+class EnumEmbedding(nn.Module):
+    def __init__(self, num_input_features, enum_columns, embedding_dim) -> None:
+        """
+        Replaces the ENUM index columns of a matrix normalized with
+        `enum_as_index` by learned embeddings; other columns pass through.
+
+        :param num_input_features: Width of the normalized matrix.
+        :param enum_columns: (column, num_embeddings) pairs, as returned by
+            `normalization.get_enum_index_columns`.
+        :param embedding_dim: Width of each embedding.
+        """
+        super(EnumEmbedding, self).__init__()
+        enum_column_set = {column for column, _ in enum_columns}
+        self.register_buffer(
+            "dense_columns",
+            torch.LongTensor(
+                [i for i in range(num_input_features) if i not in enum_column_set]
+            ),
+        )
+        self.enum_columns = [column for column, _ in enum_columns]
+        self.max_indices = [num_embeddings - 1 for _, num_embeddings in enum_columns]
+        self.embeddings: nn.ModuleList = nn.ModuleList(
+            [
+                nn.Embedding(num_embeddings, embedding_dim)
+                for _, num_embeddings in enum_columns
+            ]
+        )
+        self.output_dim = len(self.dense_columns) + embedding_dim * len(enum_columns)
+
+    def forward(self, input) -> torch.FloatTensor:
+        outputs = [input.index_select(1, self.dense_columns)]
+        for column, max_index, embedding in zip(
+            self.enum_columns, self.max_indices, self.embeddings
+        ):
+            # Clamp so that out-of-range inputs (e.g. the random input used to
+            # trace the net for export) map to valid rows
+            indices = input[:, column].clamp(0, max_index).long()
+            outputs.append(embedding(indices))
+        return torch.cat(outputs, dim=1)
+
+
+def build_feed_forward_network(
+    layers, activations, enum_columns=None, enum_embedding_dim=None
+) -> nn.Module:
+    """
+    GenericFeedForwardNetwork over `layers`, preceded by an EnumEmbedding of
+    `enum_columns` when they are given. layers[0] is the width of the
+    normalized input either way.
+    """
+    if not enum_columns:
+        return GenericFeedForwardNetwork(layers, activations)
+    embedding = EnumEmbedding(layers[0], enum_columns, enum_embedding_dim)
+    return nn.Sequential(
+        embedding,
+        GenericFeedForwardNetwork([embedding.output_dim] + layers[1:], activations),
+    )
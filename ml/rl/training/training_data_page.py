@@ -1,5 +1,15 @@
 #!/usr/bin/env python3
 
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+
+# Normalized state matrices, the largest arrays of a page
+FEATURE_FIELDS = ("states", "next_states", "next_state_pnas_concat")
+# Rows of a PackedTrainingDataPage are padded to a multiple of this
+PACKED_ROW_ALIGNMENT = 8
+
 
 class TrainingDataPage(object):
     __slots__ = [
@@ -15,6 +25,8 @@ class TrainingDataPage(object):
         "not_terminals",
         "time_diffs",
         "next_state_pnas_concat",
+        "importance_weights",
+        "replay_indices",
     ]
 
     def __init__(
@@ -31,12 +43,19 @@ class TrainingDataPage(object):
         time_diffs=None,
         possible_next_actions_lengths=None,
         next_state_pnas_concat=None,
+        importance_weights=None,
+        replay_indices=None,
     ) -> None:
         """
         Creates a TrainingDataPage object.
 
         In the case where `not_terminals` can be determined by next_actions or
         possible_next_actions, feel free to omit it.
+
+        :param importance_weights: Optional weight of every row in the loss,
+            set by prioritized replay to correct its sampling bias.
+        :param replay_indices: Replay memory slots the rows were sampled
+            from, to report their TD errors back to.
         """
         self.states = states
         self.actions = actions
@@ -50,9 +69,23 @@ class TrainingDataPage(object):
         self.time_diffs = time_diffs
         self.possible_next_actions_lengths = possible_next_actions_lengths
         self.next_state_pnas_concat = next_state_pnas_concat
+        self.importance_weights = importance_weights
+        self.replay_indices = replay_indices
+
+    def astype_features(self, dtype) -> "TrainingDataPage":
+        """
+        Stores the normalized state matrices (`states`, `next_states` and
+        `next_state_pnas_concat`) as `dtype`, e.g. np.float16 to halve their
+        memory. Trainers upcast to their own dtype when they build tensors.
+        """
+        for field in FEATURE_FIELDS:
+            value = getattr(self, field)
+            if value is not None:
+                setattr(self, field, value.astype(dtype, copy=False))
+        return self
 
     def size(self) -> int:
-        if self.states:
+        if self.states is not None:
             return len(self.states)
         raise Exception("Cannot get size of TrainingDataPage missing states.")
 
@@ -63,15 +96,15 @@ class TrainingDataPage(object):
                 self.possible_next_actions[0][start:end],
                 self.possible_next_actions[1][start:end],
             )
-        else:
-            sub_pna = (self.possible_next_actions[start:end],)
+        elif self.possible_next_actions is not None:
+            sub_pna = self.possible_next_actions[start:end]
 
         return TrainingDataPage(
             self.states[start:end],
             self.actions[start:end],
-            self.propensities[start:end],
+            None if self.propensities is None else self.propensities[start:end],
             self.rewards[start:end],
-            self.next_states[start:end],
+            None if self.next_states is None else self.next_states[start:end],
             None if self.next_actions is None else self.next_actions[start:end],
             None if self.possible_next_actions is None else sub_pna,
             None if self.episode_values is None else self.episode_values[start:end],
@@ -80,5 +113,149 @@ class TrainingDataPage(object):
             None
             if self.possible_next_actions_lengths is None
             else self.possible_next_actions_lengths[start:end],
-            self.next_state_pnas_concat[start:end],
+            None
+            if self.next_state_pnas_concat is None
+            else self.next_state_pnas_concat[start:end],
+            None
+            if self.importance_weights is None
+            else self.importance_weights[start:end],
+            None if self.replay_indices is None else self.replay_indices[start:end],
+        )
+
+
+# field -> (dtype, shape of one row)
+PageSchema = Dict[str, Tuple[np.dtype, Tuple[int, ...]]]
+
+
+def _packed_layout(schema: PageSchema) -> Tuple[Dict[str, int], int]:
+    """Returns field -> byte offset in a row, and the bytes per row."""
+    offsets = {}
+    row_bytes = 0
+    # Widest dtypes first keeps every field aligned to its item size
+    for field in sorted(schema, key=lambda f: -np.dtype(schema[f][0]).itemsize):
+        dtype, shape = schema[field]
+        offsets[field] = row_bytes
+        row_bytes += np.dtype(dtype).itemsize * int(np.prod(shape, dtype=np.int64))
+    row_bytes = -(-row_bytes // PACKED_ROW_ALIGNMENT) * PACKED_ROW_ALIGNMENT
+    return offsets, row_bytes
+
+
+class PackedTrainingDataPage(TrainingDataPage):
+    __slots__ = ["schema", "buffer"]
+
+    def __init__(
+        self,
+        schema: PageSchema,
+        num_rows: int,
+        pin_memory: bool = False,
+        buffer: Optional[np.ndarray] = None,
+    ) -> None:
+        """
+        A TrainingDataPage whose fields are views into one (num_rows,
+        row_bytes) uint8 buffer, each row holding that row's value of every
+        field. Taking a sub-page slices the buffer, shuffling gathers its
+        rows once, and `to` copies the page to a device as one buffer.
+
+        Only fields with one entry per row can be packed, so pages of
+        parametric models (`next_state_pnas_concat`, or tuple
+        `possible_next_actions`) are not supported. Assigning a field
+        replaces its view with a separate array.
+
+        :param schema: field -> (dtype, shape of one row), see `schema_of`.
+        :param pin_memory: Allocate the buffer in page-locked memory, which
+            makes host to GPU copies faster and lets them run asynchronously.
+            Requires PyTorch.
+        :param buffer: Existing buffer to view instead of allocating one.
+        """
+        super().__init__()
+        self.schema = schema
+        offsets, row_bytes = _packed_layout(schema)
+        if buffer is None:
+            if pin_memory:
+                import torch
+
+                buffer = torch.empty(num_rows, row_bytes, dtype=torch.uint8)
+                buffer = buffer.pin_memory().numpy()
+            else:
+                buffer = np.empty((num_rows, row_bytes), dtype=np.uint8)
+        assert buffer.shape == (num_rows, row_bytes), "Unexpected buffer shape"
+        self.buffer = buffer
+        for field, (dtype, shape) in schema.items():
+            dtype = np.dtype(dtype)
+            start = offsets[field]
+            end = start + dtype.itemsize * int(np.prod(shape, dtype=np.int64))
+            view = buffer[:, start:end].view(dtype).reshape((num_rows,) + shape)
+            setattr(self, field, view)
+
+    @staticmethod
+    def schema_of(tdp: TrainingDataPage) -> PageSchema:
+        """Returns the schema of the fields `tdp` has."""
+        schema = {}
+        for field in TrainingDataPage.__slots__:
+            value = getattr(tdp, field)
+            if value is None:
+                continue
+            assert isinstance(value, np.ndarray), "Cannot pack field {}".format(field)
+            schema[field] = (value.dtype, value.shape[1:])
+        return schema
+
+    @classmethod
+    def from_page(
+        cls, tdp: TrainingDataPage, pin_memory: bool = False
+    ) -> "PackedTrainingDataPage":
+        """Copies the fields of `tdp` into a packed page."""
+        num_rows = tdp.size()
+        packed = cls(cls.schema_of(tdp), num_rows, pin_memory)
+        for field in packed.schema:
+            value = getattr(tdp, field)
+            assert len(value) == num_rows, "Field {} has {} rows, expected {}".format(
+                field, len(value), num_rows
+            )
+            getattr(packed, field)[:] = value
+        return packed
+
+    def size(self) -> int:
+        return len(self.buffer)
+
+    def get_sub_page(self, start, end) -> "PackedTrainingDataPage":
+        """Returns a page viewing rows [start, end) of this one."""
+        buffer = self.buffer[start:end]
+        return PackedTrainingDataPage(self.schema, len(buffer), buffer=buffer)
+
+    def take(self, indices) -> "PackedTrainingDataPage":
+        """Returns a page with copies of the rows at `indices`."""
+        buffer = self.buffer[indices]
+        return PackedTrainingDataPage(self.schema, len(buffer), buffer=buffer)
+
+    def shuffle(self, random_state=np.random) -> "PackedTrainingDataPage":
+        """Returns a copy of this page with its rows in random order."""
+        return self.take(random_state.permutation(self.size()))
+
+    def to(self, device, non_blocking: bool = False) -> Dict:
+        """
+        Copies `buffer` to `device` in a single transfer and returns field ->
+        tensor viewing the copy, with the dtype and shape of the field.
+        Requires PyTorch.
+
+        :param non_blocking: Copy asynchronously, if the page was allocated
+            with `pin_memory`.
+        """
+        import torch
+
+        device_buffer = torch.from_numpy(self.buffer).to(
+            device, non_blocking=non_blocking
         )
+        offsets, _ = _packed_layout(self.schema)
+        num_rows = self.size()
+        tensors = {}
+        for field, (dtype, shape) in self.schema.items():
+            dtype = np.dtype(dtype)
+            start = offsets[field]
+            end = start + dtype.itemsize * int(np.prod(shape, dtype=np.int64))
+            torch_dtype = torch.from_numpy(np.zeros(0, dtype=dtype)).dtype
+            tensors[field] = (
+                device_buffer[:, start:end]
+                .view(torch_dtype)
+                .view((num_rows,) + tuple(shape))
+            )
+        return tensors